@@ -3,6 +3,8 @@
 import cv2
 import mediapipe as mp
 import numpy as np
+from pose_features import full_body_features
+from landmark_recorder import landmarks_to_array
 
 mp_pose = mp.solutions.pose
 mp_drawing = mp.solutions.drawing_utils
@@ -21,7 +23,15 @@ def calculate_angle(a, b, c):
 
     return angle
 
-def get_params(results):
+def get_params(results, all=False):
+    # all=True: the 57 full-body features of pose_features.py for the classifier, or None when no
+    # person is detected. `results` may also be a (33, C) or (N, 33, C) landmark array.
+    if all:
+        if isinstance(results, np.ndarray):
+            return full_body_features(results)
+        if results.pose_landmarks is None:
+            return None
+        return full_body_features(landmarks_to_array(results.pose_landmarks.landmark))
     try:
         landmarks = results.pose_landmarks.landmark
 
@@ -9,7 +9,7 @@ from dash import Dash, html, dcc, Input, Output, State, page_container
 import dash_bootstrap_components as dbc
 import sqlite3
 import pandas as pd
-import bcrypt # For secure password hashing
+from auth_service import auth_service, AuthServiceBusy # bcrypt hashing runs in a bounded worker pool
 from datetime import datetime
 import threading
 import queue
@@ -22,6 +22,21 @@ from threading import Timer
 from app_squat import generate_frames, frame_queue, data_queue, start_session, stop_session, session_active, \
     TARGET_REPS, TARGET_SETS, REST_DURATION_SECONDS, current_set, reps_in_current_set, set_rest_active, \
     save_session_data, exercise_duration, create_sessions_table, get_patient_sessions
+from query_cache import invalidate, cache_stats
+from dashboard_stats import init_stats_schema
+from session_history import ensure_session_indexes, init_angle_summary_table
+from cohort_export import register_export_routes
+from route_auth import init_route_auth, remember_login, forget_login, require_role
+from scheduling import init_scheduling_schema
+from search_index import init_search_index
+from patient_search import ensure_typeahead_indexes
+from write_queue import write_queue
+from landmark_recorder import init_recording_schema
+from skeleton_replay import register_replay_routes
+from rep_segmentation import init_reps_table
+from template_matching import init_template_tables
+from movement_index import init_movement_index, register_similarity_routes
+from flask import jsonify
 
 # Initialize Dash app
 external_stylesheets = [
@@ -97,7 +112,7 @@ def add_user_if_not_exists(username, password, role, name=None, specialty=None):
     user_exists = cursor.fetchone()
 
     if not user_exists:
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        hashed_password = auth_service.hash_password(password)
         cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
                        (username, hashed_password, role))
         user_id = cursor.lastrowid
@@ -109,12 +124,23 @@ def add_user_if_not_exists(username, password, role, name=None, specialty=None):
             # Ensure name and specialty are provided or defaults to username/None
             cursor.execute("INSERT INTO doctors (doctor_id, name, specialty) VALUES (?, ?, ?)", (user_id, name if name else username, specialty))
         conn.commit()
+        invalidate(role, user_id)
         print(f"Added default {role}: {username}")
     conn.close()
 
 # Initialize main database and add default users
 init_main_db()
 create_sessions_table() # Initialize squat app's sessions table (renamed from init_db)
+init_stats_schema() # Doctor dashboard counters + the triggers that maintain them
+ensure_session_indexes() # Keyset pagination over (patient_id, date, session_id)
+init_angle_summary_table() # Per-session joint summaries; backfills older sessions
+init_scheduling_schema() # Typed appointment intervals + (doctor_id, starts_at) / (patient_id, starts_at) indexes
+init_search_index() # FTS5 over session feedback and patient records, kept in sync by triggers
+ensure_typeahead_indexes() # Case-insensitive prefix lookup on patient name / username
+init_recording_schema() # sessions.recording_path -> per-session landmark file (landmark_recorder.py)
+init_reps_table() # Per-rep depth/tempo/asymmetry records segmented from the recordings
+init_template_tables() # Reference movement templates + per-rep DTW similarity (scored on save; `python template_matching.py score` catches up)
+init_movement_index() # Per-session movement signatures for nearest-patient queries; indexes recorded sessions not yet seen
 add_user_if_not_exists('patient1', 'patientpass', 'patient', name='Jane Doe')
 add_user_if_not_exists('doctor1', 'doctorpass', 'doctor', name='Dr. Smith', specialty='Physiotherapy')
 
@@ -201,6 +227,7 @@ def get_navbar(user_role, username):
             children=[
                 dbc.NavItem(dbc.NavLink("Dashboard", href="/doctor_dashboard", style={"color":"white"})),
                 dbc.NavItem(dbc.NavLink("My Patients", href="/doctor_patient_details", style={"color":"white"})), # Adjusted href for pages
+                dbc.NavItem(dbc.NavLink("Cohort Analytics", href="/doctor_cohort_analytics", style={"color":"white"})),
                 dbc.NavItem(dbc.NavLink("Schedule Appointment", href="/doctor_schedule_appointment", style={"color":"white"})), # Adjusted href for pages
                 dbc.NavItem(
                     dbc.NavLink(
@@ -321,19 +348,16 @@ def handle_login(n_clicks, login_role, login_user, login_pass):
     if not all([login_role, login_user, login_pass]):
         return dbc.Alert("All fields required!", color="danger"), dash.no_update, None, None, None
 
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, password FROM users WHERE username=? AND role=?", (login_user, login_role))
-    record = cursor.fetchone()
-    conn.close()
+    try:
+        # Verifies in the auth pool and transparently upgrades the stored hash if the cost changed
+        user_id = auth_service.authenticate(login_user, login_role, login_pass)
+    except AuthServiceBusy:
+        return dbc.Alert("Server is busy, please try again in a moment.", color="warning"), dash.no_update, None, None, None
 
-    if record:
-        user_id, hashed_password = record
-        if bcrypt.checkpw(login_pass.encode('utf-8'), hashed_password.encode('utf-8')):
-            page_path = "/" + login_role + "_dashboard" # e.g., "/doctor_dashboard" or "/patient_dashboard"
-            return "", page_path, login_role, login_user, user_id
-        else:
-            return dbc.Alert("Invalid credentials!", color="danger"), dash.no_update, None, None, None
+    if user_id is not None:
+        remember_login(user_id, login_role) # Signed cookie checked by the export/replay routes
+        page_path = "/" + login_role + "_dashboard" # e.g., "/doctor_dashboard" or "/patient_dashboard"
+        return "", page_path, login_role, login_user, user_id
     else:
         return dbc.Alert("Invalid credentials!", color="danger"), dash.no_update, None, None, None
 
@@ -394,7 +418,7 @@ def handle_signup_and_back(register_n_clicks, back_n_clicks, signup_user, signup
                     conn.close()
                     return dbc.Alert("Username already exists!", color="danger"), dash.no_update
 
-                hashed_password = bcrypt.hashpw(signup_pass.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                hashed_password = auth_service.hash_password(signup_pass)
                 cursor.execute("INSERT INTO users(username,password,role) VALUES (?,?,?)",
                                (signup_user, hashed_password, signup_role))
                 user_id = cursor.lastrowid # Get the ID of the newly inserted user
@@ -407,9 +431,13 @@ def handle_signup_and_back(register_n_clicks, back_n_clicks, signup_user, signup
 
                 conn.commit()
                 conn.close()
+                invalidate(signup_role, user_id) # Clear anything cached for this id before first use
                 return dbc.Alert("Registration successful! You can login now.", color="success"), "/"
             except sqlite3.IntegrityError as e: # Catch potential unique constraint errors (though checked above)
                 return dbc.Alert(f"Registration failed: {e}", color="danger"), dash.no_update
+            except AuthServiceBusy:
+                conn.close()
+                return dbc.Alert("Server is busy, please try again in a moment.", color="warning"), dash.no_update
 
     return dash.no_update, dash.no_update
 
@@ -450,7 +478,11 @@ def handle_forgot_and_back(reset_n_clicks, back_n_clicks, forgot_user, new_pass,
             conn.close()
             return dbc.Alert("Username not found!", color="danger"), dash.no_update
         else:
-            hashed_password = bcrypt.hashpw(new_pass.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            try:
+                hashed_password = auth_service.hash_password(new_pass)
+            except AuthServiceBusy:
+                conn.close()
+                return dbc.Alert("Server is busy, please try again in a moment.", color="warning"), dash.no_update
             cursor.execute("UPDATE users SET password=? WHERE username=?", (hashed_password, forgot_user))
             conn.commit()
             conn.close()
@@ -471,6 +503,7 @@ def handle_forgot_and_back(reset_n_clicks, back_n_clicks, forgot_user, new_pass,
 def handle_logout(n_clicks):
     if n_clicks is not None and n_clicks > 0:
         # Clear all session stores on logout
+        forget_login()
         return "/", None, None, None
     return dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
@@ -600,6 +633,41 @@ def navigate_to_patient_details(n_clicks_list):
     return dash.no_update, dash.no_update
 
 
+# Monitoring routes below are for logged-in doctors only (route_auth.py)
+
+# Query cache hit ratios (per namespace) for monitoring
+@server.route('/cache-stats')
+def cache_stats_route():
+    require_role('doctor')
+    return jsonify(cache_stats())
+
+# Per-login latency, queue wait and rehash counters from the auth pool
+@server.route('/auth-stats')
+def auth_stats_route():
+    require_role('doctor')
+    return jsonify(auth_service.metrics())
+
+
+# Queue depth, batch sizes and commit latency of the single SQLite writer thread
+@server.route('/write-stats')
+def write_stats_route():
+    require_role('doctor')
+    return jsonify(write_queue.metrics())
+
+
+# Session cookie the data routes below use to check who is asking
+init_route_auth(server)
+
+# Streamed cohort downloads: /export/cohort/<doctor_id>.csv or .parquet (that doctor only)
+register_export_routes(server)
+
+# Skeleton replays of recorded sessions (that patient or their doctor only): /replay/<patient_id>/<session_id>.mjpg
+register_replay_routes(server)
+
+# Patients who moved most like this one at intake (the patient's doctor only): /api/patients/<patient_id>/similar?exercise=&k=
+register_similarity_routes(server)
+
+
 # Open browser automatically
 if __name__ == "__main__":
     def open_browser():
@@ -10,6 +10,18 @@ import queue
 import datetime
 import sqlite3
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from query_cache import cached_query, invalidate
+from session_history import SESSION_LIST_COLUMNS, store_angle_summary
+from write_queue import write_queue, WRITE_FLUSH_TIMEOUT
+from landmark_recorder import LandmarkRecorder, new_recording_path, landmarks_to_array
+from exercise_rules import load_exercise, ExerciseTracker
+from live_matcher import load_live_matcher
+from rep_segmentation import segment_recording, store_reps
+from movement_index import recording_signature, append_signatures, mark_signatures_indexed
+from template_matching import score_recording_reps, store_rep_scores
+from overlay import hud
+from skeleton_replay import SKELETON_LANDMARK_COLOR, SKELETON_CONNECTION_COLOR, SKELETON_THICKNESS, SKELETON_CIRCLE_RADIUS
 
 # Initialize MediaPipe Pose
 mp_pose = mp.solutions.pose
@@ -20,12 +32,19 @@ mp_drawing = mp.solutions.drawing_utils
 counter = 0
 stage = None
 feedback = "Stand straight"
-squat_start_time = None
-squat_end_time = None
 session_active = False
 start_time = None
 exercise_duration = 0 # In seconds
 
+# Landmark recording of the active session (landmark_recorder.py). The frame loop appends to it
+# while stop_session may run on a Dash callback thread, so both go through recorder_lock.
+recorder = None
+recorder_lock = threading.Lock()
+last_recording_path = None # File of the most recently stopped session, for save_session_data
+# Post-session analysis of a recording (rep segmentation, movement signature, DTW against the
+# templates) reads the whole file, so save_session_data runs it here rather than on its caller
+analysis_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-analysis')
+
 # Target variables (can be set by user later)
 TARGET_REPS = 10
 TARGET_SETS = 3
@@ -35,13 +54,15 @@ set_rest_active = False
 rest_start_time = None
 REST_DURATION_SECONDS = 60
 
-# Joint angle thresholds (example values, may need tuning)
-MIN_KNEE_ANGLE_SQUAT = 70  # Angle at bottom of squat
-MAX_KNEE_ANGLE_STAND = 160 # Angle when standing straight
-MIN_HIP_ANGLE_SQUAT = 60   # Hip angle at bottom
-MAX_HIP_ANGLE_STAND = 170  # Hip angle when standing
+# Active exercise: joint angles, phase thresholds, form rules and messages come from
+# exercises/<name>.json and are evaluated by the generic engine in exercise_rules.py
+current_exercise = load_exercise('squat')
+tracker = ExerciseTracker(current_exercise)
+# Streaming DTW against the exercise's reference template (live_matcher.py); None without a template
+live_matcher = None
+last_rep_match = None # Most recent completed match (similarity, worst joint)
 
-# Deque for smoothing angles (optional, but good for noisy data)
+# Recent smoothed angles (for saving with the session)
 knee_angle_deque = deque(maxlen=5)
 hip_angle_deque = deque(maxlen=5)
 
@@ -80,7 +101,7 @@ def calculate_angle(a, b, c):
     return angle
 
 def process_frame(frame):
-    global counter, stage, feedback, squat_start_time, squat_end_time
+    global counter, stage, feedback, last_rep_match
     global reps_in_current_set, set_rest_active, rest_start_time, exercise_duration
 
     image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -89,76 +110,70 @@ def process_frame(frame):
     image.flags.writeable = True
     image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
 
-    current_knee_angle = None
-    current_hip_angle = None
+    smoothed_knee_angle = None
+    smoothed_hip_angle = None
+    form_similarity = None
 
     if results.pose_landmarks:
         # Extract Landmarks
         landmarks = results.pose_landmarks.landmark
-        
-        # Get coordinates for key points
-        try:
-            shoulder = [landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].x, landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-            hip = [landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].x, landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].y]
-            knee = [landmarks[mp_pose.PoseLandmark.LEFT_KNEE.value].x, landmarks[mp_pose.PoseLandmark.LEFT_KNEE.value].y]
-            ankle = [landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].x, landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].y]
-
-            # Calculate angles
-            current_knee_angle = calculate_angle(hip, knee, ankle)
-            current_hip_angle = calculate_angle(shoulder, hip, knee)
-
-            knee_angle_deque.append(current_knee_angle)
-            hip_angle_deque.append(current_hip_angle)
 
-            smoothed_knee_angle = np.mean(knee_angle_deque)
-            smoothed_hip_angle = np.mean(hip_angle_deque)
+        try:
+            points = landmarks_to_array(landmarks)
+            now = time.time()
+            with recorder_lock:
+                if session_active and recorder is not None:
+                    recorder.append(now, points)
+
+            # Smoothed joint angles, phase, rep and form checks for the active exercise
+            result = tracker.update(points, now)
+            smoothed_knee_angle = result.angles.get('knee')
+            smoothed_hip_angle = result.angles.get('hip')
+            if smoothed_knee_angle is not None:
+                knee_angle_deque.append(smoothed_knee_angle)
+            if smoothed_hip_angle is not None:
+                hip_angle_deque.append(smoothed_hip_angle)
 
-            # Squat Logic
             if session_active and not set_rest_active:
-                if smoothed_knee_angle > MAX_KNEE_ANGLE_STAND: # Roughly standing straight
-                    stage = "up"
-                    feedback = "Stand straight"
-                    squat_end_time = time.time() # Mark time when standing up
-                if smoothed_knee_angle < MIN_KNEE_ANGLE_SQUAT and stage == 'up': # Squatting deep enough
-                    stage = "down"
-                    feedback = "Good depth"
-                    squat_start_time = time.time() # Mark time when squatting down
-                
-                if stage == "down" and smoothed_knee_angle > MAX_KNEE_ANGLE_STAND: # Reached standing position after a squat
-                    if squat_start_time and squat_end_time and (squat_end_time - squat_start_time) < 10: # Ensure reasonable squat duration
-                        reps_in_current_set += 1
-                        counter += 1
-                        play_sound(sound_squat_up)
-                        feedback = "Rep counted!"
-                        print(f"Rep: {reps_in_current_set}, Total: {counter}")
-                        stage = "up" # Reset stage for next rep
-                        squat_start_time = None
-                        squat_end_time = None
-                        
-                        if reps_in_current_set >= TARGET_REPS:
-                            start_rest()
-                            play_sound(sound_set_complete)
-                            if current_set < TARGET_SETS:
-                                feedback = f"Set {current_set+1} complete! Rest for {REST_DURATION_SECONDS} seconds."
-                            else:
-                                feedback = "Workout complete!"
-                                play_sound(sound_workout_complete)
-                                stop_session()
-                    else:
-                        # This handles cases where the "up" stage was missed or squat was too long
-                        feedback = "Keep standing, or perform a controlled squat."
-
+                stage, feedback = result.stage, result.feedback
+                if result.rep_completed:
+                    reps_in_current_set += 1
+                    counter += 1
+                    play_sound(sound_squat_up)
+                    print(f"Rep: {reps_in_current_set}, Total: {counter}")
+
+                    if reps_in_current_set >= TARGET_REPS:
+                        start_rest()
+                        play_sound(sound_set_complete)
+                        if current_set < TARGET_SETS:
+                            feedback = f"Set {current_set+1} complete! Rest for {REST_DURATION_SECONDS} seconds."
+                        else:
+                            feedback = "Workout complete!"
+                            play_sound(sound_workout_complete)
+                            stop_session()
+
+            # Live similarity to the reference template, O(template length) per frame
+            if session_active and live_matcher is not None:
+                live = live_matcher.update([result.angles[joint] for joint in live_matcher.joints])
+                form_similarity = live.similarity
+                if live.match is not None:
+                    last_rep_match = live.match
+                text = f"Form match: {live.similarity:.0f}%"
+                if last_rep_match is not None:
+                    text += f" (last rep {last_rep_match['similarity']:.0f}%, check {last_rep_match['worst_joint'].replace('_', ' ')})"
+                # Changes nearly every frame: drawn directly, a cached sprite would never be reused
+                cv2.putText(image, text, (10, image.shape[0] - 15), cv2.FONT_HERSHEY_SIMPLEX,
+                            0.6, (255, 255, 0), 2, cv2.LINE_AA)
 
             # Visual feedback on angles
-            cv2.putText(image, f"Knee: {int(smoothed_knee_angle)}", (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
-            cv2.putText(image, f"Hip: {int(smoothed_hip_angle)}", (10, 70),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+            for i, (joint, angle) in enumerate(result.angles.items()):
+                hud.text(image, f"{joint.replace('_', ' ').title()}: {int(angle)}", (10, 30 + 40 * i),
+                         1, (0, 255, 0), 2)
 
             # Draw landmarks and connections
             mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                                    mp_drawing.DrawingSpec(color=(245, 117, 66), thickness=2, circle_radius=2),
-                                    mp_drawing.DrawingSpec(color=(245, 66, 230), thickness=2, circle_radius=2)
+                                    mp_drawing.DrawingSpec(color=SKELETON_LANDMARK_COLOR, thickness=SKELETON_THICKNESS, circle_radius=SKELETON_CIRCLE_RADIUS),
+                                    mp_drawing.DrawingSpec(color=SKELETON_CONNECTION_COLOR, thickness=SKELETON_THICKNESS, circle_radius=SKELETON_CIRCLE_RADIUS)
                                     )
         except Exception as e:
             # print(f"Error processing landmarks: {e}")
@@ -171,23 +186,23 @@ def process_frame(frame):
     if session_active and start_time:
         exercise_duration = int(time.time() - start_time)
 
-    # Display squat counter
-    cv2.putText(image, f"Reps: {reps_in_current_set}/{TARGET_REPS}", (image.shape[1] - 300, 30),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
-    cv2.putText(image, f"Sets: {current_set}/{TARGET_SETS}", (image.shape[1] - 300, 70),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
-    cv2.putText(image, f"Duration: {exercise_duration // 60:02d}:{(exercise_duration % 60):02d}", (image.shape[1] - 300, 110),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
-    cv2.putText(image, feedback, (int(image.shape[1]/2) - 150, image.shape[0] - 50),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2, cv2.LINE_AA)
+    # Display squat counter (HUD text is composited from cached sprites, overlay.py)
+    hud.text(image, f"Reps: {reps_in_current_set}/{TARGET_REPS}", (image.shape[1] - 300, 30),
+             1, (0, 255, 0), 2)
+    hud.text(image, f"Sets: {current_set}/{TARGET_SETS}", (image.shape[1] - 300, 70),
+             1, (0, 255, 0), 2)
+    hud.text(image, f"Duration: {exercise_duration // 60:02d}:{(exercise_duration % 60):02d}", (image.shape[1] - 300, 110),
+             1, (0, 255, 0), 2)
+    hud.text(image, feedback, (int(image.shape[1]/2) - 150, image.shape[0] - 50),
+             1, (0, 0, 255), 2)
 
     # Rest timer display
     if set_rest_active:
         remaining_rest_time = int(REST_DURATION_SECONDS - (time.time() - rest_start_time))
         if remaining_rest_time > 0:
             rest_feedback = f"Rest: {remaining_rest_time}s"
-            cv2.putText(image, rest_feedback, (image.shape[1] // 2 - 100, image.shape[0] // 2),
-                        cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 255), 3, cv2.LINE_AA)
+            hud.text(image, rest_feedback, (image.shape[1] // 2 - 100, image.shape[0] // 2),
+                     2, (0, 0, 255), 3)
         else:
             end_rest()
 
@@ -196,6 +211,7 @@ def process_frame(frame):
         'time': time.time(),
         'knee_angle': smoothed_knee_angle if smoothed_knee_angle is not None else None,
         'hip_angle': smoothed_hip_angle if smoothed_hip_angle is not None else None,
+        'form_similarity': form_similarity,
         'reps': reps_in_current_set,
         'total_reps': counter,
         'feedback': feedback
@@ -205,30 +221,42 @@ def process_frame(frame):
 
     return image
 
-def start_session():
+def start_session(patient_id=None):
     global session_active, counter, reps_in_current_set, current_set, stage, feedback, start_time, exercise_duration
-    global set_rest_active, rest_start_time, squat_start_time, squat_end_time
+    global set_rest_active, rest_start_time, recorder, live_matcher, last_rep_match
     if not session_active:
+        try:
+            live_matcher = load_live_matcher(current_exercise.name)
+        except sqlite3.Error:
+            live_matcher = None # Template tables not created yet
+        last_rep_match = None
+        with recorder_lock:
+            recorder = LandmarkRecorder(new_recording_path(patient_id), patient_id=patient_id)
         session_active = True
         counter = 0
         reps_in_current_set = 0
         current_set = 0
         stage = None
-        feedback = "Get ready!"
+        tracker.reset()
+        feedback = tracker.feedback
         start_time = time.time()
         exercise_duration = 0
         set_rest_active = False
         rest_start_time = None
-        squat_start_time = None
-        squat_end_time = None
         play_sound(sound_keep_going)
         print("Session Started!")
 
 def stop_session():
     global session_active, counter, reps_in_current_set, current_set, stage, feedback, start_time, exercise_duration
-    global set_rest_active, rest_start_time
+    global set_rest_active, rest_start_time, recorder, last_recording_path
     if session_active:
         session_active = False
+        # Detach under the lock so no frame can append after the footer, then close outside it
+        with recorder_lock:
+            stopped, recorder = recorder, None
+        if stopped is not None:
+            stopped.close() # Writes the footer index
+            last_recording_path = stopped.path
         print(f"Session Stopped! Total Reps: {counter}, Duration: {exercise_duration}s")
         # Save session data to DB here if needed
         feedback = "Session Ended."
@@ -239,6 +267,14 @@ def stop_session():
         rest_start_time = None
         play_sound(sound_good_job)
 
+def set_exercise(name):
+    # Switch the exercise tracked by process_frame (between sessions only)
+    global current_exercise, tracker
+    if session_active:
+        raise RuntimeError("Cannot change the exercise during a session")
+    current_exercise = load_exercise(name)
+    tracker = ExerciseTracker(current_exercise)
+
 def start_rest():
     global set_rest_active, rest_start_time, current_set, reps_in_current_set
     set_rest_active = True
@@ -317,25 +353,78 @@ def init_db():
     conn.close()
 
 def save_session_data(patient_id, reps_achieved, reps_target, sets_achieved, sets_target,
-                       feedback_msg, joint_angles_data, duration):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    # Simple JSON serialization for joint_angles (example structure)
+                       feedback_msg, joint_angles_data, duration, recording_path=None, on_error=None):
+    # Safe to call from the frame loop: the recording is analysed on analysis_executor, which then
+    # hands the write to the single writer thread (write_queue.py). If the session cannot be saved
+    # (write queue full, busy retries exhausted, constraint error), on_error(exception) is called
+    # from one of those threads.
     import json
     joint_angles_json = json.dumps(joint_angles_data)
+    exercise = current_exercise
+    session_row = (patient_id, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), exercise.display_name,
+                   reps_achieved, reps_target, sets_achieved, sets_target, 'Completed',
+                   feedback_msg, joint_angles_json, duration, recording_path)
+    reps = signature = rep_scores = None
+    saved_session_id = None
+
+    def write(cursor):
+        nonlocal saved_session_id
+        cursor.execute('''
+            INSERT INTO sessions (patient_id, date, exercise_type, reps_achieved, reps_target,
+                                  sets_achieved, sets_target, completion_status, feedback,
+                                  joint_angles_json, exercise_duration, recording_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', session_row)
+        # Lightweight per-joint summary so list/graph queries never need the JSON payload
+        session_id = saved_session_id = cursor.lastrowid
+        store_angle_summary(cursor, session_id, joint_angles_data)
+        if reps is not None:
+            store_reps(cursor, session_id, patient_id, reps)
+        if rep_scores:
+            store_rep_scores(cursor, session_id, patient_id, rep_scores)
+        if signature is None:
+            mark_signatures_indexed(cursor, [session_id]) # Nothing to index; the startup backfill can skip it
+
+    def saved():
+        invalidate('patient', patient_id) # Drop cached session lists/summaries for this patient
+        if signature is not None:
+            # Only committed sessions enter the movement index (movement_index.py)
+            try:
+                append_signatures(exercise, [saved_session_id], [patient_id], signature[None])
+            except OSError as e:
+                print(f"Could not index session {saved_session_id}: {e}") # Left for the startup backfill
+            else:
+                write_queue.submit(lambda cursor: mark_signatures_indexed(cursor, [saved_session_id]))
+        print("Session data saved to database.")
+
+    def failed(error):
+        print(f"Session data for patient {patient_id} could not be saved: {error}")
+        if on_error is not None:
+            on_error(error)
+
+    def analyse_and_write():
+        nonlocal reps, signature, rep_scores
+        # Per-rep records from the landmark recording (rep_segmentation.py), segmented on the session's
+        # exercise like the live counter
+        try:
+            reps = segment_recording(recording_path, exercise) if recording_path else None
+            signature = recording_signature(recording_path, reps, exercise)
+        except (OSError, ValueError):
+            reps = signature = None # Unreadable recording: save the session without reps
+        try:
+            rep_scores = score_recording_reps(recording_path, reps, exercise) # DTW against the exercise's templates
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Could not score the reps of patient {patient_id}'s session: {e}") # e.g. no template tables yet
+        # Off the frame loop, so waiting for room in a full write queue is fine here
+        if not write_queue.submit(write, on_commit=saved, block=True, timeout=WRITE_FLUSH_TIMEOUT, on_error=failed):
+            failed(RuntimeError("Write queue is full"))
 
-    cursor.execute('''
-        INSERT INTO sessions (patient_id, date, exercise_type, reps_achieved, reps_target,
-                              sets_achieved, sets_target, completion_status, feedback,
-                              joint_angles_json, exercise_duration)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (patient_id, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'Squats',
-          reps_achieved, reps_target, sets_achieved, sets_target, 'Completed',
-          feedback_msg, joint_angles_json, duration))
-    conn.commit()
-    conn.close()
-    print("Session data saved to database.")
+    def analysed(future):
+        if future.exception() is not None: # Not a recording problem: report it rather than lose it silently
+            failed(future.exception())
+
+    analysis_executor.submit(analyse_and_write).add_done_callback(analysed)
+    return True
 
 # Example usage for saving data (call this when a session ends)
 # save_session_data(
@@ -346,12 +435,16 @@ def save_session_data(patient_id, reps_achieved, reps_target, sets_achieved, set
 #     sets_target=TARGET_SETS,
 #     feedback_msg="Good workout!",
 #     joint_angles_data={'knee_angles': list(knee_angle_deque), 'hip_angles': list(hip_angle_deque)},
-#     duration=exercise_duration
+#     duration=exercise_duration,
+#     recording_path=last_recording_path
 # )
 
+@cached_query('patient_sessions', entity='patient')
 def get_patient_sessions(patient_id):
     conn = sqlite3.connect(DATABASE_PATH)
-    df = pd.read_sql_query(f"SELECT * FROM sessions WHERE patient_id = {patient_id}", conn)
+    # Projection only: joint_angles_json is loaded lazily per session (session_history.get_session_angles)
+    df = pd.read_sql_query(f"SELECT {', '.join(SESSION_LIST_COLUMNS)} FROM sessions WHERE patient_id = ?",
+                           conn, params=(patient_id,))
     conn.close()
     return df
 
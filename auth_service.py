@@ -0,0 +1,173 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+
+# Password hashing off the Dash request threads.
+# bcrypt is deliberately slow (hundreds of ms per call), so all hashing goes through a small
+# bounded pool; when too many logins are queued new ones are rejected instead of starving
+# every other callback.
+
+DATABASE_PATH = 'theralink.db'
+
+BCRYPT_ROUNDS = int(os.environ.get('THERALINK_BCRYPT_ROUNDS', 12))
+AUTH_WORKERS = int(os.environ.get('THERALINK_AUTH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+AUTH_MAX_PENDING = int(os.environ.get('THERALINK_AUTH_MAX_PENDING', 32))
+AUTH_TIMEOUT_SECONDS = float(os.environ.get('THERALINK_AUTH_TIMEOUT', 10))
+
+
+class AuthServiceBusy(Exception):
+    pass
+
+
+def _cost_of(hashed_password):
+    # bcrypt hashes look like $2b$12$<salt+hash>; the third field is the cost factor
+    try:
+        return int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _hash(password, rounds):
+    started = time.perf_counter()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+    return hashed, time.perf_counter() - started
+
+
+def _check(password, hashed_password):
+    started = time.perf_counter()
+    ok = bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return ok, time.perf_counter() - started
+
+
+class AuthService:
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=AUTH_WORKERS, max_pending=AUTH_MAX_PENDING,
+                 database_path=DATABASE_PATH):
+        self.rounds = rounds
+        self.database_path = database_path
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='auth')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000) # (total, queue_wait, hash_time) per login
+        self._counters = {'logins': 0, 'failed': 0, 'rejected': 0, 'timeouts': 0, 'rehashed': 0}
+
+    def _run(self, fn, *args):
+        # Returns (result, queue_wait_seconds); raises AuthServiceBusy if the queue is full or the
+        # hash does not finish within AUTH_TIMEOUT_SECONDS (the job keeps its slot until it ends)
+        if not self._slots.acquire(blocking=False):
+            with self._metrics_lock:
+                self._counters['rejected'] += 1
+            raise AuthServiceBusy("Too many pending authentication requests")
+        submitted = time.perf_counter()
+
+        def job():
+            waited = time.perf_counter() - submitted
+            return fn(*args), waited
+
+        try:
+            future = self._executor.submit(job)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=AUTH_TIMEOUT_SECONDS)
+        except FutureTimeout:
+            with self._metrics_lock:
+                self._counters['timeouts'] += 1
+            raise AuthServiceBusy("Authentication timed out") from None
+
+    def needs_rehash(self, hashed_password):
+        return _cost_of(hashed_password) != self.rounds
+
+    def hash_password(self, password):
+        (hashed, _), _ = self._run(_hash, password, self.rounds)
+        return hashed
+
+    def verify_password(self, password, hashed_password):
+        (ok, _), _ = self._run(_check, password, hashed_password)
+        return ok
+
+    def authenticate(self, username, role, password):
+        # Returns the user id on success, None on bad credentials
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.database_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, password FROM users WHERE username=? AND role=?", (username, role))
+        record = cursor.fetchone()
+        conn.close()
+
+        if not record:
+            self._record_login(False, time.perf_counter() - started, 0.0, 0.0)
+            return None
+
+        user_id, hashed_password = record
+        (ok, hash_time), waited = self._run(_check, password, hashed_password)
+        self._record_login(ok, time.perf_counter() - started, waited, hash_time)
+        if not ok:
+            return None
+
+        if self.needs_rehash(hashed_password):
+            self._schedule_rehash(user_id, password, hashed_password)
+        return user_id
+
+    def _schedule_rehash(self, user_id, password, old_hash):
+        # Upgrade the stored hash to the current cost in the background; never delays the login.
+        # The UPDATE only applies if the password was not changed in the meantime.
+        def rehash():
+            new_hash, _ = _hash(password, self.rounds)
+            conn = sqlite3.connect(self.database_path)
+            cursor = conn.cursor()
+            cursor.execute("UPDATE users SET password=? WHERE id=? AND password=?", (new_hash, user_id, old_hash))
+            conn.commit()
+            updated = cursor.rowcount
+            conn.close()
+            if updated:
+                with self._metrics_lock:
+                    self._counters['rehashed'] += 1
+
+        if self._slots.acquire(blocking=False):
+            future = self._executor.submit(rehash)
+            future.add_done_callback(lambda _: self._slots.release())
+        # If the pool is saturated we simply retry on the next successful login
+
+    def _record_login(self, ok, total, waited, hash_time):
+        with self._metrics_lock:
+            self._counters['logins'] += 1
+            if not ok:
+                self._counters['failed'] += 1
+            self._latencies.append((total, waited, hash_time))
+
+    def metrics(self):
+        with self._metrics_lock:
+            latencies = list(self._latencies)
+            counters = dict(self._counters)
+
+        def percentile(values, pct):
+            if not values:
+                return 0.0
+            ordered = sorted(values)
+            return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+        totals = [l[0] for l in latencies]
+        waits = [l[1] for l in latencies]
+        hashes = [l[2] for l in latencies if l[2]]
+        counters.update({
+            'bcrypt_rounds': self.rounds,
+            'login_latency_p50_ms': percentile(totals, 50) * 1000,
+            'login_latency_p95_ms': percentile(totals, 95) * 1000,
+            'login_latency_max_ms': max(totals, default=0.0) * 1000,
+            'queue_wait_p95_ms': percentile(waits, 95) * 1000,
+            'hash_time_p50_ms': percentile(hashes, 50) * 1000,
+        })
+        return counters
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+auth_service = AuthService()
@@ -0,0 +1,443 @@
+import os
+import csv
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from auth_service import BCRYPT_ROUNDS
+from session_history import summarize_joint_angles, mark_angle_summaries
+from dashboard_stats import rebuild_doctor_stats
+from search_index import rebuild_search_index
+from query_cache import invalidate
+
+# Bulk import / backfill of historical patients and sessions (clinic onboarding).
+# Rows are validated, written with executemany inside large transactions, and the import
+# position is committed in the same transaction as the data, so an interrupted run can simply
+# be started again and continues where it stopped.
+# Large imports drop the tables' secondary indexes and triggers and restore them at the end. Run
+# those while the app is stopped: until the restore, dashboard statistics and the search index are
+# not maintained for anyone's writes (they are rebuilt from the tables afterwards, so nothing is
+# lost, but pages show stale numbers and queries run without their indexes in the meantime).
+
+DATABASE_PATH = 'theralink.db'
+
+IMPORT_BATCH_ROWS = 20000
+# Secondary indexes/triggers are dropped and rebuilt once at the end above this many rows
+DEFER_THRESHOLD_ROWS = 50000
+
+SESSION_FIELDS = ('patient_id', 'date', 'exercise_type', 'reps_achieved', 'reps_target', 'sets_achieved',
+                  'sets_target', 'completion_status', 'feedback', 'joint_angles_json', 'exercise_duration')
+
+
+class RowError(ValueError):
+    pass
+
+
+class RecordParseError(RowError):
+    # A record that could not be read at all; `row` is its raw text
+    def __init__(self, message, row):
+        super().__init__(message)
+        self.row = row
+
+
+def read_records(path, skip=0):
+    # Yields dicts from a .csv or .jsonl / .ndjson file; the first `skip` records are not parsed.
+    # A line that is not a JSON object is yielded as a RecordParseError, so it is rejected on its own.
+    if path.endswith(('.jsonl', '.ndjson', '.json')):
+        with open(path) as f:
+            seen = 0
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                seen += 1
+                if seen <= skip:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield RecordParseError(f"Not valid JSON: {e}", line)
+                    continue
+                yield record if isinstance(record, dict) else RecordParseError("Not a JSON object", line)
+    else:
+        with open(path, newline='') as f:
+            for record_no, record in enumerate(csv.DictReader(f), 1):
+                if record_no > skip:
+                    yield record
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def _int_or_none(value, field):
+    if value in (None, ''):
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        raise RowError(f"{field} must be a number, got {value!r}")
+
+
+def _normalize_date(value):
+    if not value:
+        raise RowError("date is required")
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.strptime(str(value)[:19], fmt))
+        except ValueError:
+            continue
+    raise RowError(f"Unrecognised date {value!r}")
+
+
+class BulkImporter:
+    def __init__(self, database_path=None, batch_rows=IMPORT_BATCH_ROWS, defer_indexes=None, errors_path=None):
+        self.database_path = database_path or DATABASE_PATH
+        self.batch_rows = batch_rows
+        self.defer_indexes = defer_indexes # None = decide from the file size
+        self.errors_path = errors_path
+        self.conn = sqlite3.connect(self.database_path, isolation_level=None) # Explicit BEGIN/COMMIT
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA cache_size=-200000") # ~200 MB page cache during the import
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS import_progress (
+                source TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                records_done INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS import_deferred_ddl (
+                name TEXT PRIMARY KEY,
+                sql TEXT NOT NULL
+            )
+        ''')
+        self._username_ids = {}
+        self._known_patient_ids = set()
+        # Summaries are written here, so sessions are marked as summarised when the app's marker exists
+        self._marks_summaries = 'angle_stats_done' in {row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")}
+        self._errors = open(errors_path, 'a') if errors_path else None
+        self.stats = {'imported': 0, 'rejected': 0, 'skipped': 0, 'seconds': 0.0}
+
+    # --- resume bookkeeping ---
+    def _progress(self, source, fingerprint):
+        row = self.conn.execute("SELECT fingerprint, records_done FROM import_progress WHERE source = ?",
+                                (source,)).fetchone()
+        if row and row[0] == fingerprint:
+            return row[1]
+        return 0 # New file, or the file changed since the last run: start over
+
+    def _save_progress(self, source, fingerprint, records_done):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO import_progress (source, fingerprint, records_done, updated_at) VALUES (?, ?, ?, datetime('now'))",
+            (source, fingerprint, records_done)
+        )
+
+    # --- deferred index / trigger maintenance ---
+    def _defer(self, tables):
+        # Remember the DDL before dropping, so a crash mid-import still gets it rebuilt next run
+        placeholders = ','.join('?' * len(tables))
+        objects = self.conn.execute(f'''
+            SELECT type, name, sql FROM sqlite_master
+            WHERE tbl_name IN ({placeholders}) AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        ''', tables).fetchall()
+        self.conn.execute("BEGIN IMMEDIATE")
+        for obj_type, name, sql in objects:
+            self.conn.execute("INSERT OR REPLACE INTO import_deferred_ddl (name, sql) VALUES (?, ?)", (name, sql))
+            self.conn.execute(f"DROP {obj_type.upper()} IF EXISTS {name}")
+        self.conn.execute("COMMIT")
+        return len(objects)
+
+    def restore_deferred(self):
+        deferred = self.conn.execute("SELECT name, sql FROM import_deferred_ddl").fetchall()
+        if not deferred:
+            return 0
+        self.conn.execute("BEGIN IMMEDIATE")
+        # After an interrupted run the app's ensure_*/init_* may already have recreated some objects
+        existing = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+        for name, sql in deferred:
+            if name not in existing:
+                self.conn.execute(sql)
+            self.conn.execute("DELETE FROM import_deferred_ddl WHERE name = ?", (name,))
+        self.conn.execute("COMMIT")
+        # Triggers did not run during the import, so recompute what they maintain
+        rebuild_doctor_stats(self.conn)
+        if any(name.startswith('trg_fts_') for name, _ in deferred):
+            rebuild_search_index(self.conn)
+        return len(deferred)
+
+    def _reject(self, record_no, record, error):
+        self.stats['rejected'] += 1
+        if self._errors:
+            self._errors.write(json.dumps({'record': record_no, 'error': str(error), 'row': record}, default=str) + "\n")
+
+    def _lookup_user_ids(self, usernames, role):
+        missing = [u for u in set(usernames) if (u, role) not in self._username_ids]
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for user_id, username in self.conn.execute(
+                    f"SELECT id, username FROM users WHERE role = ? AND username IN ({placeholders})", [role] + chunk):
+                self._username_ids[(username, role)] = user_id
+        return {u: self._username_ids.get((u, role)) for u in usernames}
+
+    def _existing_patient_ids(self, patient_ids):
+        missing = list({i for i in patient_ids if i not in self._known_patient_ids})
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            self._known_patient_ids.update(row[0] for row in self.conn.execute(
+                f"SELECT patient_id FROM patients WHERE patient_id IN ({','.join('?' * len(chunk))})", chunk))
+        return self._known_patient_ids
+
+    def _existing_usernames(self, usernames):
+        existing = set()
+        for i in range(0, len(usernames), 500):
+            chunk = usernames[i:i + 500]
+            existing.update(row[0] for row in self.conn.execute(
+                f"SELECT username FROM users WHERE username IN ({','.join('?' * len(chunk))})", chunk))
+        return existing
+
+    # --- sessions ---
+    def _validate_session(self, record, patient_ids, known_patient_ids):
+        patient_id = _int_or_none(record.get('patient_id'), 'patient_id')
+        # Foreign keys are not enforced, so an unknown id would be imported as an orphan session
+        if patient_id is not None and patient_id not in known_patient_ids:
+            raise RowError(f"Unknown patient_id {patient_id}")
+        if patient_id is None and record.get('patient_username'):
+            patient_id = patient_ids.get(record['patient_username'])
+        if patient_id is None:
+            raise RowError("Unknown patient (need patient_id or an existing patient_username)")
+
+        angles = record.get('joint_angles_json', record.get('joint_angles'))
+        payload = angles if isinstance(angles, str) and angles else None # Store the original text as-is
+        if isinstance(angles, str):
+            try:
+                angles = json.loads(angles) if angles else {}
+            except json.JSONDecodeError:
+                raise RowError("joint_angles_json is not valid JSON")
+        angles = angles or {}
+        if not isinstance(angles, dict):
+            raise RowError("joint angles must be an object of joint -> list of angles")
+
+        row = (
+            patient_id,
+            _normalize_date(record.get('date')),
+            record.get('exercise_type') or 'Squats',
+            _int_or_none(record.get('reps_achieved'), 'reps_achieved'),
+            _int_or_none(record.get('reps_target'), 'reps_target'),
+            _int_or_none(record.get('sets_achieved'), 'sets_achieved'),
+            _int_or_none(record.get('sets_target'), 'sets_target'),
+            record.get('completion_status') or 'Completed',
+            record.get('feedback'),
+            payload or json.dumps(angles),
+            _int_or_none(record.get('exercise_duration'), 'exercise_duration'),
+        )
+        return row, angles
+
+    def _write_sessions(self, batch, next_id):
+        session_rows, summary_rows = [], []
+        for row, angles in batch:
+            session_rows.append((next_id,) + row)
+            summary_rows.extend((next_id,) + summary for summary in summarize_joint_angles(angles))
+            next_id += 1
+        self.conn.executemany(
+            f"INSERT INTO sessions (session_id, {', '.join(SESSION_FIELDS)}) VALUES ({','.join('?' * (len(SESSION_FIELDS) + 1))})",
+            session_rows
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO session_angle_stats (session_id, joint, samples, first_angle, mean_angle, min_angle, max_angle) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            summary_rows
+        )
+        if self._marks_summaries:
+            mark_angle_summaries(self.conn, [row[0] for row in session_rows])
+        return next_id
+
+    def import_sessions(self, path):
+        return self._run(path, 'sessions', ['sessions', 'session_angle_stats'], self._session_batch)
+
+    def _session_batch(self, records):
+        usernames = [r.get('patient_username') for _, r in records if r.get('patient_username')]
+        patient_ids = self._lookup_user_ids(usernames, 'patient') if usernames else {}
+        explicit_ids = []
+        for _, r in records:
+            try:
+                explicit_ids.append(_int_or_none(r.get('patient_id'), 'patient_id'))
+            except RowError:
+                pass # Rejected by _validate_session
+        known_patient_ids = self._existing_patient_ids([i for i in explicit_ids if i is not None])
+        valid = []
+        for record_no, record in records:
+            try:
+                valid.append(self._validate_session(record, patient_ids, known_patient_ids))
+            except RowError as e:
+                self._reject(record_no, record, e)
+        if valid:
+            # Explicit ids (we hold the write lock) so angle summaries can be written with executemany too
+            next_id = (self.conn.execute("SELECT MAX(session_id) FROM sessions").fetchone()[0] or 0) + 1
+            self._write_sessions(valid, next_id)
+        return len(valid)
+
+    # --- patients ---
+    def import_patients(self, path):
+        self._hash_pool = ThreadPoolExecutor(max_workers=max(1, os.cpu_count() or 1))
+        try:
+            return self._run(path, 'patients', ['users', 'patients'], self._patient_batch)
+        finally:
+            self._hash_pool.shutdown()
+
+    @staticmethod
+    def _hash(password):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+    def _patient_batch(self, records):
+        usernames = [r.get('username').strip() for _, r in records if r.get('username')]
+        existing = self._existing_usernames(usernames)
+        doctor_names = [r.get('doctor_username') for _, r in records if r.get('doctor_username')]
+        doctor_ids = self._lookup_user_ids(doctor_names, 'doctor') if doctor_names else {}
+
+        valid, to_hash, seen = [], [], set()
+        for record_no, record in records:
+            username = (record.get('username') or '').strip()
+            try:
+                if not username:
+                    raise RowError("username is required")
+                if username in existing or username in seen:
+                    self.stats['skipped'] += 1 # Already imported (e.g. an earlier partial run) or duplicate
+                    continue
+                password_hash = record.get('password_hash')
+                if password_hash and not str(password_hash).startswith('$2'):
+                    raise RowError("password_hash must be a bcrypt hash")
+                if not password_hash and not record.get('password'):
+                    raise RowError("password or password_hash is required")
+                doctor_id = _int_or_none(record.get('doctor_id'), 'doctor_id')
+                if doctor_id is None and record.get('doctor_username'):
+                    doctor_id = doctor_ids.get(record['doctor_username'])
+                    if doctor_id is None:
+                        raise RowError(f"Unknown doctor {record['doctor_username']!r}")
+            except RowError as e:
+                self._reject(record_no, record, e)
+                continue
+            seen.add(username)
+            valid.append([username, password_hash, record.get('name') or username, record.get('dob'),
+                          record.get('gender'), record.get('contact'), doctor_id])
+            if not password_hash:
+                to_hash.append((len(valid) - 1, record['password']))
+
+        # bcrypt is the bottleneck for plain-text passwords; hash them across all cores
+        for (index, _), hashed in zip(to_hash, self._hash_pool.map(self._hash, [p for _, p in to_hash])):
+            valid[index][1] = hashed
+
+        if valid:
+            next_id = (self.conn.execute("SELECT MAX(id) FROM users").fetchone()[0] or 0) + 1
+            user_rows, patient_rows = [], []
+            for offset, (username, password_hash, name, dob, gender, contact, doctor_id) in enumerate(valid):
+                user_rows.append((next_id + offset, username, password_hash, 'patient'))
+                patient_rows.append((next_id + offset, name, dob, gender, contact, doctor_id))
+            self.conn.executemany("INSERT INTO users (id, username, password, role) VALUES (?, ?, ?, ?)", user_rows)
+            self.conn.executemany(
+                "INSERT INTO patients (patient_id, name, dob, gender, contact, doctor_id) VALUES (?, ?, ?, ?, ?, ?)",
+                patient_rows
+            )
+        return len(valid)
+
+    # --- driver ---
+    def _run(self, path, kind, tables, write_batch):
+        started = time.perf_counter()
+        source = f"{kind}:{os.path.abspath(path)}"
+        fingerprint = _fingerprint(path)
+        done = self._progress(source, fingerprint)
+        if done:
+            print(f"Resuming {path} after {done} records")
+
+        defer = self.defer_indexes
+        if defer is None:
+            # Rough estimate: only worth dropping indexes for large files
+            defer = os.path.getsize(path) > DEFER_THRESHOLD_ROWS * 200
+        if defer:
+            dropped = self._defer(tables)
+            print(f"Dropped {dropped} indexes/triggers on {', '.join(tables)} until the import ends; "
+                  f"dashboard statistics and search are stale until then")
+
+        imported = 0
+        batch = []
+        record_no = done
+
+        def flush():
+            nonlocal imported
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                records = []
+                for number, record in batch:
+                    if isinstance(record, RecordParseError):
+                        self._reject(number, record.row, record)
+                    else:
+                        records.append((number, record))
+                imported += write_batch(records) if records else 0
+                self._save_progress(source, fingerprint, record_no)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        try:
+            for record in read_records(path, skip=done):
+                record_no += 1
+                batch.append((record_no, record))
+                if len(batch) >= self.batch_rows:
+                    flush()
+                    batch = []
+            if batch:
+                flush()
+        finally:
+            if self._errors:
+                self._errors.flush()
+            self.restore_deferred() # Also picks up DDL left behind by an interrupted earlier run
+
+        # Whatever is cached (possibly in a shared backend) may describe imported entities
+        invalidate('patient')
+        invalidate('doctor')
+
+        elapsed = time.perf_counter() - started
+        self.stats['imported'] += imported
+        self.stats['seconds'] += elapsed
+        rate = imported / elapsed if elapsed > 0 else 0.0
+        print(f"Imported {imported} {kind} from {path} in {elapsed:.2f}s ({rate:,.0f} rows/s), "
+              f"rejected {self.stats['rejected']}, skipped {self.stats['skipped']}")
+        return imported
+
+    def close(self):
+        if self._errors:
+            self._errors.close()
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import patients or sessions from CSV / JSON lines.")
+    parser.add_argument('kind', choices=['patients', 'sessions'])
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_ROWS)
+    parser.add_argument('--errors', help="Append rejected rows (with reasons) to this JSON lines file")
+    defer_group = parser.add_mutually_exclusive_group()
+    defer_group.add_argument('--defer-indexes', dest='defer', action='store_true', default=None)
+    defer_group.add_argument('--no-defer-indexes', dest='defer', action='store_false')
+    args = parser.parse_args()
+
+    importer = BulkImporter(batch_rows=args.batch_size, defer_indexes=args.defer, errors_path=args.errors)
+    try:
+        for path in args.paths:
+            if args.kind == 'patients':
+                importer.import_patients(path)
+            else:
+                importer.import_sessions(path)
+    finally:
+        importer.close()
+    sys.exit(1 if importer.stats['rejected'] else 0)
@@ -0,0 +1,281 @@
+import sys
+import time
+import sqlite3
+import argparse
+import numpy as np
+from datetime import date, datetime, timedelta
+from query_cache import cached_query
+
+# Cohort-wide range-of-motion trends and adherence for the doctor analytics page.
+# Per-session aggregates (session_angle_stats) for every patient of a doctor are loaded once into
+# columnar arrays sorted by (patient, date); all per-patient metrics are then computed with grouped
+# numpy reductions (bincount / cumsum over group boundaries), never with a Python loop per patient.
+
+DATABASE_PATH = 'theralink.db'
+
+ANALYTICS_WINDOW_DAYS = 90 # history used for trends
+ADHERENCE_WINDOW_DAYS = 28 # recent period used for adherence
+EXPECTED_SESSIONS_PER_WEEK = 3
+ROLLING_SESSIONS = 5 # rolling mean window, in sessions
+MIN_TREND_SESSIONS = 3 # fewer sessions than this -> no slope
+PLATEAU_SLOPE = 0.5 # |degrees of ROM per week| below this counts as a plateau
+INACTIVE_DAYS = 14 # no session for this long -> inactive
+AT_RISK_TOP_K = 10
+
+TREND_JOINTS = ('knee', 'hip')
+
+STATUS_LABELS = ('Improving', 'Plateauing', 'Declining', 'Inactive', 'Insufficient data')
+
+
+def get_cohort_data_version(doctor_id, conn=None):
+    # Cheap change token: trigger-maintained counters plus the newest session id.
+    # Any session or patient added for this doctor changes it, so cached results are never stale.
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    row = conn.execute('''
+        SELECT (SELECT patients_assigned FROM doctor_stats WHERE doctor_id = ?),
+               (SELECT total_sessions FROM doctor_stats WHERE doctor_id = ?),
+               (SELECT MAX(session_id) FROM sessions)
+    ''', (doctor_id, doctor_id)).fetchone()
+    if own_conn:
+        conn.close()
+    return '-'.join(str(value or 0) for value in row)
+
+
+def load_cohort_arrays(doctor_id, start_date, conn=None):
+    # Columnar per-session aggregates for the doctor's patients, sorted by (patient_id, day)
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    patients = conn.execute('''
+        SELECT p.patient_id, p.name FROM patients p WHERE p.doctor_id = ? ORDER BY p.patient_id
+    ''', (doctor_id,)).fetchall()
+    rows = conn.execute('''
+        SELECT s.patient_id,
+               julianday(s.date),
+               s.reps_achieved,
+               s.reps_target,
+               knee.max_angle - knee.min_angle,
+               hip.max_angle - hip.min_angle
+        FROM patients p
+        JOIN sessions s ON s.patient_id = p.patient_id
+        LEFT JOIN session_angle_stats knee ON knee.session_id = s.session_id AND knee.joint = 'knee'
+        LEFT JOIN session_angle_stats hip ON hip.session_id = s.session_id AND hip.joint = 'hip'
+        WHERE p.doctor_id = ? AND s.date >= ?
+        ORDER BY s.patient_id, s.date
+    ''', (doctor_id, start_date.isoformat())).fetchall()
+    if own_conn:
+        conn.close()
+
+    # None -> nan in a float array, so missing summaries simply drop out of the reductions
+    values = np.array(rows, dtype=np.float64).reshape(-1, 6)
+    return {
+        'patient_ids': np.array([p[0] for p in patients], dtype=np.int64),
+        'names': [p[1] for p in patients],
+        'patient_id': values[:, 0].astype(np.int64),
+        'day': values[:, 1],
+        'reps_achieved': values[:, 2],
+        'reps_target': values[:, 3],
+        'rom': {'knee': values[:, 4], 'hip': values[:, 5]},
+    }
+
+
+def _grouped_sum(group, values, n_groups):
+    return np.bincount(group, weights=values, minlength=n_groups)
+
+
+def grouped_slopes(group, x, y, n_groups, min_count=MIN_TREND_SESSIONS):
+    # Least-squares slope of y over x per group; nan where a group has too few valid samples
+    valid = ~(np.isnan(x) | np.isnan(y))
+    g, x, y = group[valid], x[valid], y[valid]
+    n = np.bincount(g, minlength=n_groups).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Centre x per group first so julian-day magnitudes do not cancel catastrophically
+        x = x - (_grouped_sum(g, x, n_groups) / n)[g]
+        sxx = _grouped_sum(g, x * x, n_groups)
+        sxy = _grouped_sum(g, x * y, n_groups)
+        slopes = sxy / sxx
+    slopes[(n < min_count) | (sxx <= 0)] = np.nan
+    return slopes
+
+
+def grouped_rolling_mean(group_start, y, window=ROLLING_SESSIONS):
+    # Trailing mean over the last `window` valid samples of each row's group (rows sorted by group).
+    # Built from cumulative sums, clamped so a window never reaches back into the previous group.
+    valid = ~np.isnan(y)
+    csum = np.concatenate(([0.0], np.cumsum(np.where(valid, y, 0.0))))
+    ccount = np.concatenate(([0], np.cumsum(valid)))
+    idx = np.arange(len(y))
+    # Prefix position where the window starts: `window` valid samples back, but never before the group
+    target = np.maximum(ccount[idx + 1] - window, 0)
+    start = np.maximum(np.searchsorted(ccount, target, side='left'), group_start)
+    counts = ccount[idx + 1] - ccount[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (csum[idx + 1] - csum[start]) / counts
+
+
+def compute_cohort_metrics(arrays, today, window_days=ANALYTICS_WINDOW_DAYS, adherence_days=ADHERENCE_WINDOW_DAYS,
+                           sessions_per_week=EXPECTED_SESSIONS_PER_WEEK, top_k=AT_RISK_TOP_K):
+    patient_ids = arrays['patient_ids']
+    n_patients = len(patient_ids)
+    # Row -> patient index; sessions are sorted by patient so groups are contiguous
+    group = np.searchsorted(patient_ids, arrays['patient_id'])
+    day = arrays['day']
+    today_jd = _julian_day(today)
+
+    session_count = np.bincount(group, minlength=n_patients)
+    group_start = np.concatenate(([0], np.cumsum(session_count)[:-1]))
+    group_last = group_start + session_count - 1
+    has_sessions = session_count > 0
+    row_group_start = group_start[group]
+
+    recent = day >= today_jd - adherence_days
+    recent_sessions = np.bincount(group, weights=recent, minlength=n_patients)
+    expected = sessions_per_week * adherence_days / 7.0
+    adherence = np.minimum(recent_sessions / expected, 1.0)
+
+    reps_achieved = _grouped_sum(group, np.nan_to_num(arrays['reps_achieved']), n_patients)
+    reps_target = _grouped_sum(group, np.nan_to_num(arrays['reps_target']), n_patients)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        completion = np.where(reps_target > 0, np.minimum(reps_achieved / reps_target, 1.0), np.nan)
+
+    last_day = np.full(n_patients, np.nan)
+    last_day[has_sessions] = day[group_last[has_sessions]]
+    days_since_last = today_jd - last_day
+
+    metrics = {
+        'patient_id': patient_ids,
+        'sessions': session_count,
+        'recent_sessions': recent_sessions.astype(np.int64),
+        'adherence': adherence,
+        'completion': completion,
+        'days_since_last': days_since_last,
+    }
+    for joint in TREND_JOINTS:
+        rom = arrays['rom'][joint]
+        metrics[f'{joint}_slope'] = grouped_slopes(group, day, rom, n_patients) * 7.0 # degrees per week
+        rolling = grouped_rolling_mean(row_group_start, rom)
+        latest = np.full(n_patients, np.nan)
+        latest[has_sessions] = rolling[group_last[has_sessions]]
+        metrics[f'{joint}_rom'] = latest
+
+    # Headline trend: knee where available, else hip
+    slope = np.where(np.isnan(metrics['knee_slope']), metrics['hip_slope'], metrics['knee_slope'])
+    status = np.full(n_patients, 4, dtype=np.int8) # Insufficient data
+    status[slope > PLATEAU_SLOPE] = 0
+    status[np.abs(slope) <= PLATEAU_SLOPE] = 1
+    status[slope < -PLATEAU_SLOPE] = 2
+    status[~(days_since_last <= INACTIVE_DAYS)] = 3 # Also covers patients with no sessions at all
+    metrics['status'] = status
+
+    # Risk in [0, 1]: missed sessions weigh most, then a falling or flat trend, then time since last session
+    trend_risk = np.clip(0.5 - np.nan_to_num(slope, nan=0.0) / (4 * PLATEAU_SLOPE), 0.0, 1.0)
+    idle_risk = np.clip(np.nan_to_num(days_since_last, nan=window_days) / window_days, 0.0, 1.0)
+    metrics['risk'] = 0.5 * (1.0 - adherence) + 0.3 * trend_risk + 0.2 * idle_risk
+
+    k = min(top_k, n_patients)
+    if k:
+        candidates = np.argpartition(-metrics['risk'], k - 1)[:k]
+        metrics['at_risk'] = candidates[np.argsort(-metrics['risk'][candidates], kind='stable')]
+    else:
+        metrics['at_risk'] = np.array([], dtype=np.int64)
+    return metrics
+
+
+def _julian_day(day):
+    return datetime(day.year, day.month, day.day).toordinal() + 1721424.5
+
+
+def _round(value, digits):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def _patient_rows(metrics, names, indices):
+    rows = []
+    for i in indices:
+        rows.append({
+            'patient_id': int(metrics['patient_id'][i]),
+            'name': names[i],
+            'status': STATUS_LABELS[metrics['status'][i]],
+            'sessions': int(metrics['sessions'][i]),
+            'recent_sessions': int(metrics['recent_sessions'][i]),
+            'adherence': _round(metrics['adherence'][i] * 100, 0),
+            'completion': _round(metrics['completion'][i] * 100, 0),
+            'knee_rom': _round(metrics['knee_rom'][i], 1),
+            'knee_slope': _round(metrics['knee_slope'][i], 2),
+            'hip_rom': _round(metrics['hip_rom'][i], 1),
+            'hip_slope': _round(metrics['hip_slope'][i], 2),
+            'days_since_last': None if np.isnan(metrics['days_since_last'][i]) else int(metrics['days_since_last'][i]),
+            'risk': _round(metrics['risk'][i], 3),
+        })
+    return rows
+
+
+@cached_query('cohort_analytics', entity='doctor')
+def _cached_cohort_analytics(doctor_id, data_version, today, window_days):
+    start = time.perf_counter()
+    arrays = load_cohort_arrays(doctor_id, today - timedelta(days=window_days))
+    loaded = time.perf_counter()
+    metrics = compute_cohort_metrics(arrays, today, window_days=window_days)
+    computed = time.perf_counter()
+    return {
+        'patients': _patient_rows(metrics, arrays['names'], range(len(arrays['names']))),
+        'at_risk': _patient_rows(metrics, arrays['names'], metrics['at_risk']),
+        'status_counts': {label: int(np.sum(metrics['status'] == i)) for i, label in enumerate(STATUS_LABELS)},
+        'data_version': data_version,
+        'timings': {'load': loaded - start, 'compute': computed - loaded},
+    }
+
+
+def get_cohort_analytics(doctor_id, window_days=ANALYTICS_WINDOW_DAYS, today=None):
+    # Cached per (doctor, data version, day, window); a new session or patient yields a new version
+    today = today or date.today()
+    return _cached_cohort_analytics(doctor_id, get_cohort_data_version(doctor_id), today, window_days)
+
+
+def _synthetic_cohort(n_patients, sessions_per_patient, today, seed=0):
+    # Random cohort shaped like load_cohort_arrays() output, for benchmarking without a database
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 2 * sessions_per_patient, n_patients)
+    patient_ids = np.arange(1, n_patients + 1, dtype=np.int64)
+    patient_id = np.repeat(patient_ids, counts)
+    today_jd = _julian_day(today)
+    day = today_jd - rng.uniform(0, ANALYTICS_WINDOW_DAYS, len(patient_id))
+    order = np.lexsort((day, patient_id))
+    patient_id, day = patient_id[order], day[order]
+    gain = np.repeat(rng.normal(0.1, 0.2, n_patients), counts)
+    knee = 60 + gain * (day - day.min()) + rng.normal(0, 3, len(day))
+    return {
+        'patient_ids': patient_ids,
+        'names': [f'Patient {i}' for i in patient_ids],
+        'patient_id': patient_id,
+        'day': day,
+        'reps_achieved': rng.integers(0, 12, len(day)).astype(np.float64),
+        'reps_target': np.full(len(day), 10.0),
+        'rom': {'knee': knee, 'hip': knee * 0.8},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cohort analytics for a doctor, or a synthetic benchmark.")
+    parser.add_argument('doctor_id', type=int, nargs='?')
+    parser.add_argument('--benchmark', type=int, metavar='N_PATIENTS', help="Time the metrics on a synthetic cohort")
+    parser.add_argument('--sessions', type=int, default=30, help="Average sessions per synthetic patient")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        arrays = _synthetic_cohort(args.benchmark, args.sessions, date.today())
+        start = time.perf_counter()
+        metrics = compute_cohort_metrics(arrays, date.today())
+        elapsed = time.perf_counter() - start
+        print(f"{args.benchmark} patients / {len(arrays['day'])} sessions: metrics in {elapsed * 1000:.1f} ms",
+              file=sys.stderr)
+    elif args.doctor_id is not None:
+        result = get_cohort_analytics(args.doctor_id)
+        print(result['status_counts'])
+        for row in result['at_risk']:
+            print(row)
+        print({k: f"{v * 1000:.1f} ms" for k, v in result['timings'].items()}, file=sys.stderr)
+    else:
+        parser.error("give a doctor_id or --benchmark N_PATIENTS")
@@ -0,0 +1,204 @@
+import io
+import csv
+import sys
+import json
+import time
+import sqlite3
+import argparse
+
+# Streaming export of a doctor's patient cohort: one output row per recorded joint angle sample.
+# Sessions are read from a cursor in chunks and each joint_angles_json payload is decoded only
+# when its session is reached, so memory stays bounded no matter how large the cohort is.
+
+DATABASE_PATH = 'theralink.db'
+
+EXPORT_CHUNK_SESSIONS = 200 # sessions fetched from the cursor at a time
+EXPORT_BATCH_ROWS = 50000 # rows per CSV chunk / Parquet row group
+
+EXPORT_COLUMNS = ('patient_id', 'session_id', 'date', 'exercise_type', 'reps_achieved', 'exercise_duration',
+                  'joint', 'frame', 'angle')
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def iter_cohort_rows(doctor_id, chunk_sessions=EXPORT_CHUNK_SESSIONS, database_path=None):
+    conn = sqlite3.connect(database_path or DATABASE_PATH)
+    try:
+        cursor = conn.execute('''
+            SELECT s.patient_id, s.session_id, s.date, s.exercise_type, s.reps_achieved, s.exercise_duration,
+                   s.joint_angles_json
+            FROM patients p
+            JOIN sessions s ON s.patient_id = p.patient_id
+            WHERE p.doctor_id = ?
+            ORDER BY s.patient_id, s.session_id
+        ''', (doctor_id,))
+        while True:
+            sessions = cursor.fetchmany(chunk_sessions)
+            if not sessions:
+                break
+            for *session_cols, payload in sessions:
+                try:
+                    joint_angles = json.loads(payload) if payload else {}
+                except (json.JSONDecodeError, TypeError):
+                    joint_angles = {}
+                if not isinstance(joint_angles, dict):
+                    continue
+                for joint, angles in joint_angles.items():
+                    if not isinstance(angles, list):
+                        continue
+                    for frame, angle in enumerate(angles):
+                        yield (*session_cols, joint, frame, angle)
+    finally:
+        conn.close()
+
+
+def _batched(rows, batch_rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ExportStats:
+    def __init__(self):
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def seconds(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def report(self):
+        return f"Exported {self.rows} rows in {self.seconds:.2f}s ({self.rows_per_second:,.0f} rows/s)"
+
+
+def stream_csv(rows, stats=None, batch_rows=EXPORT_BATCH_ROWS):
+    # Yields CSV text chunks; suitable for a streaming HTTP response or writing to a file
+    stats = stats or ExportStats()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in _batched(rows, batch_rows):
+        writer.writerows(batch)
+        stats.rows += len(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    stats.finished = time.perf_counter()
+    tail = buffer.getvalue()
+    if tail:
+        yield tail
+    print(stats.report(), file=sys.stderr)
+
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only file object that hands written bytes back to the generator driving it
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_parquet(rows, stats=None, batch_rows=EXPORT_BATCH_ROWS):
+    # Yields Parquet bytes one row group at a time (pyarrow is only needed for this format)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('patient_id', pa.int64()), ('session_id', pa.int64()), ('date', pa.string()),
+        ('exercise_type', pa.string()), ('reps_achieved', pa.int64()), ('exercise_duration', pa.int64()),
+        ('joint', pa.string()), ('frame', pa.int32()), ('angle', pa.float32()),
+    ])
+    stats = stats or ExportStats()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for batch in _batched(rows, batch_rows):
+            columns = list(zip(*batch))
+            table = pa.Table.from_arrays([pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                                         schema=schema)
+            writer.write_table(table, row_group_size=batch_rows)
+            stats.rows += len(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    stats.finished = time.perf_counter()
+    yield sink.drain() # Footer
+    print(stats.report(), file=sys.stderr)
+
+
+def stream_cohort_export(doctor_id, fmt='csv', stats=None):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    rows = iter_cohort_rows(doctor_id)
+    return stream_csv(rows, stats) if fmt == 'csv' else stream_parquet(rows, stats)
+
+
+def export_cohort(doctor_id, path, fmt='csv'):
+    stats = ExportStats()
+    mode = 'w' if fmt == 'csv' else 'wb'
+    with open(path, mode, newline='' if fmt == 'csv' else None) as f:
+        for chunk in stream_cohort_export(doctor_id, fmt, stats):
+            f.write(chunk)
+    return stats
+
+
+def register_export_routes(server):
+    # GET /export/cohort/<doctor_id>.csv|parquet -> streamed download, for that doctor only
+    from flask import Response, abort, stream_with_context
+    from route_auth import require_doctor
+
+    @server.route('/export/cohort/<int:doctor_id>.<fmt>')
+    def export_cohort_route(doctor_id, fmt):
+        require_doctor(doctor_id)
+        if fmt not in EXPORT_FORMATS:
+            abort(404)
+        body = stream_cohort_export(doctor_id, fmt)
+        return Response(
+            stream_with_context(body),
+            mimetype=EXPORT_FORMATS[fmt],
+            headers={'Content-Disposition': f'attachment; filename=cohort_{doctor_id}.{fmt}'}
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export all sessions (per-frame angles) for a doctor's patients.")
+    parser.add_argument('doctor_id', type=int)
+    parser.add_argument('output', help="Output file path, or '-' for CSV on stdout")
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+    args = parser.parse_args()
+
+    if args.output == '-':
+        for chunk in stream_cohort_export(args.doctor_id, 'csv'):
+            sys.stdout.write(chunk)
+    else:
+        export_cohort(args.doctor_id, args.output, args.format)
@@ -0,0 +1,217 @@
+import sqlite3
+from datetime import date, timedelta
+
+# Materialized per-doctor statistics for the doctor dashboard.
+# Counters are maintained by triggers on patients / appointments / sessions, so the
+# dashboard reads a handful of rows instead of scanning history on every page load.
+
+DATABASE_PATH = 'theralink.db'
+
+STATS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS doctor_stats (
+        doctor_id INTEGER PRIMARY KEY,
+        patients_assigned INTEGER NOT NULL DEFAULT 0,
+        pending_reports INTEGER NOT NULL DEFAULT 0,
+        total_sessions INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS doctor_daily_stats (
+        doctor_id INTEGER NOT NULL,
+        day TEXT NOT NULL, -- YYYY-MM-DD
+        appointments INTEGER NOT NULL DEFAULT 0,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (doctor_id, day)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Helper fragments used inside the trigger bodies
+_SESSION_DOCTOR = "(SELECT doctor_id FROM patients WHERE patient_id = {row}.patient_id)"
+_APPOINTMENT_COUNTS = "lower({row}.status) != 'cancelled'"
+
+STATS_TRIGGERS = [
+    # --- patients: how many patients each doctor has ---
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_patient_insert AFTER INSERT ON patients
+    WHEN NEW.doctor_id IS NOT NULL
+    BEGIN
+        INSERT INTO doctor_stats (doctor_id, patients_assigned) VALUES (NEW.doctor_id, 1)
+        ON CONFLICT(doctor_id) DO UPDATE SET patients_assigned = patients_assigned + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_patient_reassign AFTER UPDATE OF doctor_id ON patients
+    WHEN OLD.doctor_id IS NOT NEW.doctor_id
+    BEGIN
+        UPDATE doctor_stats SET patients_assigned = patients_assigned - 1 WHERE doctor_id = OLD.doctor_id;
+        INSERT INTO doctor_stats (doctor_id, patients_assigned) SELECT NEW.doctor_id, 1 WHERE NEW.doctor_id IS NOT NULL
+        ON CONFLICT(doctor_id) DO UPDATE SET patients_assigned = patients_assigned + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_patient_delete AFTER DELETE ON patients
+    WHEN OLD.doctor_id IS NOT NULL
+    BEGIN
+        UPDATE doctor_stats SET patients_assigned = patients_assigned - 1 WHERE doctor_id = OLD.doctor_id;
+    END
+    ''',
+    # --- appointments: per doctor and day, cancelled ones do not count ---
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_appointment_insert AFTER INSERT ON appointments
+    WHEN {_APPOINTMENT_COUNTS.format(row='NEW')}
+    BEGIN
+        INSERT INTO doctor_daily_stats (doctor_id, day, appointments) VALUES (NEW.doctor_id, date(NEW.appointment_date), 1)
+        ON CONFLICT(doctor_id, day) DO UPDATE SET appointments = appointments + 1;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_appointment_update AFTER UPDATE OF doctor_id, appointment_date, status ON appointments
+    BEGIN
+        UPDATE doctor_daily_stats SET appointments = appointments - 1
+        WHERE {_APPOINTMENT_COUNTS.format(row='OLD')} AND doctor_id = OLD.doctor_id AND day = date(OLD.appointment_date);
+        INSERT INTO doctor_daily_stats (doctor_id, day, appointments)
+        SELECT NEW.doctor_id, date(NEW.appointment_date), 1 WHERE {_APPOINTMENT_COUNTS.format(row='NEW')}
+        ON CONFLICT(doctor_id, day) DO UPDATE SET appointments = appointments + 1;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_appointment_delete AFTER DELETE ON appointments
+    WHEN {_APPOINTMENT_COUNTS.format(row='OLD')}
+    BEGIN
+        UPDATE doctor_daily_stats SET appointments = appointments - 1
+        WHERE doctor_id = OLD.doctor_id AND day = date(OLD.appointment_date);
+    END
+    ''',
+    # --- sessions: attributed to the patient's doctor at the time they are recorded ---
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_session_insert AFTER INSERT ON sessions
+    WHEN {_SESSION_DOCTOR.format(row='NEW')} IS NOT NULL
+    BEGIN
+        INSERT INTO doctor_daily_stats (doctor_id, day, sessions) VALUES ({_SESSION_DOCTOR.format(row='NEW')}, date(NEW.date), 1)
+        ON CONFLICT(doctor_id, day) DO UPDATE SET sessions = sessions + 1;
+        INSERT INTO doctor_stats (doctor_id, total_sessions, pending_reports)
+        VALUES ({_SESSION_DOCTOR.format(row='NEW')}, 1, NEW.report_generated != 0)
+        ON CONFLICT(doctor_id) DO UPDATE SET total_sessions = total_sessions + 1,
+                                             pending_reports = pending_reports + excluded.pending_reports;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_session_report AFTER UPDATE OF report_generated ON sessions
+    WHEN (OLD.report_generated != 0) != (NEW.report_generated != 0)
+    BEGIN
+        UPDATE doctor_stats SET pending_reports = pending_reports + (CASE WHEN NEW.report_generated != 0 THEN 1 ELSE -1 END)
+        WHERE doctor_id = {_SESSION_DOCTOR.format(row='NEW')};
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_stats_session_delete AFTER DELETE ON sessions
+    WHEN {_SESSION_DOCTOR.format(row='OLD')} IS NOT NULL
+    BEGIN
+        UPDATE doctor_daily_stats SET sessions = sessions - 1
+        WHERE doctor_id = {_SESSION_DOCTOR.format(row='OLD')} AND day = date(OLD.date);
+        UPDATE doctor_stats SET total_sessions = total_sessions - 1,
+                                pending_reports = pending_reports - (OLD.report_generated != 0)
+        WHERE doctor_id = {_SESSION_DOCTOR.format(row='OLD')};
+    END
+    ''',
+]
+
+
+def _column_names(cursor, table):
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+
+
+def init_stats_schema(conn=None):
+    # Requires the users/patients/appointments (app.py) and sessions (app_squat.py) tables
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+
+    # Sessions flagged for the doctor's review (read by the notification dropdown)
+    if 'report_generated' not in _column_names(cursor, 'sessions'):
+        cursor.execute("ALTER TABLE sessions ADD COLUMN report_generated INTEGER NOT NULL DEFAULT 0")
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='doctor_stats'")
+    needs_backfill = cursor.fetchone() is None
+
+    for statement in STATS_SCHEMA + STATS_TRIGGERS:
+        cursor.execute(statement)
+    conn.commit()
+
+    if needs_backfill:
+        rebuild_doctor_stats(conn)
+    if own_conn:
+        conn.close()
+
+
+def rebuild_doctor_stats(conn=None):
+    # Full recompute; only needed once after the tables are created (or to repair drift)
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    cursor.execute("DELETE FROM doctor_stats")
+    cursor.execute("DELETE FROM doctor_daily_stats")
+    cursor.execute('''
+        INSERT INTO doctor_stats (doctor_id, patients_assigned)
+        SELECT doctor_id, COUNT(*) FROM patients WHERE doctor_id IS NOT NULL GROUP BY doctor_id
+    ''')
+    cursor.execute('''
+        INSERT INTO doctor_stats (doctor_id, total_sessions, pending_reports)
+        SELECT p.doctor_id, COUNT(*), SUM(s.report_generated != 0)
+        FROM sessions s JOIN patients p ON p.patient_id = s.patient_id
+        WHERE p.doctor_id IS NOT NULL
+        GROUP BY p.doctor_id
+        ON CONFLICT(doctor_id) DO UPDATE SET total_sessions = excluded.total_sessions,
+                                             pending_reports = excluded.pending_reports
+    ''')
+    cursor.execute('''
+        INSERT INTO doctor_daily_stats (doctor_id, day, appointments)
+        SELECT doctor_id, date(appointment_date), COUNT(*)
+        FROM appointments WHERE lower(status) != 'cancelled'
+        GROUP BY doctor_id, date(appointment_date)
+    ''')
+    cursor.execute('''
+        INSERT INTO doctor_daily_stats (doctor_id, day, sessions)
+        SELECT p.doctor_id, date(s.date), COUNT(*)
+        FROM sessions s JOIN patients p ON p.patient_id = s.patient_id
+        WHERE p.doctor_id IS NOT NULL
+        GROUP BY p.doctor_id, date(s.date)
+        ON CONFLICT(doctor_id, day) DO UPDATE SET sessions = excluded.sessions
+    ''')
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+def get_doctor_dashboard_stats(doctor_id, days=7, today=None):
+    # One primary-key range read: totals plus the last `days` days of daily counters
+    today = today or date.today()
+    first_day = today - timedelta(days=days - 1)
+    conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT s.patients_assigned, s.pending_reports, s.total_sessions, d.day, d.appointments, d.sessions
+        FROM (SELECT ? AS doctor_id) AS k
+        LEFT JOIN doctor_stats s ON s.doctor_id = k.doctor_id
+        LEFT JOIN doctor_daily_stats d ON d.doctor_id = k.doctor_id AND d.day BETWEEN ? AND ?
+    ''', (doctor_id, first_day.isoformat(), today.isoformat()))
+    rows = cursor.fetchall()
+    conn.close()
+
+    patients_assigned, pending_reports, total_sessions = (rows[0][:3] if rows else (None, None, None))
+    daily = {row[3]: (row[4], row[5]) for row in rows if row[3] is not None}
+    days_list = [(first_day + timedelta(days=i)).isoformat() for i in range(days)]
+    return {
+        'patients_assigned': patients_assigned or 0,
+        'pending_reports': pending_reports or 0,
+        'total_sessions': total_sessions or 0,
+        'appointments_today': daily.get(today.isoformat(), (0, 0))[0],
+        'days': days_list,
+        'appointments_per_day': [daily.get(d, (0, 0))[0] for d in days_list],
+        'sessions_per_day': [daily.get(d, (0, 0))[1] for d in days_list],
+    }
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import argparse
+import threading
+from collections import deque
+import numpy as np
+from pose_features import FEATURE_NAMES, N_FEATURES
+from landmark_recorder import N_LANDMARKS, N_VALUES
+
+# Training data collection for the form classifier.
+# The capture loop hands each labelled frame (57 features, raw landmarks, label letters) to
+# record(), which only appends to a deque: no lock, no file I/O, never blocks. A background thread
+# drains the deque into preallocated shard buffers and writes every SHARD_FRAMES frames as one
+# .npz shard (temporary name + rename, so a shard on disk is always complete), then rewrites
+# manifest.json listing the shards with their recording id and frame and label counts. A shard
+# never spans two recordings (new_recording() ends the current one), so train_pipeline.py can keep
+# every frame of a recording on the same side of a train/validation split.
+# The loader reads one shard at a time, so training never holds the whole dataset in memory.
+
+DATASET_DIR = os.environ.get('THERALINK_DATASET_DIR', 'dataset')
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Classifier outputs, in model output order (live_demo.py / live_demo_all.py)
+LABEL_LETTERS = ('c', 'k', 'h', 'r', 'x', 'i')
+
+SHARD_FRAMES = 4096
+MAX_PENDING_FRAMES = 8192 # frames waiting for the writer before record() starts dropping
+WRITER_POLL_SECONDS = 0.05
+
+
+def label_vector(label):
+    # 'kx' -> multi-hot uint8 vector over LABEL_LETTERS
+    return np.array([letter in label for letter in LABEL_LETTERS], dtype=np.uint8)
+
+
+def load_manifest(directory=None):
+    path = os.path.join(directory or DATASET_DIR, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {'version': MANIFEST_VERSION, 'feature_names': list(FEATURE_NAMES),
+                'label_letters': list(LABEL_LETTERS), 'shards': []}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('feature_names') != list(FEATURE_NAMES):
+        raise ValueError(f"{path}: recorded with a different manifest version or feature set")
+    return manifest
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+class DatasetRecorder:
+    def __init__(self, directory=None, shard_frames=SHARD_FRAMES, max_pending=MAX_PENDING_FRAMES):
+        self.directory = directory or DATASET_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self.shard_frames = shard_frames
+        self.max_pending = max_pending
+        self._manifest = load_manifest(self.directory)
+        self._pending = deque() # append (capture loop) / popleft (writer) are atomic
+        self._buffers = {
+            't': np.empty(shard_frames, dtype=np.float64),
+            'features': np.empty((shard_frames, N_FEATURES), dtype=np.float32),
+            'landmarks': np.empty((shard_frames, N_LANDMARKS, N_VALUES), dtype=np.float16),
+            'labels': np.empty((shard_frames, len(LABEL_LETTERS)), dtype=np.uint8),
+        }
+        self._filled = 0
+        self._recording_id = self._new_recording_id()
+        self._shard_recording_id = None
+        self._counters = {'recorded': 0, 'dropped': 0, 'written': 0, 'shards': 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='dataset-recorder', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _new_recording_id():
+        return f"{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+    # --- capture side ---
+    def new_recording(self):
+        # Call when the operator starts recording: later frames go to shards of a new recording
+        self._recording_id = self._new_recording_id()
+
+    def record(self, features, landmarks, label, t=None):
+        # Returns False (and counts a drop) when the writer is too far behind
+        if len(self._pending) >= self.max_pending or self._stop.is_set():
+            self._counters['dropped'] += 1
+            return False
+        self._pending.append((time.time() if t is None else t, features, landmarks, label, self._recording_id))
+        self._counters['recorded'] += 1
+        return True
+
+    # --- writer side ---
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._drain():
+                self._stop.wait(WRITER_POLL_SECONDS)
+        self._drain()
+        self._write_shard()
+
+    def _drain(self):
+        drained = 0
+        buffers = self._buffers
+        while self._pending:
+            t, features, landmarks, label, recording_id = self._pending.popleft()
+            if self._filled and recording_id != self._shard_recording_id:
+                self._write_shard() # The previous recording ended mid-shard
+            self._shard_recording_id = recording_id
+            i = self._filled
+            buffers['t'][i] = t
+            buffers['features'][i] = features
+            buffers['landmarks'][i] = landmarks
+            buffers['labels'][i] = label_vector(label)
+            self._filled += 1
+            drained += 1
+            if self._filled == self.shard_frames:
+                self._write_shard()
+        return drained
+
+    def _write_shard(self):
+        if not self._filled:
+            return
+        n = self._filled
+        name = f"shard_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}.npz"
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **{key: buffer[:n] for key, buffer in self._buffers.items()})
+        os.replace(path + '.tmp', path)
+        self._manifest['shards'].append({
+            'file': name, 'recording': self._shard_recording_id, 'frames': n, 'start_t': float(self._buffers['t'][0]), 'end_t': float(self._buffers['t'][n - 1]),
+            'label_counts': self._buffers['labels'][:n].sum(axis=0).tolist(),
+        })
+        _write_manifest(self.directory, self._manifest)
+        self._filled = 0
+        self._counters['written'] += n
+        self._counters['shards'] += 1
+
+    def close(self):
+        # Write everything recorded so far (the last shard may be short)
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join()
+
+    def stats(self):
+        return dict(self._counters, pending=len(self._pending), buffered=self._filled)
+
+
+# --- loading ---
+
+def dataset_frames(directory=None):
+    return sum(shard['frames'] for shard in load_manifest(directory)['shards'])
+
+
+def iter_shards(directory=None, fields=('features', 'labels'), shards=None):
+    # One shard's arrays at a time: {field: array}. `shards` selects manifest entries by position.
+    directory = directory or DATASET_DIR
+    entries = load_manifest(directory)['shards']
+    for i in (range(len(entries)) if shards is None else shards):
+        with np.load(os.path.join(directory, entries[i]['file'])) as shard:
+            yield {field: shard[field] for field in fields}
+
+
+def iter_batches(directory=None, batch_size=256, shuffle=True, seed=None, fields=('features', 'labels'), shards=None):
+    # Mini-batches of the given fields. Shuffling is over shard order and within each shard, so at
+    # most one shard (plus one partial batch) is in memory.
+    rng = np.random.default_rng(seed)
+    entries = load_manifest(directory)['shards']
+    order = np.arange(len(entries)) if shards is None else np.asarray(shards)
+    if shuffle:
+        order = rng.permutation(order)
+    carry = None
+    for shard in iter_shards(directory, fields, order):
+        if shuffle:
+            permutation = rng.permutation(len(shard[fields[0]]))
+            shard = {field: values[permutation] for field, values in shard.items()}
+        if carry is not None:
+            shard = {field: np.concatenate((carry[field], shard[field])) for field in fields}
+        n = len(shard[fields[0]])
+        whole = n - n % batch_size
+        for start in range(0, whole, batch_size):
+            yield tuple(shard[field][start:start + batch_size] for field in fields)
+        carry = {field: shard[field][whole:] for field in fields}
+    if carry is not None and len(carry[fields[0]]):
+        yield tuple(carry[field] for field in fields)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise a recorded dataset, or time the recorder on synthetic frames.")
+    parser.add_argument('--directory', default=DATASET_DIR)
+    parser.add_argument('--benchmark', type=int, metavar='FRAMES', help="Record this many synthetic frames")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        recorder = DatasetRecorder(args.directory, max_pending=args.benchmark) # measure, don't drop
+        rng = np.random.default_rng(0)
+        features = rng.normal(size=(256, N_FEATURES)).astype(np.float32)
+        landmarks = rng.uniform(size=(256, N_LANDMARKS, N_VALUES)).astype(np.float32)
+        worst = 0.0
+        start = time.perf_counter()
+        for i in range(args.benchmark):
+            call = time.perf_counter()
+            recorder.record(features[i % 256], landmarks[i % 256], LABEL_LETTERS[i % len(LABEL_LETTERS)])
+            worst = max(worst, time.perf_counter() - call)
+        elapsed = time.perf_counter() - start
+        recorder.close()
+        written = time.perf_counter() - start
+        print(f"record(): {elapsed / args.benchmark * 1e6:.1f} us/frame on average, worst {worst * 1e6:.0f} us; "
+              f"all written after {written:.2f}s ({args.benchmark / written:,.0f} frames/s); {recorder.stats()}",
+              file=sys.stderr)
+
+    manifest = load_manifest(args.directory)
+    counts = np.sum([shard['label_counts'] for shard in manifest['shards']], axis=0) if manifest['shards'] else []
+    print(f"{len(manifest['shards'])} shards, {dataset_frames(args.directory)} frames")
+    for letter, count in zip(LABEL_LETTERS, counts):
+        print(f"  {letter}: {count}")
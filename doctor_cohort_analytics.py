@@ -0,0 +1,114 @@
+import dash
+from dash import dcc, html, dash_table, Input, Output, callback
+import dash_bootstrap_components as dbc
+import plotly.express as px
+import pandas as pd
+from cohort_analytics import get_cohort_analytics, STATUS_LABELS, ANALYTICS_WINDOW_DAYS
+
+dash.register_page(__name__, path='/doctor_cohort_analytics', title='Cohort Analytics', order=2)
+
+STATUS_COLORS = {
+    'Improving': 'success', 'Plateauing': 'warning', 'Declining': 'danger',
+    'Inactive': 'secondary', 'Insufficient data': 'light',
+}
+
+COHORT_TABLE_COLUMNS = [
+    ('name', "Patient"), ('status', "Status"), ('sessions', "Sessions"), ('adherence', "Adherence (%)"),
+    ('completion', "Reps Completed (%)"), ('knee_rom', "Knee ROM (°)"), ('knee_slope', "Knee Trend (°/wk)"),
+    ('hip_rom', "Hip ROM (°)"), ('hip_slope', "Hip Trend (°/wk)"), ('days_since_last', "Days Since Last"),
+    ('risk', "Risk"),
+]
+
+
+def cohort_table(table_id, page_size):
+    return dash_table.DataTable(
+        id=table_id,
+        columns=[{'name': label, 'id': key} for key, label in COHORT_TABLE_COLUMNS],
+        data=[],
+        sort_action='native',
+        filter_action='native',
+        page_action='native',
+        page_size=page_size,
+        style_table={'overflowX': 'auto'},
+        style_cell={'textAlign': 'left', 'padding': '6px', 'minWidth': '80px'},
+        style_header={'fontWeight': 'bold'},
+        style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': '#f8f9fa'}],
+    )
+
+
+layout = dbc.Container([
+    html.H2("Cohort Analytics", className="text-center my-4"),
+
+    dbc.Row([
+        dbc.Col(html.P("Range-of-motion trends and adherence across all of your patients.", className="text-muted"),
+                width=8),
+        dbc.Col(dcc.Dropdown(
+            id='cohort-analytics-window',
+            options=[{'label': f"Last {days} days", 'value': days} for days in (30, 90, 180, 365)],
+            value=ANALYTICS_WINDOW_DAYS,
+            clearable=False
+        ), width=4),
+    ], className="mb-3"),
+
+    dbc.Row([
+        dbc.Col(dbc.Card([
+            dbc.CardHeader(label),
+            dbc.CardBody(html.H3("0", id=f"cohort-analytics-count-{i}", className=f"text-{STATUS_COLORS[label]}"))
+        ], className="shadow"))
+        for i, label in enumerate(STATUS_LABELS)
+    ], className="mb-4"),
+
+    dbc.Row([
+        dbc.Col(dbc.Card([
+            dbc.CardHeader("Trend vs. Adherence"),
+            dbc.CardBody(dcc.Graph(id="cohort-analytics-trend-graph"))
+        ], className="shadow mb-4"), width=7),
+
+        dbc.Col(dbc.Card([
+            dbc.CardHeader("Most At-Risk Patients"),
+            dbc.CardBody(cohort_table('cohort-analytics-at-risk-table', page_size=10))
+        ], className="shadow mb-4"), width=5),
+    ]),
+
+    dbc.Card([
+        dbc.CardHeader("All Patients"),
+        dbc.CardBody(cohort_table('cohort-analytics-table', page_size=25))
+    ], className="shadow mb-4"),
+    html.P(id="cohort-analytics-timing", className="text-muted small text-end"),
+], fluid=True)
+
+
+@callback(
+    *[Output(f"cohort-analytics-count-{i}", 'children') for i in range(len(STATUS_LABELS))],
+    Output('cohort-analytics-trend-graph', 'figure'),
+    Output('cohort-analytics-at-risk-table', 'data'),
+    Output('cohort-analytics-table', 'data'),
+    Output('cohort-analytics-timing', 'children'),
+    Input('user-id-store', 'data'), # Doctor's ID from app.py
+    Input('cohort-analytics-window', 'value'),
+    Input('url', 'pathname') # Refresh on page load
+)
+def update_cohort_analytics(doctor_id, window_days, pathname):
+    if not doctor_id:
+        raise dash.exceptions.PreventUpdate
+
+    # Cached per doctor and data version; recomputed only after new sessions or patients
+    result = get_cohort_analytics(doctor_id, window_days=window_days or ANALYTICS_WINDOW_DAYS)
+    counts = [str(result['status_counts'][label]) for label in STATUS_LABELS]
+
+    df = pd.DataFrame(result['patients'], columns=[key for key, _ in COHORT_TABLE_COLUMNS] + ['patient_id'])
+    df_trend = df.dropna(subset=['knee_slope', 'adherence'])
+    if df_trend.empty:
+        trend_fig = px.scatter(title="No range-of-motion trends in this period")
+    else:
+        trend_fig = px.scatter(
+            df_trend, x='adherence', y='knee_slope', color='status', hover_name='name',
+            labels={'adherence': "Adherence (%)", 'knee_slope': "Knee ROM trend (°/week)"},
+            category_orders={'status': list(STATUS_LABELS)}, title="Knee ROM Trend by Adherence"
+        )
+        trend_fig.add_hline(y=0, line_dash='dot', line_color='grey')
+
+    timings = result['timings']
+    timing_text = (f"{len(result['patients'])} patients · loaded in {timings['load'] * 1000:.0f} ms, "
+                   f"computed in {timings['compute'] * 1000:.0f} ms")
+    return (*counts, trend_fig, result['at_risk'], result['patients'], timing_text)
@@ -1,20 +1,11 @@
-from dash import html, dcc
+import dash
+from dash import html, dcc, Input, Output, callback
 import dash_bootstrap_components as dbc
 import plotly.express as px
 import pandas as pd
+from dashboard_stats import get_doctor_dashboard_stats
 
-# Dummy data for demonstration
-df_patients = pd.DataFrame({
-    "Day": ["Mon", "Tue", "Wed", "Thu", "Fri"],
-    "Patients": [5, 7, 3, 8, 6]
-})
-df_reports = pd.DataFrame({
-    "Status": ["Completed", "Pending"],
-    "Count": [25, 10]
-})
-
-bar_fig = px.bar(df_patients, x="Day", y="Patients", title="Patients per Day", text_auto=True)
-pie_fig = px.pie(df_reports, names="Status", values="Count", title="Reports Status")
+dash.register_page(__name__, path='/doctor_dashboard', title='Doctor Dashboard', order=0)
 
 layout = dbc.Container([
     html.H2("Doctor Dashboard", className="text-center my-4"),
@@ -22,29 +13,61 @@ layout = dbc.Container([
     dbc.Row([
         dbc.Col(dbc.Card([
             dbc.CardHeader("Total Patients"),
-            dbc.CardBody(html.H3("42", className="text-success"))
+            dbc.CardBody(html.H3("0", id="doctor-dashboard-total-patients", className="text-success"))
         ], className="shadow"), width=4),
 
         dbc.Col(dbc.Card([
             dbc.CardHeader("Appointments Today"),
-            dbc.CardBody(html.H3("8", className="text-primary"))
+            dbc.CardBody(html.H3("0", id="doctor-dashboard-appointments-today", className="text-primary"))
         ], className="shadow"), width=4),
 
         dbc.Col(dbc.Card([
             dbc.CardHeader("Pending Reports"),
-            dbc.CardBody(html.H3("10", className="text-danger"))
+            dbc.CardBody(html.H3("0", id="doctor-dashboard-pending-reports", className="text-danger"))
         ], className="shadow"), width=4),
     ], className="mb-4"),
 
     dbc.Row([
         dbc.Col(dbc.Card([
             dbc.CardHeader("Patients Analytics"),
-            dbc.CardBody(dcc.Graph(figure=bar_fig))
+            dbc.CardBody(dcc.Graph(id="doctor-dashboard-sessions-graph"))
         ], className="shadow mb-4"), width=6),
 
         dbc.Col(dbc.Card([
             dbc.CardHeader("Reports Analytics"),
-            dbc.CardBody(dcc.Graph(figure=pie_fig))
+            dbc.CardBody(dcc.Graph(id="doctor-dashboard-reports-graph"))
         ], className="shadow mb-4"), width=6),
     ])
 ], fluid=True)
+
+
+@callback(
+    Output('doctor-dashboard-total-patients', 'children'),
+    Output('doctor-dashboard-appointments-today', 'children'),
+    Output('doctor-dashboard-pending-reports', 'children'),
+    Output('doctor-dashboard-sessions-graph', 'figure'),
+    Output('doctor-dashboard-reports-graph', 'figure'),
+    Input('user-id-store', 'data'), # Doctor's ID from app.py
+    Input('url', 'pathname') # Refresh on page load
+)
+def update_doctor_dashboard(doctor_id, pathname):
+    if not doctor_id:
+        raise dash.exceptions.PreventUpdate
+
+    # Counters are maintained by triggers (see dashboard_stats.py), so this is a single indexed read
+    stats = get_doctor_dashboard_stats(doctor_id)
+
+    df_sessions = pd.DataFrame({
+        "Day": [pd.to_datetime(d).strftime('%a') for d in stats['days']],
+        "Sessions": stats['sessions_per_day']
+    })
+    df_reports = pd.DataFrame({
+        "Status": ["Reviewed", "Pending"],
+        "Count": [max(stats['total_sessions'] - stats['pending_reports'], 0), stats['pending_reports']]
+    })
+
+    bar_fig = px.bar(df_sessions, x="Day", y="Sessions", title="Patient Sessions per Day", text_auto=True)
+    pie_fig = px.pie(df_reports, names="Status", values="Count", title="Reports Status")
+
+    return (str(stats['patients_assigned']), str(stats['appointments_today']), str(stats['pending_reports']),
+            bar_fig, pie_fig)
@@ -7,11 +7,34 @@ import pandas as pd
 import sqlite3
 import json # For handling joint_angles_json
 from datetime import datetime
+from query_cache import cached_query
+from session_history import get_session, get_session_angles, get_exercise_types, get_session_aggregates, \
+    get_joint_angle_aggregates
+from session_table import session_table, fetch_session_table_page
+from search_index import search_sessions, search_patients, SEARCH_PAGE_SIZE
+from patient_search import search_patient_prefix, count_doctor_patients, TYPEAHEAD_LIMIT
+from skeleton_replay import get_recording_path, replay_url
+from template_matching import get_patient_similarity_trend
 
 dash.register_page(__name__, path='/doctor_patient_details', title='Patient Details', order=2)
 
 DATABASE_PATH = 'theralink.db'
 
+SESSION_TABLE_COLUMNS = [
+    ('date', "Date"), ('exercise_type', "Exercise Type"), ('reps_achieved', "Total Reps"),
+    ('exercise_duration', "Duration (s)"),
+]
+
+
+def format_session_row(row):
+    return {
+        'date': pd.to_datetime(row['date']).strftime('%Y-%m-%d %H:%M'),
+        'exercise_type': row['exercise_type'],
+        'reps_achieved': row['reps_achieved'],
+        'exercise_duration': row['exercise_duration'],
+    }
+
+@cached_query('patient_details', entity='patient')
 def get_patient_details(patient_id):
     conn = sqlite3.connect(DATABASE_PATH)
     # Join with users to get username
@@ -24,38 +47,49 @@ def get_patient_details(patient_id):
     conn.close()
     return patient_df.iloc[0] if not patient_df.empty else None
 
-def get_patient_sessions(patient_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    df = pd.read_sql_query(f"""
-        SELECT *
-        FROM sessions
-        WHERE patient_id = {patient_id}
-        ORDER BY date DESC
-    """, conn)
-    conn.close()
-    return df
-
-# Helper to get doctor's patients
-def get_doctor_patients(doctor_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    df = pd.read_sql_query(f"""
-        SELECT p.patient_id, p.name, u.username as patient_username
-        FROM patients p
-        JOIN users u ON p.patient_id = u.id
-        WHERE p.doctor_id = {doctor_id}
-    """, conn)
-    conn.close()
-    return df
-
-def list_layout(doctor_username=None):
+def list_layout(doctor_username=None, doctor_id=None):
     # This layout is for listing all patients for the doctor
     return dbc.Container([
         dcc.Store(id='doctor-id-store-patient-list', storage_type='session'),
         html.H1(f"My Patients (Dr. {doctor_username})", className="mb-4 text-center"),
+        html.Div([
+            # Streamed by cohort_export.py; rows are per-frame joint angles for every session
+            html.A(dbc.Button([html.I(className="fas fa-file-csv me-2"), "Export Cohort (CSV)"],
+                              color="outline-primary", size="sm", className="me-2"),
+                   href=f"/export/cohort/{doctor_id}.csv"),
+            html.A(dbc.Button([html.I(className="fas fa-database me-2"), "Export Cohort (Parquet)"],
+                              color="outline-primary", size="sm"),
+                   href=f"/export/cohort/{doctor_id}.parquet"),
+        ], className="text-end mb-2") if doctor_id else None,
         html.Hr(),
+        dbc.Card([
+            dbc.CardHeader("Search Session Notes"),
+            dbc.CardBody([
+                dcc.Store(id='session-search-page', data=0),
+                dbc.Input(id='session-search-input', type='search', debounce=True,
+                          placeholder='e.g. knee pain, "good depth"', className="mb-3"),
+                html.Div(id='session-search-results'),
+                html.Div([
+                    dbc.Button("Previous", id='session-search-prev', color="outline-secondary", size="sm",
+                               className="me-2", disabled=True),
+                    dbc.Button("Next", id='session-search-next', color="outline-secondary", size="sm", disabled=True),
+                ], className="text-end mt-2")
+            ])
+        ], className="mb-4"),
         dbc.Card([
             dbc.CardHeader("Assigned Patients"),
-            dbc.CardBody(id="all-patients-list-content") # Populated by callback
+            dbc.CardBody([
+                dcc.Store(id='patient-list-page', data=0),
+                dbc.Input(id='patient-list-search', type='search', debounce=True,
+                          placeholder="Search by name, contact or username...", className="mb-2"),
+                html.P(id='patient-list-count', className="text-muted small"),
+                html.Div(id="all-patients-list-content"), # Populated by callback
+                html.Div([
+                    dbc.Button("Previous", id='patient-list-prev', color="outline-secondary", size="sm",
+                               className="me-2", disabled=True),
+                    dbc.Button("Next", id='patient-list-next', color="outline-secondary", size="sm", disabled=True),
+                ], className="text-end mt-2")
+            ])
         ])
     ], className="mt-4")
 
@@ -63,6 +97,7 @@ def detail_layout():
     # This layout is for showing details of a specific patient
     return dbc.Container([
         dcc.Store(id='selected-patient-id-on-page', storage_type='session'),
+        dcc.Store(id='patient-session-page-cursors', data={}), # Keyset cursor per table page
         html.H1("Patient Details", className="mb-4 text-center text-primary"),
         html.Hr(),
 
@@ -94,8 +129,11 @@ def detail_layout():
                 html.Hr(),
                 dcc.Graph(id='patient-joint-angle-progress-graph'),
                 html.Hr(),
+                dcc.Graph(id='patient-form-similarity-graph'),
+                html.Hr(),
                 html.H5("Detailed Session Log"),
-                html.Div(id='patient-detailed-session-table', className="mt-3"),
+                html.P("Click a row to see the session's details.", className="text-muted small"),
+                html.Div(session_table('patient-detailed-session-table', SESSION_TABLE_COLUMNS), className="mt-3"),
                 dbc.Collapse(
                     dbc.Card(dbc.CardBody(id='selected-patient-session-data')),
                     id='patient-session-detail-collapse',
@@ -108,26 +146,58 @@ def detail_layout():
     ], className="mt-4")
 
 
-# Callback for listing all patients a doctor is assigned to
+# Callback for listing the doctor's patients: the first patients alphabetically before anything is typed,
+# then ranked full-text matches on name, contact and username (search_index.py), one page at a time
 @callback(
     Output('all-patients-list-content', 'children'),
+    Output('patient-list-count', 'children'),
     Output('doctor-id-store-patient-list', 'data'),
+    Output('patient-list-page', 'data'),
+    Output('patient-list-prev', 'disabled'),
+    Output('patient-list-next', 'disabled'),
     Input('user-id-store', 'data'), # Get doctor ID from app.py
-    Input('url', 'pathname') # Trigger on page load
+    Input('url', 'pathname'), # Trigger on page load
+    Input('patient-list-search', 'value'),
+    Input('patient-list-prev', 'n_clicks'),
+    Input('patient-list-next', 'n_clicks'),
+    State('patient-list-page', 'data')
 )
-def update_all_patients_list(doctor_id, pathname):
+def update_all_patients_list(doctor_id, pathname, search_text, prev_clicks, next_clicks, page):
     if not doctor_id:
-        return html.P("Please log in as a doctor."), dash.no_update
-    
-    patients_df = get_doctor_patients(doctor_id)
-    if patients_df.empty:
-        return html.P("You are not assigned to any patients yet."), doctor_id
+        return html.P("Please log in as a doctor."), None, dash.no_update, 0, True, True
+
+    ctx = dash.callback_context
+    trigger_id = ctx.triggered[0]['prop_id'] if ctx.triggered else None
+    if trigger_id == 'patient-list-next.n_clicks':
+        page = (page or 0) + 1
+    elif trigger_id == 'patient-list-prev.n_clicks':
+        page = max((page or 0) - 1, 0)
+    else:
+        page = 0 # New search text or page load
+
+    searching = bool((search_text or '').strip())
+    if searching:
+        results = search_patients(doctor_id, search_text, page=page, page_size=SEARCH_PAGE_SIZE)
+        patients, has_more = results['hits'], results['has_more']
+    else:
+        patients, has_more, page = search_patient_prefix(doctor_id, None, TYPEAHEAD_LIMIT), False, 0
+    if not patients:
+        if searching:
+            return html.P("No patients match your search."), None, doctor_id, page, page == 0, True
+        return html.P("You are not assigned to any patients yet."), None, doctor_id, page, True, True
+
+    if searching:
+        first = page * SEARCH_PAGE_SIZE + 1
+        count_text = f"Matches {first}-{first + len(patients) - 1}"
+    else:
+        count_text = f"Showing {len(patients)} of {count_doctor_patients(doctor_id)} patients - type to search"
 
     patient_cards = [
         dbc.Card(
             dbc.CardBody([
                 html.H5(patient['name'], className="card-title"),
-                html.P(f"Username: {patient['patient_username']}", className="card-text"),
+                html.P(f"Username: {patient['username']}", className="card-text"),
+                html.P(f"Contact: {patient['contact']}", className="card-text") if patient.get('contact') else None,
                 dbc.Button(
                     "View Details",
                     id={'type': 'view-patient-details-btn', 'index': patient['patient_id']},
@@ -138,9 +208,9 @@ def update_all_patients_list(doctor_id, pathname):
             ]),
             className="mb-3"
         )
-        for index, patient in patients_df.iterrows()
+        for patient in patients
     ]
-    return patient_cards, doctor_id
+    return patient_cards, count_text, doctor_id, page, page == 0, not has_more
 
 # Main layout for the page
 # This callback determines whether to show the list view or the detail view
@@ -168,7 +238,7 @@ def display_page(url_search, user_id, user_role):
     conn.close()
     doctor_username = doctor_username_df['username'].iloc[0] if not doctor_username_df.empty else "Unknown"
 
-    return list_layout(doctor_username)
+    return list_layout(doctor_username, user_id)
 
 
 # Callback to populate patient details in the detail view
@@ -209,166 +279,152 @@ def update_patient_details_display(url_search):
     Output('patient-session-exercise-filter', 'options'),
     Output('patient-reps-progress-graph', 'figure'),
     Output('patient-joint-angle-progress-graph', 'figure'),
-    Output('patient-detailed-session-table', 'children'),
     Input('selected-patient-id-on-page', 'data'),
     Input('patient-session-exercise-filter', 'value'),
     prevent_initial_call=True
 )
 def update_patient_session_data(patient_id, selected_exercise_type):
     if not patient_id:
-        return [], go.Figure(), go.Figure(), html.P("No patient selected.")
+        return [], go.Figure(), go.Figure()
 
-    sessions_df = get_patient_sessions(patient_id)
-    
-    if sessions_df.empty:
-        return [], go.Figure(), go.Figure(), html.P("No session data available for this patient.")
+    # Graphs are built from per-day/week/month aggregates computed in SQL, so the page costs the
+    # same however long the patient's history is
+    exercise_options = [{'label': i, 'value': i} for i in get_exercise_types(patient_id)]
+    if not exercise_options:
+        return [], go.Figure(), go.Figure()
 
-    # Convert date to datetime objects for sorting and plotting
-    sessions_df['date'] = pd.to_datetime(sessions_df['date'])
-    sessions_df = sessions_df.sort_values(by='date')
-
-    # Get unique exercise types for the dropdown
-    exercise_options = [{'label': i, 'value': i} for i in sessions_df['exercise_type'].unique()]
-
-    filtered_sessions_df = sessions_df
-    if selected_exercise_type:
-        filtered_sessions_df = sessions_df[sessions_df['exercise_type'] == selected_exercise_type]
-        if filtered_sessions_df.empty:
-            return exercise_options, go.Figure(), go.Figure(), html.P(f"No '{selected_exercise_type}' sessions found.")
+    bucket, buckets = get_session_aggregates(patient_id, selected_exercise_type, by_exercise=True)
+    if not buckets:
+        return exercise_options, go.Figure(), go.Figure()
+    agg_df = pd.DataFrame(buckets)
+    agg_df['bucket'] = pd.to_datetime(agg_df['bucket'])
+    period = bucket.capitalize()
 
     # Reps Progress Graph
     reps_fig = px.line(
-        filtered_sessions_df,
-        x='date',
-        y='total_reps',
+        agg_df,
+        x='bucket',
+        y='reps_achieved',
         color='exercise_type' if not selected_exercise_type else None,
         markers=True,
-        title='Total Repetitions Over Time'
+        title=f'Total Repetitions per {period}'
     )
     reps_fig.update_layout(xaxis_title="Date", yaxis_title="Total Reps", hovermode="x unified")
 
-    # Joint Angle Progress Graph (more complex - needs to parse JSON)
+    # Joint Angle Progress Graph, from the per-session summary table (no JSON parsing)
     joint_angle_fig = go.Figure()
-    joint_angle_fig.update_layout(title='Average Joint Angles Over Time', xaxis_title="Date", yaxis_title="Angle (degrees)")
-
-    # Group by exercise type if no specific filter is applied
-    if not selected_exercise_type:
-        for exercise in filtered_sessions_df['exercise_type'].unique():
-            exercise_df = filtered_sessions_df[filtered_sessions_df['exercise_type'] == exercise]
-            for joint in ['knee', 'hip', 'ankle', 'shoulder', 'elbow', 'wrist']: # Example joints
-                joint_angles_data = []
-                dates = []
-                for idx, row in exercise_df.iterrows():
-                    try:
-                        angles_json = json.loads(row['joint_angles_json'])
-                        if joint in angles_json:
-                            # Assuming joint_angles_json contains a dict like {'knee': [angles], 'hip': [angles]}
-                            # We'll take the mean for simplicity for a progress graph
-                            joint_angles_data.append(sum(angles_json[joint]) / len(angles_json[joint]))
-                            dates.append(row['date'])
-                    except (json.JSONDecodeError, TypeError, KeyError):
-                        continue # Skip if JSON is invalid or joint not found
-                if joint_angles_data:
-                    joint_angle_fig.add_trace(go.Scatter(
-                        x=dates,
-                        y=joint_angles_data,
-                        mode='lines+markers',
-                        name=f"{exercise} - {joint} (Avg)",
-                        hovertemplate=
-                        '<b>Date</b>: %{x}<br>' +
-                        '<b>Avg Angle</b>: %{y:.2f} degrees<br>' +
-                        '<extra></extra>' # Hides trace name on hover
-                    ))
-    else: # Specific exercise selected
-        for joint in ['knee', 'hip', 'ankle', 'shoulder', 'elbow', 'wrist']: # Example joints
-            joint_angles_data = []
-            dates = []
-            for idx, row in filtered_sessions_df.iterrows():
-                try:
-                    angles_json = json.loads(row['joint_angles_json'])
-                    if joint in angles_json:
-                        joint_angles_data.append(sum(angles_json[joint]) / len(angles_json[joint]))
-                        dates.append(row['date'])
-                except (json.JSONDecodeError, TypeError, KeyError):
-                    continue
-            if joint_angles_data:
-                joint_angle_fig.add_trace(go.Scatter(
-                    x=dates,
-                    y=joint_angles_data,
-                    mode='lines+markers',
-                    name=f"{selected_exercise_type} - {joint} (Avg)",
-                    hovertemplate=
-                    '<b>Date</b>: %{x}<br>' +
-                    '<b>Avg Angle</b>: %{y:.2f} degrees<br>' +
-                    '<extra></extra>'
-                ))
-
-    # Detailed Session Table
-    # Create a table from the filtered sessions_df
-    table_rows = []
-    for idx, row in filtered_sessions_df.iterrows():
-        table_rows.append(html.Tr([
-            html.Td(row['date'].strftime('%Y-%m-%d %H:%M')),
-            html.Td(row['exercise_type']),
-            html.Td(row['total_reps']),
-            html.Td(row['duration_seconds']),
-            html.Td(dbc.Button("View Details", id={'type': 'open-session-detail', 'index': row['session_id']}, size="sm", color="info"))
-        ]))
-    
-    detailed_table = dbc.Table(
-        [
-            html.Thead(html.Tr([
-                html.Th("Date"),
-                html.Th("Exercise Type"),
-                html.Th("Total Reps"),
-                html.Th("Duration (s)"),
-                html.Th("Actions")
-            ])),
-            html.Tbody(table_rows)
-        ],
-        bordered=True,
-        hover=True,
-        responsive=True,
-        striped=True,
-        className="table-sm"
-    )
+    joint_angle_fig.update_layout(title=f'Average Joint Angles per {period}', xaxis_title="Date", yaxis_title="Angle (degrees)")
+
+    _, angle_buckets = get_joint_angle_aggregates(patient_id, selected_exercise_type, bucket=bucket)
+    summaries_df = pd.DataFrame(angle_buckets)
+    if not summaries_df.empty:
+        summaries_df['bucket'] = pd.to_datetime(summaries_df['bucket'])
+        # Group by exercise type and joint; one trace each
+        for (exercise, joint), joint_df in summaries_df.groupby(['exercise_type', 'joint'], sort=False):
+            joint_angle_fig.add_trace(go.Scatter(
+                x=joint_df['bucket'],
+                y=joint_df['mean_angle'],
+                mode='lines+markers',
+                name=f"{exercise} - {joint} (Avg)",
+                hovertemplate=
+                '<b>Date</b>: %{x}<br>' +
+                '<b>Avg Angle</b>: %{y:.2f} degrees<br>' +
+                '<extra></extra>' # Hides trace name on hover
+            ))
+
+    return exercise_options, reps_fig, joint_angle_fig
+
+
+# Callback for the weekly form trend: mean similarity of the patient's reps to the reference templates
+@callback(
+    Output('patient-form-similarity-graph', 'figure'),
+    Input('selected-patient-id-on-page', 'data'),
+    Input('patient-session-exercise-filter', 'value'),
+    prevent_initial_call=True
+)
+def update_patient_similarity_trend(patient_id, selected_exercise_type):
+    similarity_fig = go.Figure()
+    similarity_fig.update_layout(title='Form Similarity to Reference Movements per Week', xaxis_title="Week",
+                                 yaxis_title="Similarity (%)", yaxis_range=[0, 100])
+    if not patient_id:
+        return similarity_fig
+
+    trend_df = pd.DataFrame(get_patient_similarity_trend(patient_id, selected_exercise_type))
+    if trend_df.empty:
+        similarity_fig.add_annotation(text="No scored reps yet (no reference templates for these exercises)",
+                                      showarrow=False, xref="paper", yref="paper", x=0.5, y=0.5)
+        return similarity_fig
+    trend_df['week'] = pd.to_datetime(trend_df['week'])
+    for exercise, exercise_df in trend_df.groupby('exercise_type', sort=False):
+        similarity_fig.add_trace(go.Scatter(
+            x=exercise_df['week'],
+            y=exercise_df['similarity'],
+            mode='lines+markers',
+            name=exercise,
+            customdata=exercise_df['reps'],
+            hovertemplate=
+            '<b>Week of</b>: %{x}<br>' +
+            '<b>Similarity</b>: %{y:.1f}%<br>' +
+            '<b>Reps</b>: %{customdata}<br>' +
+            '<extra></extra>'
+        ))
+    return similarity_fig
+
+
+# Callback to page through the session log; only the visible page is fetched
+@callback(
+    Output('patient-detailed-session-table', 'data'),
+    Output('patient-detailed-session-table', 'page_count'),
+    Output('patient-detailed-session-table', 'page_current'),
+    Output('patient-session-page-cursors', 'data'),
+    Input('selected-patient-id-on-page', 'data'),
+    Input('patient-session-exercise-filter', 'value'),
+    Input('patient-detailed-session-table', 'page_current'),
+    State('patient-session-page-cursors', 'data'),
+    prevent_initial_call=True
+)
+def update_patient_session_table(patient_id, selected_exercise_type, page_current, page_cursors):
+    if not patient_id:
+        return [], 1, 0, {}
+
+    ctx = dash.callback_context
+    trigger_id = ctx.triggered[0]['prop_id'] if ctx.triggered else None
+    if trigger_id != 'patient-detailed-session-table.page_current':
+        page_current, page_cursors = 0, {} # Patient or filter changed
 
-    return exercise_options, reps_fig, joint_angle_fig, detailed_table
+    data, page_cursors, page_count = fetch_session_table_page(
+        patient_id, page_current, page_cursors, format_session_row, exercise_type=selected_exercise_type
+    )
+    return data, page_count, page_current, page_cursors
 
 
-# Callback to open/close session detail collapse and display data
+# Callback to open session detail collapse for the clicked row and display data
 @callback(
     Output('patient-session-detail-collapse', 'is_open'),
     Output('selected-patient-session-data', 'children'),
-    Input({'type': 'open-session-detail', 'index': dash.ALL}, 'n_clicks'),
+    Input('patient-detailed-session-table', 'active_cell'),
+    State('selected-patient-id-on-page', 'data'),
     State('patient-session-detail-collapse', 'is_open'),
     prevent_initial_call=True
 )
-def toggle_session_detail_collapse(n_clicks, is_open):
-    if not n_clicks or all(nc is None for nc in n_clicks):
-        raise dash.exceptions.PreventUpdate
-
-    ctx = dash.callback_context
-    if not ctx.triggered:
+def toggle_session_detail_collapse(active_cell, patient_id, is_open):
+    if not active_cell or active_cell.get('row_id') is None:
         raise dash.exceptions.PreventUpdate
 
-    button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    session_id = json.loads(button_id)['index']
+    # Table rows are keyed by session_id
+    session_id = active_cell['row_id']
 
     # Fetch specific session data
-    conn = sqlite3.connect(DATABASE_PATH)
-    session_df = pd.read_sql_query(f"SELECT * FROM sessions WHERE session_id = {session_id}", conn)
-    conn.close()
+    session_data = get_session(patient_id, session_id)
 
-    if session_df.empty:
+    if session_data is None:
         return is_open, html.P("Session data not found.")
 
-    session_data = session_df.iloc[0]
-    
-    # Parse joint angles and create a more detailed display
+    # The angle payload is only loaded now (and cached) for the one session being viewed
+    joint_angles = get_session_angles(session_id, patient_id)
     joint_angles_display = html.Ul([
         html.Li(f"{joint.capitalize()}: {angles}")
-        for joint, angles in json.loads(session_data['joint_angles_json']).items()
+        for joint, angles in joint_angles.items()
     ])
 
     detail_content = dbc.Container([
@@ -378,13 +434,63 @@ def toggle_session_detail_collapse(n_clicks, is_open):
             dbc.Col(html.P(f"Exercise Type: {session_data['exercise_type']}")),
         ]),
         dbc.Row([
-            dbc.Col(html.P(f"Total Reps: {session_data['total_reps']}")),
-            dbc.Col(html.P(f"Duration: {session_data['duration_seconds']} seconds")),
+            dbc.Col(html.P(f"Total Reps: {session_data['reps_achieved']}")),
+            dbc.Col(html.P(f"Duration: {session_data['exercise_duration']} seconds")),
         ]),
+        html.H6("Movement Replay:"),
+        # Skeleton-only animation rendered from the landmark recording (skeleton_replay.py)
+        html.Img(src=replay_url(patient_id, session_id), style={'width': '100%', 'maxWidth': '640px'})
+        if get_recording_path(patient_id, session_id) else html.P("No recording for this session.", className="text-muted"),
         html.H6("Joint Angles:"),
         joint_angles_display,
         html.H6("Remarks:"),
-        html.P(session_data.get('remarks', 'No remarks provided.'))
+        html.P(session_data.get('feedback') or 'No remarks provided.')
     ])
 
-    return not is_open, detail_content # Toggle collapse and update content
\ No newline at end of file
+    return True, detail_content # Open collapse and update content
+
+
+# Full-text search over the doctor's session feedback (search_index.py), one page of ranked hits at a time
+@callback(
+    Output('session-search-results', 'children'),
+    Output('session-search-page', 'data'),
+    Output('session-search-prev', 'disabled'),
+    Output('session-search-next', 'disabled'),
+    Input('session-search-input', 'value'),
+    Input('session-search-prev', 'n_clicks'),
+    Input('session-search-next', 'n_clicks'),
+    State('session-search-page', 'data'),
+    State('doctor-id-store-patient-list', 'data'),
+    prevent_initial_call=True
+)
+def update_session_search(text, prev_clicks, next_clicks, page, doctor_id):
+    if not doctor_id:
+        raise dash.exceptions.PreventUpdate
+
+    ctx = dash.callback_context
+    trigger_id = ctx.triggered[0]['prop_id'] if ctx.triggered else None
+    if trigger_id == 'session-search-next.n_clicks':
+        page = (page or 0) + 1
+    elif trigger_id == 'session-search-prev.n_clicks':
+        page = max((page or 0) - 1, 0)
+    else:
+        page = 0 # New search text
+
+    results = search_sessions(doctor_id, text, page=page, page_size=SEARCH_PAGE_SIZE)
+    if not results['hits']:
+        message = html.P("No matching sessions.", className="text-muted") if text else None
+        return message, page, page == 0, True
+
+    items = [
+        dbc.ListGroupItem([
+            html.Div([
+                dcc.Link(hit['patient_name'], href=f"/doctor_patient_details?patient_id={hit['patient_id']}",
+                         className="fw-bold me-2"),
+                html.Small(f"{hit['exercise_type']} · {pd.to_datetime(hit['date']).strftime('%Y-%m-%d %H:%M')}",
+                           className="text-muted"),
+            ]),
+            dcc.Markdown(hit['snippet'], className="mb-0 small")
+        ])
+        for hit in results['hits']
+    ]
+    return dbc.ListGroup(items, flush=True), page, page == 0, not results['has_more']
@@ -2,8 +2,10 @@ import dash
 from dash import html, dcc, callback, Input, Output, State
 import dash_bootstrap_components as dbc
 import sqlite3
-from datetime import datetime, date
-import pandas as pd
+from datetime import datetime, date, timedelta
+from patient_search import search_patient_prefix, get_patient_option, patient_option
+from scheduling import book_appointment, book_series, get_week_calendar, SchedulingConflict, \
+    DEFAULT_APPOINTMENT_MINUTES, WEEKDAY_NAMES
 
 # Register the page
 dash.register_page(__name__, path='/doctor_schedule_appointment', title='Schedule Appointment', order=3)
@@ -19,25 +21,6 @@ def get_doctor_id_from_username(username):
     conn.close()
     return doctor_id[0] if doctor_id else None
 
-# Utility to get patient_id and name for dropdown
-def get_all_patients_for_dropdown(doctor_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    # Fetch patients assigned to this doctor
-    # If a doctor can schedule for ANY patient, remove the WHERE p.doctor_id = ? clause
-    patients_df = pd.read_sql_query(f"""
-        SELECT p.patient_id, p.name, u.username
-        FROM patients p
-        JOIN users u ON p.patient_id = u.id
-        WHERE p.doctor_id = {doctor_id}
-    """, conn)
-    conn.close()
-    
-    options = []
-    if not patients_df.empty:
-        options = [{'label': f"{row['name']} ({row['username']})", 'value': row['patient_id']}
-                   for index, row in patients_df.iterrows()]
-    return options
-
 # --- Layout for Doctor Schedule Appointment Page ---
 def layout():
     # The actual patient options will be loaded by a callback after doctor_id is available
@@ -51,11 +34,12 @@ def layout():
                     dbc.CardBody([
                         html.Div([
                             dbc.Label("Select Patient:", html_for="appointment-patient-select", className="fw-bold mb-2"),
-                            dbc.Select(
+                            dcc.Dropdown(
                                 id="appointment-patient-select",
-                                options=[], # Will be populated by callback
-                                placeholder="Choose Patient",
-                                className="mb-3 form-control-lg border-primary rounded-pill"
+                                options=[], # Filled by the typeahead callback as the doctor types
+                                placeholder="Type a patient's name or username",
+                                searchable=True,
+                                className="mb-3"
                             ),
                         ]),
                         html.Div([
@@ -78,6 +62,30 @@ def layout():
                                 className="mb-3 form-control-lg border-primary rounded-pill"
                             ),
                         ]),
+                        html.Div([
+                            dbc.Label("Duration:", html_for="appointment-duration-select", className="fw-bold mb-2"),
+                            dbc.Select(
+                                id="appointment-duration-select",
+                                options=[{'label': f"{minutes} minutes", 'value': minutes} for minutes in (15, 30, 45, 60, 90)],
+                                value=DEFAULT_APPOINTMENT_MINUTES,
+                                className="mb-3 form-control-lg border-primary rounded-pill"
+                            ),
+                        ]),
+                        html.Div([
+                            dbc.Label("Repeat Weekly On (optional):", html_for="appointment-repeat-days", className="fw-bold mb-2"),
+                            dbc.Checklist(
+                                id="appointment-repeat-days",
+                                options=[{'label': name, 'value': i} for i, name in enumerate(WEEKDAY_NAMES)],
+                                value=[],
+                                inline=True,
+                                className="mb-2"
+                            ),
+                            dbc.InputGroup([
+                                dbc.InputGroupText("For"),
+                                dbc.Input(id="appointment-repeat-weeks", type="number", min=1, max=52, step=1, value=6),
+                                dbc.InputGroupText("weeks"),
+                            ], className="mb-3"),
+                        ]),
                         dbc.Button(
                             "Schedule Appointment", 
                             id="schedule-appointment-btn", 
@@ -96,14 +104,21 @@ def layout():
                     ])
                 ], className="shadow-lg border-0 rounded-lg")
             ])
+        ]),
+        dbc.Row(justify="center", className="mt-4", children=[
+            dbc.Col(lg=10, children=[
+                dbc.Card([
+                    dbc.CardHeader(html.H4(id="schedule-week-header", className="text-center mb-0")),
+                    dbc.CardBody(id="schedule-week-view")
+                ], className="shadow-lg border-0 rounded-lg")
+            ])
         ])
     ], fluid=True, className="py-4 bg-light")
 
 
-# Callback to update the header and patient dropdown options based on the logged-in doctor
+# Callback to update the header based on the logged-in doctor
 @callback(
     Output("schedule-app-header", "children"),
-    Output("appointment-patient-select", "options"),
     Output("doctor-id-store-schedule-app", "data"),
     Input('user-id-store', 'data'),      # Doctor's ID from session
     Input('user-role-store', 'data'),    # Doctor's role from session
@@ -111,7 +126,7 @@ def layout():
 )
 def update_schedule_app_ui(doctor_id, user_role):
     if user_role != 'doctor' or not doctor_id:
-        return "Access Denied", [], None # Or redirect to login
+        return "Access Denied", None # Or redirect to login
 
     conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
@@ -120,12 +135,33 @@ def update_schedule_app_ui(doctor_id, user_role):
     conn.close()
 
     header_text = f"Schedule Appointment, Dr. {doctor_username}"
-    patient_options = get_all_patients_for_dropdown(doctor_id) # Get patients assigned to this doctor
+    return header_text, doctor_id
 
-    return header_text, patient_options, doctor_id
+
+# Typeahead: the dropdown only ever holds the top matches for what has been typed so far
+@callback(
+    Output("appointment-patient-select", "options"),
+    Input("appointment-patient-select", "search_value"),
+    Input("doctor-id-store-schedule-app", "data"),
+    State("appointment-patient-select", "value")
+)
+def update_patient_options(search_value, doctor_id, selected_patient_id):
+    if not doctor_id:
+        return []
+    if not search_value and selected_patient_id:
+        # Dropdown closed with a selection; keep its label without refetching the list
+        selected = get_patient_option(doctor_id, selected_patient_id)
+        return [patient_option(selected)] if selected else []
+
+    options = [patient_option(patient) for patient in search_patient_prefix(doctor_id, search_value)]
+    if selected_patient_id and all(option['value'] != selected_patient_id for option in options):
+        selected = get_patient_option(doctor_id, selected_patient_id)
+        if selected:
+            options.insert(0, patient_option(selected))
+    return options
 
 
-# Callback to handle scheduling an appointment
+# Callback to handle scheduling an appointment (single or weekly series)
 @callback(
     Output("schedule-appointment-message", "children"),
     Input("schedule-appointment-btn", "n_clicks"),
@@ -133,35 +169,67 @@ def update_schedule_app_ui(doctor_id, user_role):
     State("appointment-patient-select", "value"),  # Patient ID (instead of username)
     State("appointment-date-picker", "date"),
     State("appointment-time-input", "value"),
+    State("appointment-duration-select", "value"),
+    State("appointment-repeat-days", "value"),
+    State("appointment-repeat-weeks", "value"),
     prevent_initial_call=True
 )
-def handle_schedule_appointment(n_clicks, doctor_id, patient_id, app_date, app_time):
+def handle_schedule_appointment(n_clicks, doctor_id, patient_id, app_date, app_time, duration, repeat_days, repeat_weeks):
     if not n_clicks:
         raise dash.exceptions.PreventUpdate
 
     # Validate inputs
     if not all([doctor_id, patient_id, app_date, app_time]):
         return dbc.Alert("Please ensure a doctor is logged in, and select a patient, date, and time.", color="danger")
-    
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
 
+    patient_id = int(patient_id)
+    duration = int(duration or DEFAULT_APPOINTMENT_MINUTES)
     try:
-        # Fetch doctor_username and patient_username from IDs for storing in appointments table
-        cursor.execute("SELECT username FROM users WHERE id = ?", (doctor_id,))
-        doctor_username = cursor.fetchone()[0]
-
-        cursor.execute("SELECT username FROM users WHERE id = ?", (patient_id,))
-        patient_username = cursor.fetchone()[0]
-
-        # Insert into appointments table
-        cursor.execute(
-            "INSERT INTO appointments (doctor_id, doctor_username, patient_id, patient_username, appointment_date, appointment_time, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (doctor_id, doctor_username, patient_id, patient_username, app_date, app_time, "scheduled")
-        )
-        conn.commit()
-        return dbc.Alert(f"Appointment scheduled for patient {patient_username} on {app_date} at {app_time}.", color="success")
+        # Conflict check and insert run in one transaction (see scheduling.py)
+        if repeat_days:
+            ids = book_series(doctor_id, patient_id, app_date[:10], app_time, repeat_days, int(repeat_weeks or 1), duration)
+            days = ", ".join(WEEKDAY_NAMES[d] for d in sorted(repeat_days))
+            return dbc.Alert(f"Scheduled {len(ids)} appointments ({days} at {app_time}) starting {app_date[:10]}.",
+                             color="success")
+        book_appointment(doctor_id, patient_id, f"{app_date[:10]} {app_time}", duration)
+        return dbc.Alert(f"Appointment scheduled on {app_date[:10]} at {app_time}.", color="success")
+    except SchedulingConflict as e:
+        clashes = [html.Li(f"{c['starts_at'][:16]} - {c['ends_at'][11:16]}") for c in e.conflicts[:5]]
+        return dbc.Alert([html.P(f"Not scheduled: {e}.", className="mb-1"), html.Ul(clashes, className="mb-0")],
+                         color="warning")
+    except ValueError as e:
+        return dbc.Alert(f"Error scheduling appointment: {e}", color="danger")
     except sqlite3.Error as e:
         return dbc.Alert(f"Error scheduling appointment: {e}", color="danger")
-    finally:
-        conn.close()
\ No newline at end of file
+
+
+# Week view of the doctor's calendar around the selected date; refreshed after each booking
+@callback(
+    Output("schedule-week-header", "children"),
+    Output("schedule-week-view", "children"),
+    Input("doctor-id-store-schedule-app", "data"),
+    Input("appointment-date-picker", "date"),
+    Input("schedule-appointment-message", "children")
+)
+def update_week_view(doctor_id, selected_date, message):
+    if not doctor_id:
+        raise dash.exceptions.PreventUpdate
+
+    monday, appointments = get_week_calendar('doctor', doctor_id, (selected_date or date.today().isoformat())[:10])
+    days = [monday + timedelta(days=i) for i in range(7)]
+    by_day = {day.isoformat(): [] for day in days}
+    for appointment in appointments:
+        by_day.setdefault(appointment['starts_at'][:10], []).append(appointment)
+
+    header = html.Tr([html.Th(f"{WEEKDAY_NAMES[day.weekday()]} {day.strftime('%d %b')}") for day in days])
+    cells = html.Tr([
+        html.Td([
+            dbc.Badge(f"{a['starts_at'][11:16]}-{a['ends_at'][11:16]} {a['patient_name'] or a['patient_id']}",
+                      color="info" if a['series_id'] else "primary", className="d-block mb-1 text-wrap")
+            for a in by_day[day.isoformat()]
+        ] or html.Span("-", className="text-muted"), style={'verticalAlign': 'top', 'width': '14%'})
+        for day in days
+    ])
+    table = dbc.Table([html.Thead(header), html.Tbody(cells)], bordered=True, size="sm", className="mb-0")
+    title = f"Week of {monday.strftime('%d %b %Y')} ({len(appointments)} appointments)"
+    return title, table
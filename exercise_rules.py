@@ -0,0 +1,204 @@
+import os
+import json
+from collections import namedtuple
+import numpy as np
+from utils import joint_angles, trailing_mean
+
+# Data-driven exercise definitions (exercises/*.json) compiled into array checks.
+# A definition names the joint triplets to measure, the angle ranges of the rest/active phases
+# of the movement, form rules ("while active, hip angle must stay >= 45") and the messages to show.
+# Loading compiles all of that into index and bound arrays, so one engine evaluates any exercise
+# with a handful of numpy operations per frame (or per whole recorded series) and no per-exercise code.
+
+EXERCISES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exercises')
+
+# MediaPipe PoseLandmark order
+LANDMARK_NAMES = (
+    'NOSE', 'LEFT_EYE_INNER', 'LEFT_EYE', 'LEFT_EYE_OUTER', 'RIGHT_EYE_INNER', 'RIGHT_EYE', 'RIGHT_EYE_OUTER',
+    'LEFT_EAR', 'RIGHT_EAR', 'MOUTH_LEFT', 'MOUTH_RIGHT', 'LEFT_SHOULDER', 'RIGHT_SHOULDER', 'LEFT_ELBOW',
+    'RIGHT_ELBOW', 'LEFT_WRIST', 'RIGHT_WRIST', 'LEFT_PINKY', 'RIGHT_PINKY', 'LEFT_INDEX', 'RIGHT_INDEX',
+    'LEFT_THUMB', 'RIGHT_THUMB', 'LEFT_HIP', 'RIGHT_HIP', 'LEFT_KNEE', 'RIGHT_KNEE', 'LEFT_ANKLE', 'RIGHT_ANKLE',
+    'LEFT_HEEL', 'RIGHT_HEEL', 'LEFT_FOOT_INDEX', 'RIGHT_FOOT_INDEX',
+)
+_LANDMARK_INDEX = {name: i for i, name in enumerate(LANDMARK_NAMES)}
+
+# Stage codes used in the compiled arrays
+STARTING, REST, ACTIVE = -1, 0, 1
+_PHASES = {'rest': REST, 'active': ACTIVE}
+
+DEFAULT_MESSAGES = {
+    'start': "Get ready!",
+    'rest': "",
+    'active': "",
+    'rep': "Rep counted!",
+    'too_slow': "Return to the start position and try again.",
+}
+
+FrameResult = namedtuple('FrameResult', 'angles stage rep_completed feedback violations')
+
+
+class ExerciseDefinitionError(ValueError):
+    pass
+
+
+def _bounds(spec, where):
+    # {"min": a, "max": b} (either optional) -> (low, high)
+    if not isinstance(spec, dict) or not ({'min', 'max'} & spec.keys()):
+        raise ExerciseDefinitionError(f"{where} needs a 'min' and/or 'max' angle")
+    return float(spec.get('min', -np.inf)), float(spec.get('max', np.inf))
+
+
+class Exercise:
+    # A compiled definition. Angles are always ordered like self.joints.
+    def __init__(self, definition):
+        try:
+            self.name = definition['name']
+            self.display_name = definition.get('display_name', self.name)
+            self.joints = tuple(definition['joints'])
+            self.triplets = np.array([[_LANDMARK_INDEX[landmark] for landmark in definition['joints'][joint]]
+                                      for joint in self.joints], dtype=np.intp)
+            if self.triplets.shape != (len(self.joints), 3):
+                raise ExerciseDefinitionError(f"{self.name}: every joint needs three landmarks")
+            joint_index = {joint: i for i, joint in enumerate(self.joints)}
+            self.smoothing_frames = int(definition.get('smoothing_frames', 1))
+
+            phase = definition['phase']
+            self.phase_joint = joint_index[phase['joint']]
+            self.rest_bounds = _bounds(phase['rest'], f"{self.name}: phase.rest")
+            self.active_bounds = _bounds(phase['active'], f"{self.name}: phase.active")
+            names = phase.get('stage_names', {})
+            self.stage_names = {STARTING: None, REST: names.get('rest', 'rest'), ACTIVE: names.get('active', 'active')}
+            self.max_rep_seconds = float(phase.get('max_rep_seconds', np.inf))
+
+            # Rules as parallel arrays: rule r checks angles[rule_joints[r]] within [rule_low[r], rule_high[r]]
+            # in the stages where rule_stages[stage_code, r] is True
+            rules = definition.get('rules', [])
+            self.rule_joints = np.array([joint_index[rule['joint']] for rule in rules], dtype=np.intp)
+            bounds = [_bounds(rule, f"{self.name}: rule {i}") for i, rule in enumerate(rules)]
+            self.rule_low = np.array([low for low, _ in bounds], dtype=np.float64)
+            self.rule_high = np.array([high for _, high in bounds], dtype=np.float64)
+            # Rows indexed by stage code (STARTING is row -1)
+            self.rule_stages = np.zeros((3, len(rules)), dtype=bool)
+            for r, rule in enumerate(rules):
+                for code in ([_PHASES[rule['phase']]] if rule.get('phase') else [STARTING, REST, ACTIVE]):
+                    self.rule_stages[code, r] = True
+            self.rule_messages = [rule['message'] for rule in rules]
+        except KeyError as e:
+            raise ExerciseDefinitionError(f"{definition.get('name', 'exercise')}: unknown or missing {e}") from None
+
+        self.messages = dict(DEFAULT_MESSAGES, **definition.get('messages', {}))
+        self.labels = definition.get('labels', {})
+        self.correct_labels = set(definition.get('correct_labels', []))
+
+    def angles(self, landmarks):
+        # (..., 33, >=2) landmarks -> (..., n_joints) angles in degrees, all joints in one call
+        xy = np.asarray(landmarks)[..., :2]
+        points = xy[..., self.triplets, :] # (..., n_joints, 3, 2)
+        return joint_angles(points[..., 0, :], points[..., 1, :], points[..., 2, :])
+
+    def in_phase(self, angles):
+        # (..., n_joints) -> (in rest, in active) boolean arrays of shape (...)
+        angle = np.asarray(angles)[..., self.phase_joint]
+        return ((angle >= self.rest_bounds[0]) & (angle <= self.rest_bounds[1]),
+                (angle >= self.active_bounds[0]) & (angle <= self.active_bounds[1]))
+
+    def violations(self, angles, stages):
+        # (..., n_joints) angles and (...) stage codes -> (..., n_rules) True where a rule is broken
+        values = np.asarray(angles)[..., self.rule_joints]
+        outside = (values < self.rule_low) | (values > self.rule_high)
+        return outside & self.rule_stages[np.asarray(stages)]
+
+    def stages(self, angles):
+        # Hysteresis over a whole (n, n_joints) series: every frame keeps the phase it last entered.
+        # As in ExerciseTracker, the active phase only counts once the rest position has been seen.
+        rest, active = self.in_phase(angles)
+        active = active & (np.cumsum(rest) > 0)
+        frames = np.arange(len(rest))
+        last = np.maximum.accumulate(np.where(rest | active, frames, -1)) if len(frames) else frames
+        return np.where(last >= 0, active[np.maximum(last, 0)].astype(np.int8), STARTING)
+
+    def evaluate_series(self, landmarks):
+        # Offline check of a recorded series: smoothed angles, stage per frame and rule violations
+        angles = trailing_mean(self.angles(landmarks), self.smoothing_frames)
+        stages = self.stages(angles)
+        return angles, stages, self.violations(angles, stages)
+
+    def feedback_for(self, violations):
+        # Message of the first broken rule, or None
+        broken = np.flatnonzero(violations)
+        return self.rule_messages[broken[0]] if len(broken) else None
+
+    def describe_label(self, label):
+        # Model output letters (e.g. 'kx') -> their messages, and whether the form counts as correct
+        return [self.labels.get(letter, letter) for letter in label], bool(self.correct_labels & set(label))
+
+
+class ExerciseTracker:
+    # Live engine for one exercise: feed one frame of landmarks at a time
+    def __init__(self, exercise):
+        self.exercise = exercise
+        self._window = np.zeros((max(exercise.smoothing_frames, 1), len(exercise.joints)))
+        self.reset()
+
+    def reset(self):
+        self._filled = 0
+        self._next = 0
+        self.stage = STARTING
+        self.active_since = None
+        self.reps = 0
+        self.feedback = self.exercise.messages['start']
+
+    @property
+    def stage_name(self):
+        return self.exercise.stage_names[self.stage]
+
+    def update(self, landmarks, now):
+        # landmarks: (33, >=2) array for this frame; returns a FrameResult
+        exercise = self.exercise
+        self._window[self._next] = exercise.angles(landmarks)
+        self._next = (self._next + 1) % len(self._window)
+        self._filled = min(self._filled + 1, len(self._window))
+        angles = self._window[:self._filled].mean(axis=0) # Same as averaging a deque of recent angles
+
+        rest, active = exercise.in_phase(angles)
+        rep_completed = False
+        if rest:
+            if self.stage == ACTIVE:
+                # Back at the start position after the active phase: one rep, if it was controlled
+                rep_completed = now - self.active_since <= exercise.max_rep_seconds
+                self.feedback = exercise.messages['rep' if rep_completed else 'too_slow']
+            else:
+                self.feedback = exercise.messages['rest']
+            self.stage = REST
+        elif active and self.stage == REST:
+            self.stage = ACTIVE
+            self.active_since = now
+            self.feedback = exercise.messages['active']
+        self.reps += rep_completed
+
+        # A broken form rule overrides the phase message while it lasts
+        violations = exercise.violations(angles, self.stage)
+        feedback = self.feedback if rep_completed else exercise.feedback_for(violations) or self.feedback
+        return FrameResult(dict(zip(exercise.joints, angles)), self.stage_name, rep_completed, feedback, violations)
+
+
+_loaded = {}
+
+
+def load_exercise(name):
+    # Compiled definition from exercises/<name>.json (compiled once per process)
+    if name not in _loaded:
+        path = os.path.join(EXERCISES_DIR, f"{name}.json")
+        try:
+            with open(path) as f:
+                definition = json.load(f)
+        except FileNotFoundError:
+            raise ExerciseDefinitionError(f"No exercise definition named '{name}'") from None
+        _loaded[name] = Exercise(definition)
+    return _loaded[name]
+
+
+def available_exercises():
+    # {name: display name} for every definition on disk
+    names = sorted(f[:-len('.json')] for f in os.listdir(EXERCISES_DIR) if f.endswith('.json'))
+    return {name: load_exercise(name).display_name for name in names}
@@ -0,0 +1,218 @@
+import os
+import time
+import uuid
+import zlib
+import struct
+import sqlite3
+import numpy as np
+
+# Append-only recording of the raw pose landmarks of a live session, one file per session.
+#
+# Layout (little endian):
+#   header  64 bytes   magic 'TLRK', version, landmark shape, record size, patient id, start time
+#   records N * 272    float64 timestamp + float16 (33, 4) landmarks (x, y, z, visibility)
+#   footer  optional   sparse time index (every INDEX_STRIDE-th timestamp) + trailer with a CRC
+#
+# Records are fixed-size, so a file is readable at any point: if the process dies before the
+# footer is written, the reader derives the frame count from the file size and ignores a torn
+# last record. Readers memory-map the records, so seeking to any moment costs one page read.
+
+RECORDINGS_DIR = os.environ.get('THERALINK_RECORDINGS_DIR', 'recordings')
+RECORDING_SUFFIX = '.tlr'
+
+DATABASE_PATH = 'theralink.db'
+
+N_LANDMARKS = 33 # MediaPipe Pose
+N_VALUES = 4 # x, y, z, visibility
+INDEX_STRIDE = 64 # frames between footer index entries
+FLUSH_INTERVAL_SECONDS = 1.0 # at most this much is lost if the process is killed
+
+MAGIC = b'TLRK'
+FOOTER_MAGIC = b'TLRI'
+VERSION = 1
+HEADER_FORMAT = '<4sHHHIqd' # magic, version, n_landmarks, n_values, record_size, patient_id, started_at
+HEADER_SIZE = 64
+TRAILER_FORMAT = '<4sQQII' # magic, n_frames, index_offset, index_count, crc32 of the index
+TRAILER_SIZE = struct.calcsize(TRAILER_FORMAT)
+
+RECORD_DTYPE = np.dtype([('t', '<f8'), ('landmarks', '<f2', (N_LANDMARKS, N_VALUES))])
+RECORD_SIZE = RECORD_DTYPE.itemsize
+
+
+def init_recording_schema(conn=None):
+    # Sessions point at their landmark recording (NULL for sessions recorded before this existed)
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+    if 'recording_path' not in columns:
+        conn.execute("ALTER TABLE sessions ADD COLUMN recording_path TEXT")
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+def landmarks_to_array(landmarks, out=None):
+    # MediaPipe landmark list -> (33, 4) float32 array of x, y, z, visibility
+    out = np.empty((N_LANDMARKS, N_VALUES), dtype=np.float32) if out is None else out
+    for i, lm in enumerate(landmarks):
+        out[i] = (lm.x, lm.y, lm.z, lm.visibility)
+    return out
+
+
+def new_recording_path(patient_id=None, directory=None):
+    directory = directory or RECORDINGS_DIR
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(directory, f"{patient_id if patient_id is not None else 'anon'}_{stamp}_{uuid.uuid4().hex[:8]}{RECORDING_SUFFIX}")
+
+
+class LandmarkRecorder:
+    # Writer side; append() is a struct pack plus a buffered write, cheap enough for the frame loop
+    def __init__(self, path, patient_id=None, started_at=None):
+        self.path = path
+        self.n_frames = 0
+        self._record = np.zeros(1, dtype=RECORD_DTYPE)
+        self._landmarks = np.empty((N_LANDMARKS, N_VALUES), dtype=np.float32)
+        self._index = []
+        self._last_flush = time.monotonic()
+        self._last_t = float('-inf')
+        self._file = open(path, 'wb', buffering=64 * 1024)
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, N_LANDMARKS, N_VALUES, RECORD_SIZE,
+                             -1 if patient_id is None else int(patient_id), started_at or time.time())
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def append(self, timestamp, landmarks):
+        # landmarks: a MediaPipe landmark list or anything shaped (33, 4)
+        if self._file is None:
+            raise ValueError("Recording is closed")
+        if timestamp <= self._last_t:
+            timestamp = np.nextafter(self._last_t, np.inf) # Keep timestamps strictly increasing for lookups
+        if isinstance(landmarks, np.ndarray):
+            self._record['landmarks'][0] = landmarks
+        else:
+            self._record['landmarks'][0] = landmarks_to_array(landmarks, self._landmarks)
+        self._record['t'][0] = timestamp
+        if self.n_frames % INDEX_STRIDE == 0:
+            self._index.append(timestamp)
+        self._file.write(self._record.tobytes())
+        self.n_frames += 1
+        self._last_t = timestamp
+        now = time.monotonic()
+        if now - self._last_flush >= FLUSH_INTERVAL_SECONDS:
+            self._file.flush() # Hand the buffer to the OS so a crash loses at most a second
+            self._last_flush = now
+
+    def close(self):
+        if self._file is None:
+            return
+        index = np.asarray(self._index, dtype='<f8').tobytes()
+        index_offset = HEADER_SIZE + self.n_frames * RECORD_SIZE
+        self._file.write(index)
+        self._file.write(struct.pack(TRAILER_FORMAT, FOOTER_MAGIC, self.n_frames, index_offset,
+                                     len(self._index), zlib.crc32(index)))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LandmarkRecording:
+    # Reader side: records are memory-mapped, nothing is loaded until it is indexed
+    def __init__(self, path):
+        self.path = path
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            magic, version, n_landmarks, n_values, record_size, patient_id, started_at = \
+                struct.unpack_from(HEADER_FORMAT, header)
+            if magic != MAGIC or record_size != RECORD_SIZE or (n_landmarks, n_values) != (N_LANDMARKS, N_VALUES):
+                raise ValueError(f"{path} is not a landmark recording")
+            self.patient_id = None if patient_id < 0 else patient_id
+            self.started_at = started_at
+            self.n_frames, self._index = self._read_footer(f, size)
+        self.complete = self._index is not None
+        if self._index is None:
+            # No (valid) footer: the writer did not finish; keep every whole record
+            self.n_frames = (size - HEADER_SIZE) // RECORD_SIZE
+        self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(self.n_frames,)) \
+            if self.n_frames else np.zeros(0, dtype=RECORD_DTYPE)
+
+    @staticmethod
+    def _read_footer(f, size):
+        if size < HEADER_SIZE + TRAILER_SIZE:
+            return 0, None
+        f.seek(size - TRAILER_SIZE)
+        magic, n_frames, index_offset, index_count, crc = struct.unpack(TRAILER_FORMAT, f.read(TRAILER_SIZE))
+        if magic != FOOTER_MAGIC or index_offset != HEADER_SIZE + n_frames * RECORD_SIZE \
+                or index_offset + index_count * 8 + TRAILER_SIZE != size:
+            return 0, None
+        f.seek(index_offset)
+        raw = f.read(index_count * 8)
+        if zlib.crc32(raw) != crc:
+            return 0, None
+        return n_frames, np.frombuffer(raw, dtype='<f8')
+
+    def __len__(self):
+        return self.n_frames
+
+    @property
+    def timestamps(self):
+        return self.records['t']
+
+    @property
+    def duration(self):
+        return float(self.records['t'][-1] - self.records['t'][0]) if self.n_frames > 1 else 0.0
+
+    def index_at(self, timestamp):
+        # Frame shown at `timestamp` (the last frame at or before it)
+        if self._index is not None and len(self._index):
+            # Coarse step in the footer index, then a search inside one INDEX_STRIDE block
+            block = max(int(np.searchsorted(self._index, timestamp, side='right')) - 1, 0)
+            start = block * INDEX_STRIDE
+            stop = min(start + INDEX_STRIDE, self.n_frames)
+            i = start + int(np.searchsorted(self.records['t'][start:stop], timestamp, side='right')) - 1
+        else:
+            i = int(np.searchsorted(self.records['t'], timestamp, side='right')) - 1
+        return min(max(i, 0), self.n_frames - 1)
+
+    def frame(self, i):
+        # (timestamp, (33, 4) float32 landmarks)
+        record = self.records[i]
+        return float(record['t']), record['landmarks'].astype(np.float32)
+
+    def at_offset(self, seconds):
+        # Frame `seconds` after the first frame
+        return self.frame(self.index_at(self.records['t'][0] + seconds))
+
+    def between(self, start_offset, end_offset):
+        # (timestamps, (n, 33, 4) landmarks) for the interval, relative to the first frame
+        if not self.n_frames:
+            return np.zeros(0), np.zeros((0, N_LANDMARKS, N_VALUES), dtype=np.float32)
+        t0 = self.records['t'][0]
+        start = int(np.searchsorted(self.records['t'], t0 + start_offset, side='left'))
+        stop = int(np.searchsorted(self.records['t'], t0 + end_offset, side='right'))
+        chunk = self.records[start:stop]
+        return np.array(chunk['t']), chunk['landmarks'].astype(np.float32)
+
+    def close(self):
+        mm = getattr(self.records, '_mmap', None)
+        self.records = None
+        if mm is not None:
+            mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_recording(path):
+    return LandmarkRecording(path)
@@ -3,8 +3,9 @@ import mediapipe as mp
 import SquatPosture as sp
 import pandas as pd
 import numpy as np
-import tensorflow as tf
+from model_manager import get_model_manager, ModelLoadError
 from utils import *
+from train_pipeline import predicted_label, MODEL_PATH
 from csv import writer
 
 mp_drawing = mp.solutions.drawing_utils
@@ -23,7 +24,7 @@ dict = {'neck': [],
 # For video input:
 cap = cv2.VideoCapture(0)
 
-model = tf.keras.models.load_model("working_model_1")
+model = get_model_manager(MODEL_PATH) # 57-feature classifier saved by train_pipeline.py; loads in the background
 counter_for_renewal = 0
 with mp_pose.Pose() as pose:
     while cap.isOpened():
@@ -45,9 +46,10 @@ with mp_pose.Pose() as pose:
         mp_drawing.draw_landmarks(
             image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
 
-        params = sp.get_params(results)
+        params = sp.get_params(results) # 5 averaged angles for the live plot
+        features = sp.get_params(results, all=True) # 57 full-body features for the classifier
 
-        if params is None:
+        if features is None:
             print("NO HUMAN!")
             continue
 
@@ -74,24 +76,20 @@ with mp_pose.Pose() as pose:
         counter_for_renewal += 1
         # print(flat_params)
 
-        output = model.predict(flat_params.T)
-
-        output[0][2] *= 5
-        output[0][4] *= 3
-
-        output = output * (1 / np.sum(output))
-
-        output_name = ['c', 'k', 'h', 'r', 'x', 'i']
-
-        label = ""
-
-        for i in range(1, 4):
-            label += output_name[i] if output[0][i] > 0.4 else ""
-
-        if label == "":
-            label = "c"
+        model_status = "Loading model..."
+        try:
+            output = model.predict(features[np.newaxis])
+        except ModelLoadError as e: # Shown in place of the label until the demo is restarted
+            output, model_status = None, str(e)
+        if output is None: # Model still loading or failed
+            cv2.putText(image, model_status, (10, 43), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+            cv2.imshow('MediaPipe Pose', image)
+            if cv2.waitKey(5) & 0xFF == 27:
+                break
+            continue
 
-        label += 'x' if output[0][4] > 0.04 else ''
+        # One independent sigmoid per letter (train_pipeline.py), thresholded as in training
+        label = predicted_label(output)
 
         # print(label, output)
 
@@ -3,20 +3,25 @@ import mediapipe as mp
 import SquatPosture as sp
 import pandas as pd
 import numpy as np
-import tensorflow as tf
+from model_manager import get_model_manager, ModelLoadError
 from utils import *
-from csv import writer
+from landmark_recorder import landmarks_to_array
+from dataset_recorder import DatasetRecorder, LABEL_LETTERS
+from train_pipeline import predicted_label, MODEL_PATH
 
-csv_file = open('plotting_live.csv', 'w+')
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
-writer_object = writer(csv_file)
-writer_object.writerow(['neck', 'knee', 'hip', 'ankle', 'y-knee'])
+
+# Training data capture (dataset_recorder.py): SPACE starts/stops recording, the label letters
+# (c k h r x i) toggle the operator's label for the recorded frames, BACKSPACE clears it
+recorder = DatasetRecorder()
+recording = False
+operator_label = "c"
 
 # For video input:
 cap = cv2.VideoCapture(0)
 
-model = tf.keras.models.load_model("working_model_1")
+model = get_model_manager(MODEL_PATH) # 57-feature classifier saved by train_pipeline.py; loads in the background
 counter_for_renewal = 0
 with mp_pose.Pose() as pose:
     while cap.isOpened():
@@ -38,49 +43,54 @@ with mp_pose.Pose() as pose:
         mp_drawing.draw_landmarks(
             image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
 
-        params = sp.get_params(results, all=True)
-
-        if params is None:
+        if results.pose_landmarks is None:
             print("NO HUMAN!")
             continue
 
-        flat_params = np.reshape(params, (57, 1))
-
-        #if counter_for_renewal > 100:
-            #csv_file.truncate(1)
-        # writer_object.writerow(flat_params.T.flatten())
-        # csv_file.flush()
-
-        # counter_for_renewal += 1
-        # print(flat_params)
-
-        output = model.predict(flat_params.T)
-
-        # output[0][2] *= 5
-        # output[0][4] *= 3
+        landmarks = landmarks_to_array(results.pose_landmarks.landmark)
+        params = sp.get_params(landmarks, all=True)
 
-        output = output * (1 / np.sum(output))
-
-        output_name = ['c', 'k', 'h', 'r', 'x', 'i']
+        flat_params = np.reshape(params, (57, 1))
 
-        label = ""
+        if recording and operator_label:
+            recorder.record(params, landmarks, operator_label) # Queued; written by a background thread
+
+        model_status = "Loading model..."
+        try:
+            output = model.predict(flat_params.T)
+        except ModelLoadError as e: # Shown in place of the label until the demo is restarted
+            output, model_status = None, str(e)
+        if output is None: # Model still loading or failed; keep recording and showing the camera
+            cv2.putText(image, model_status, (10, 43), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+            cv2.imshow('MediaPipe Pose', image)
+            if cv2.waitKey(5) & 0xFF == 27:
+                break
+            continue
 
+        # One independent sigmoid per letter in LABEL_LETTERS (train_pipeline.py): keep every letter
+        # whose probability reaches the threshold the model was evaluated at
         print(output)
-
-        for i in range(1, 5):
-            label += output_name[i] if output[0][i] > 0.1 else ""
-
-        if label == "":
-            label = "c"
-
-        # print(label, output)
+        label = predicted_label(output)
 
         label_final_results(image, label)
+        if recording:
+            cv2.putText(image, f"REC [{operator_label or '-'}] {recorder.stats()['recorded']} frames",
+                        (10, image.shape[0] - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
 
         cv2.imshow('MediaPipe Pose', image)
 
-        if cv2.waitKey(5) & 0xFF == 27:
+        key = cv2.waitKey(5) & 0xFF
+        if key == 27:
             break
-csv_file.close()
+        elif key == ord(' '):
+            recording = not recording
+            if recording:
+                recorder.new_recording() # Its frames stay together in cross-validation (train_pipeline.py)
+        elif key == 8:
+            operator_label = ""
+        elif chr(key) in LABEL_LETTERS:
+            letter = chr(key)
+            operator_label = operator_label.replace(letter, "") if letter in operator_label else operator_label + letter
+recorder.close()
 cap.release()
 cv2.destroyAllWindows()
@@ -0,0 +1,135 @@
+import sys
+import time
+import argparse
+from collections import namedtuple
+import numpy as np
+from template_matching import load_templates, SIMILARITY_SCALE_DEG
+
+# Live form scoring: streaming subsequence DTW (SPRING) of the incoming joint angles against a
+# reference template. Only one DTW column (one cell per template sample) is kept; each frame
+# updates it in O(template length) with a prefix-sum + minimum.accumulate scan, so nothing is
+# recomputed over the history. Alongside the cost, every cell carries where its path started,
+# its length and its per-joint cost, which gives the live similarity, the joint deviating the
+# most, and the boundaries of each completed match.
+
+MATCH_THRESHOLD_DEG = 15.0 # mean deviation per sample and joint below which a match is reported
+
+LiveMatch = namedtuple('LiveMatch', 'similarity distance worst_joint match')
+
+
+def _similarity(distance):
+    # Scalar similarity_from_distance (template_matching.py), without the array machinery per frame
+    return max(0.0, min(100.0, 100.0 * (1.0 - distance / SIMILARITY_SCALE_DEG)))
+
+
+class StreamingMatcher:
+    def __init__(self, template, joints, threshold_deg=MATCH_THRESHOLD_DEG):
+        self.template = np.asarray(template, dtype=np.float64) # (length, joints)
+        self.joints = tuple(joints)
+        self.threshold_deg = threshold_deg
+        length, n_joints = self.template.shape
+        self._cells = np.arange(length + 1)
+        self._cost = np.empty(length + 1)
+        self._joint_cost = np.empty((length + 1, n_joints))
+        self._path_length = np.empty(length + 1)
+        self._start = np.empty(length + 1, dtype=np.int64)
+        self._joint_prefix = np.zeros((length + 1, n_joints))
+        self._ones = np.ones(n_joints)
+        self._source = np.zeros(length + 1, dtype=np.intp)
+        self._entry = np.zeros(length + 1) # entry[0] stays 0: starting fresh in this frame
+        self.reset()
+
+    def reset(self):
+        # Cell 0 is "before the template": always free to start from
+        self.frame = 0
+        self._cost[:] = np.inf
+        self._cost[0] = 0.0
+        self._joint_cost[:] = 0.0
+        self._path_length[:] = 0.0
+        self._start[:] = 0
+        self._best = None # (distance, start frame, end frame, joint costs) of the pending match
+
+    def update(self, angles):
+        # angles: this frame's angles, ordered like self.joints. Returns a LiveMatch; `match` is a
+        # dict for a completed match (reported once no later frame can improve it), else None.
+        self.frame += 1
+        t = self.frame
+        old_cost, old_joint, old_length, old_start = self._cost, self._joint_cost, self._path_length, self._start
+        old_start[0] = t # A path leaving cell 0 starts at this frame
+
+        joint_cost = np.abs(self.template - np.asarray(angles, dtype=np.float64)) # (length, joints)
+        np.cumsum(joint_cost, axis=0, out=self._joint_prefix[1:])
+        prefix = self._joint_prefix @ self._ones # P[i] = cost of template samples 1..i on this frame
+
+        # Entering cell i from the previous frame: diagonal (i-1) or vertical (i)
+        source = self._source
+        source[1:] = self._cells[1:] - (old_cost[:-1] <= old_cost[1:])
+        # D[i] = c[i] + min(reach[i], D[i-1]) = P[i] + min over k <= i of (reach[k] - P[k-1]),
+        # with k = 0 meaning "start in cell 0 of this frame"
+        entry = self._entry
+        np.minimum(old_cost[:-1], old_cost[1:], out=entry[1:])
+        entry[1:] -= prefix[:-1]
+        running = np.minimum.accumulate(entry)
+        k = np.maximum.accumulate(np.where(entry == running, self._cells, 0)) # entry cell of each path
+        src = source[k]
+
+        cost = prefix + running
+        cost[0] = 0.0
+        new_joint = old_joint[src] + self._joint_prefix - self._joint_prefix[np.maximum(k - 1, 0)]
+        new_length = old_length[src] + self._cells - np.maximum(k - 1, 0)
+        new_start = np.where(k == 0, t, old_start[src])
+        new_joint[0], new_length[0], new_start[0] = 0.0, 0.0, t
+        self._cost, self._joint_cost, self._path_length, self._start = cost, new_joint, new_length, new_start
+
+        # Mean deviation per sample and joint along each cell's path (cells 1..length; never empty)
+        normalized = cost[1:] / (new_length[1:] * len(self.joints))
+        match = None
+        if self._best is not None:
+            # SPRING: report once every live path is worse or starts after the pending match ended
+            best_distance, best_start, best_end, best_joints = self._best
+            overlapping = new_start[1:] <= best_end
+            if not np.any(overlapping & (normalized < best_distance)):
+                match = {'start_frame': best_start, 'end_frame': best_end, 'distance': best_distance,
+                         'similarity': _similarity(best_distance),
+                         'worst_joint': self.joints[int(np.argmax(best_joints))]}
+                self._best = None
+                cost[1:][overlapping] = np.inf # Later matches must not reuse these frames
+                normalized[overlapping] = np.inf
+
+        distance = float(normalized[-1])
+        if distance <= self.threshold_deg and (self._best is None or distance < self._best[0]):
+            self._best = (distance, int(new_start[-1]), t, new_joint[-1].copy())
+
+        worst = self.joints[int(new_joint[-1].argmax())] if distance < np.inf else None
+        return LiveMatch(_similarity(distance), distance, worst, match)
+
+
+def load_live_matcher(exercise_name, threshold_deg=MATCH_THRESHOLD_DEG):
+    # Matcher for the newest template of the exercise, or None when it has no template yet
+    template_ids, curves = load_templates(exercise_name)
+    if not template_ids:
+        return None
+    from exercise_rules import load_exercise
+    return StreamingMatcher(curves[-1], load_exercise(exercise_name).joints, threshold_deg)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the streaming matcher per frame on a synthetic stream.")
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--length', type=int, default=64)
+    parser.add_argument('--joints', type=int, default=3)
+    args = parser.parse_args()
+
+    x = np.linspace(0.0, 1.0, args.length)[:, None]
+    template = 170 - 100 * np.exp(-((x - 0.5) / 0.2) ** 2) * np.ones((1, args.joints))
+    matcher = StreamingMatcher(template, [f"joint{j}" for j in range(args.joints)])
+    rng = np.random.default_rng(0)
+    phase = np.arange(args.frames) / 90.0 % 1.0 # a rep every 3 s at 30 fps
+    stream = 170 - 100 * np.exp(-((phase - 0.5) / 0.2) ** 2)[:, None] + rng.normal(0, 3, (args.frames, args.joints))
+    matches = 0
+    start = time.perf_counter()
+    for frame in stream:
+        matches += matcher.update(frame).match is not None
+    elapsed = time.perf_counter() - start
+    print(f"{args.frames} frames, template length {args.length}: {elapsed / args.frames * 1e6:.1f} us/frame, "
+          f"{matches} matches reported", file=sys.stderr)
@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import argparse
+import itertools
+import threading
+import numpy as np
+
+# Classifier models loaded once per process, off the capture thread, and warm before first use.
+# start() returns immediately; a background thread loads the model, traces one inference function
+# with a fixed input signature ([None, features] float32, so no batch size ever retraces) and runs
+# warm-up batches through it. Only then is the manager ready: predict() never pays loading or
+# tracing costs, and returns None while the model is loading so a live loop can keep drawing. If
+# loading failed it raises ModelLoadError instead, so the loop can show why rather than wait forever.
+# The traced function holds no Python state, so any number of session threads can call it at once.
+
+MODEL_PATH = 'form_model_57'
+WARMUP_BATCH_SIZES = (1, 1, 1, 32) # the live loop predicts one frame at a time
+
+
+class ModelLoadError(RuntimeError):
+    pass
+
+
+class ModelManager:
+    def __init__(self, path=MODEL_PATH, warmup_batch_sizes=WARMUP_BATCH_SIZES):
+        self.path = path
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self.n_features = None
+        self.error = None
+        self._model = None
+        self._infer = None
+        self._ready = threading.Event()
+        self._done = threading.Event() # ready or failed
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._timings = {}
+        self._predictions = itertools.count() # next() is atomic, unlike += from several threads
+        self._predicted = 0
+
+    def start(self):
+        # Idempotent: the model is loaded once however many callers start it
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name=f"model-load-{self.path}", daemon=True)
+                self._thread.start()
+        return self
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            import tensorflow as tf
+            model = tf.keras.models.load_model(self.path)
+            loaded = time.perf_counter()
+            self.n_features = int(model.inputs[0].shape[-1])
+
+            @tf.function(input_signature=[tf.TensorSpec([None, self.n_features], tf.float32)])
+            def infer(features):
+                return model(features, training=False)
+
+            infer = infer.get_concrete_function()
+            traced = time.perf_counter()
+            first = None
+            for batch_size in self.warmup_batch_sizes:
+                infer(tf.zeros((batch_size, self.n_features), tf.float32)).numpy()
+                first = first or time.perf_counter()
+            warmed = time.perf_counter()
+            self._model, self._infer = model, infer
+            self._timings = {'load_s': loaded - started, 'trace_s': traced - loaded,
+                             'first_inference_s': (first or traced) - traced, 'warmup_s': warmed - traced,
+                             'ready_after_s': warmed - started}
+            self._ready.set()
+            print(f"Model {self.path} ready in {warmed - started:.2f}s "
+                  f"(load {loaded - started:.2f}s, trace {traced - loaded:.2f}s, warm-up {warmed - traced:.2f}s)")
+        except Exception as e:
+            self.error = e
+            print(f"Could not load model {self.path}: {e}")
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        # Block until ready (or failed); True when the model can be used
+        self.start()
+        self._done.wait(timeout)
+        return self.ready
+
+    def predict(self, features):
+        # (batch, features) -> (batch, outputs) numpy array like Model.predict, or None while loading;
+        # raises ModelLoadError once loading has failed
+        if not self._ready.is_set():
+            if self.error is not None:
+                raise ModelLoadError(f"Model failed to load: {self.error}") from self.error
+            return None
+        self._predicted = next(self._predictions) + 1
+        return self._infer(np.asarray(features, dtype=np.float32).reshape(-1, self.n_features)).numpy()
+
+    def stats(self):
+        state = 'ready' if self.ready else 'failed' if self.error is not None else \
+            'loading' if self._thread is not None else 'not started'
+        return dict(self._timings, path=self.path, state=state, predictions=self._predicted,
+                    error=None if self.error is None else str(self.error))
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_model_manager(path=MODEL_PATH):
+    # Process-wide manager per model path, already loading in the background
+    with _managers_lock:
+        key = os.path.abspath(path)
+        if key not in _managers:
+            _managers[key] = ModelManager(path)
+        return _managers[key].start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a model like the live demos do and report load/trace/inference timings.")
+    parser.add_argument('path', nargs='?', default=MODEL_PATH)
+    parser.add_argument('--threads', type=int, default=4, help="Concurrent predicting threads")
+    parser.add_argument('--calls', type=int, default=500, help="Single-frame predictions per thread")
+    args = parser.parse_args()
+
+    manager = get_model_manager(args.path)
+    if not manager.wait():
+        sys.exit(f"{manager.path}: {manager.stats()['error']}")
+    print(manager.stats(), file=sys.stderr)
+
+    def hammer(latencies):
+        frame = np.zeros((1, manager.n_features), dtype=np.float32)
+        for _ in range(args.calls):
+            started = time.perf_counter()
+            manager.predict(frame)
+            latencies.append(time.perf_counter() - started)
+
+    latencies = [[] for _ in range(args.threads)]
+    threads = [threading.Thread(target=hammer, args=(own,)) for own in latencies]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    flat = np.concatenate(latencies) * 1e3
+    print(f"{args.threads} threads x {args.calls} predictions: median {np.median(flat):.2f} ms, "
+          f"p99 {np.percentile(flat, 99):.2f} ms", file=sys.stderr)
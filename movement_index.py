@@ -0,0 +1,407 @@
+import os
+import sys
+import time
+import struct
+import sqlite3
+import argparse
+import threading
+import numpy as np
+from exercise_rules import load_exercise, available_exercises
+from rep_segmentation import REP_DTYPE
+from template_matching import CURVE_LENGTH, recording_rep_curves
+from route_auth import require_patient_access
+
+# Nearest-neighbour search over per-session movement signatures ("who moved like this patient?").
+# A signature is a fixed-length float32 vector: the session's mean rep curve per joint (downsampled)
+# plus the mean and spread of its rep metrics, each block scaled to carry equal weight.
+# Signatures are appended to one file per exercise next to the database:
+#
+#   header  64 bytes   magic 'TLMI', version, dimension, exercise name
+#   records N * (16 + 4 * dimension)   int64 session id, int64 patient id, float32 signature
+#
+# Records are only ever appended (a re-indexed session appends a new record that supersedes the
+# old one), so readers pick up new sessions by reading past the last offset they saw. Queries are
+# brute force over a contiguous in-memory matrix: one matrix-vector product against precomputed
+# squared norms and an argpartition, a few milliseconds for 100k sessions.
+
+DATABASE_PATH = 'theralink.db'
+
+INDEX_DIR = os.environ.get('THERALINK_MOVEMENT_INDEX_DIR', 'movement_index')
+INDEX_SUFFIX = '.tlm'
+
+MAGIC = b'TLMI'
+VERSION = 1
+HEADER_FORMAT = '<4sHH32s' # magic, version, dimension, exercise name
+HEADER_SIZE = 64
+
+SIGNATURE_SAMPLES = 16 # samples kept per joint from the CURVE_LENGTH mean rep curve
+ANGLE_SCALE_DEG = 180.0
+# Rep metrics in the signature and the scale that maps each to roughly 0..1
+METRIC_SCALES = {
+    'depth_angle': 180.0,
+    'range_of_motion': 180.0,
+    'descent_s': 5.0,
+    'ascent_s': 5.0,
+    'time_under_tension_s': 10.0,
+    'asymmetry_deg': 45.0,
+}
+DEFAULT_NEIGHBOURS = 10
+
+
+def signature_dimension(exercise):
+    return SIGNATURE_SAMPLES * len(exercise.joints) + 2 * len(METRIC_SCALES)
+
+
+def record_dtype(dimension):
+    return np.dtype([('session_id', '<i8'), ('patient_id', '<i8'), ('signature', '<f4', (dimension,))])
+
+
+def session_signature(reps, curves):
+    # reps: REP_DTYPE array (or rows with the METRIC_SCALES fields), curves: (n_reps, CURVE_LENGTH, joints)
+    curves = np.asarray(curves, dtype=np.float64)
+    samples = np.linspace(0, curves.shape[1] - 1, SIGNATURE_SAMPLES).round().astype(np.intp)
+    shape = (curves.mean(axis=0)[samples] / ANGLE_SCALE_DEG).T.ravel() # joint-major
+    metrics = np.array([[rep[field] for field in METRIC_SCALES] for rep in reps], dtype=np.float64)
+    metrics /= np.array(list(METRIC_SCALES.values()))
+    metrics = np.concatenate((metrics.mean(axis=0), metrics.std(axis=0)))
+    # Equal weight per block, whatever the number of joints
+    return np.concatenate((shape / np.sqrt(len(shape)), metrics / np.sqrt(len(metrics)))).astype(np.float32)
+
+
+def recording_signature(recording_path, reps, exercise):
+    # Signature of a recorded session from its reps; None when it has no complete rep
+    if reps is None or not len(reps):
+        return None
+    return session_signature(reps, recording_rep_curves(recording_path, reps, exercise, CURVE_LENGTH))
+
+
+def index_path(exercise_name, directory=None):
+    return os.path.join(directory or INDEX_DIR, f"{exercise_name}{INDEX_SUFFIX}")
+
+
+def append_signatures(exercise, session_ids, patient_ids, signatures, directory=None):
+    # One write per call, so a concurrent reader sees whole records (a torn tail is ignored)
+    dimension = signature_dimension(exercise)
+    path = index_path(exercise.name, directory)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    records = np.zeros(len(session_ids), dtype=record_dtype(dimension))
+    records['session_id'] = session_ids
+    records['patient_id'] = patient_ids
+    records['signature'] = signatures
+    with open(path, 'ab') as f:
+        if f.tell() == 0:
+            header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, dimension, exercise.name.encode())
+            f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(records.tobytes())
+
+
+class MovementIndex:
+    # In-memory view of one exercise's signature file; refresh() reads only what was appended since
+    def __init__(self, exercise_name, directory=None):
+        self.exercise = load_exercise(exercise_name)
+        self.path = index_path(self.exercise.name, directory)
+        self.dimension = signature_dimension(self.exercise)
+        self._dtype = record_dtype(self.dimension)
+        self._lock = threading.Lock()
+        self._offset = HEADER_SIZE
+        self._count = 0
+        self._signatures = np.zeros((0, self.dimension), dtype=np.float32)
+        self._session_ids = np.zeros(0, dtype=np.int64)
+        self._patient_ids = np.zeros(0, dtype=np.int64)
+        self._sq_norms = np.zeros(0, dtype=np.float32) # inf for superseded records
+        self._row_of_session = {}
+        self._by_patient = None # (rows ordered by patient, start of each patient's run), rebuilt after refresh
+
+    def __len__(self):
+        return len(self._row_of_session)
+
+    def _grow(self, needed):
+        capacity = len(self._signatures)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity, 1024)
+        for name in ('_signatures', '_session_ids', '_patient_ids', '_sq_norms'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._count] = old[:self._count]
+            setattr(self, name, new)
+
+    def refresh(self):
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                return 0
+            available = (size - self._offset) // self._dtype.itemsize
+            if available <= 0:
+                return 0
+            with open(self.path, 'rb') as f:
+                if self._offset == HEADER_SIZE:
+                    magic, version, dimension, _ = struct.unpack_from(HEADER_FORMAT, f.read(HEADER_SIZE))
+                    if magic != MAGIC or version != VERSION or dimension != self.dimension:
+                        raise ValueError(f"{self.path}: not a version {VERSION} index of dimension {self.dimension}")
+                f.seek(self._offset)
+                records = np.frombuffer(f.read(available * self._dtype.itemsize), dtype=self._dtype)
+            start = self._count
+            self._grow(start + len(records))
+            rows = slice(start, start + len(records))
+            self._signatures[rows] = records['signature']
+            self._session_ids[rows] = records['session_id']
+            self._patient_ids[rows] = records['patient_id']
+            self._sq_norms[rows] = np.einsum('ij,ij->i', records['signature'], records['signature'])
+            # The newest record of a session supersedes any earlier one
+            for row, session_id in enumerate(records['session_id'].tolist(), start):
+                previous = self._row_of_session.get(session_id)
+                if previous is not None:
+                    self._sq_norms[previous] = np.inf
+                self._row_of_session[session_id] = row
+            self._count += len(records)
+            self._by_patient = None
+            self._offset += len(records) * self._dtype.itemsize
+            return len(records)
+
+    def signature(self, session_id):
+        row = self._row_of_session.get(session_id)
+        return None if row is None else self._signatures[row].copy()
+
+    def _distances(self, signature, exclude_patient_ids=None):
+        # Squared euclidean distance from one signature to every record (inf for excluded ones)
+        n = self._count
+        query = np.asarray(signature, dtype=np.float32)
+        distances = self._signatures[:n] @ (-2.0 * query)
+        distances += self._sq_norms[:n]
+        distances += query @ query
+        if exclude_patient_ids:
+            distances[np.isin(self._patient_ids[:n], list(exclude_patient_ids))] = np.inf
+        return distances
+
+    def _top(self, distances, k):
+        k = min(k, int(np.isfinite(distances).sum()))
+        if k <= 0:
+            return np.zeros(0, dtype=np.intp)
+        nearest = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        return nearest[np.argsort(distances[nearest], kind='stable')]
+
+    def search(self, signature, k=DEFAULT_NEIGHBOURS, exclude_patient_ids=None):
+        # k nearest sessions: [(session_id, patient_id, distance), ...], closest first
+        self.refresh()
+        with self._lock:
+            distances = self._distances(signature, exclude_patient_ids)
+            rows = self._top(distances, k)
+            return [(int(self._session_ids[r]), int(self._patient_ids[r]), float(np.sqrt(max(distances[r], 0.0))))
+                    for r in rows]
+
+    def nearest_patients(self, signature, k=DEFAULT_NEIGHBOURS, exclude_patient_ids=None):
+        # Like search(), but one result per patient: their session closest to the signature
+        self.refresh()
+        with self._lock:
+            distances = self._distances(signature, exclude_patient_ids)
+            if not self._count:
+                return []
+            if self._by_patient is None:
+                order = np.argsort(self._patient_ids[:self._count], kind='stable')
+                patients = self._patient_ids[order]
+                self._by_patient = order, np.flatnonzero(np.r_[True, patients[1:] != patients[:-1]])
+            order, starts = self._by_patient
+            ordered = distances[order]
+            closest = np.minimum.reduceat(ordered, starts) # per patient
+            ends = np.r_[starts[1:], len(order)]
+            top = self._top(closest, k)
+            rows = [order[start + np.argmin(ordered[start:end])] for start, end in zip(starts[top], ends[top])]
+            return [(int(self._session_ids[r]), int(self._patient_ids[r]), float(np.sqrt(max(distances[r], 0.0))))
+                    for r in rows]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_movement_index(exercise_name='squat'):
+    # Process-wide index per exercise, refreshed on every query
+    with _indexes_lock:
+        if exercise_name not in _indexes:
+            _indexes[exercise_name] = MovementIndex(exercise_name)
+        return _indexes[exercise_name]
+
+
+def _exercise_names(conn):
+    # sessions.exercise_type holds the display name
+    names = {display: name for name, display in available_exercises().items()}
+    return {row[0]: names[row[0]] for row in conn.execute("SELECT DISTINCT exercise_type FROM sessions")
+            if row[0] in names}
+
+
+def mark_signatures_indexed(cursor, session_ids):
+    cursor.executemany("UPDATE sessions SET signature_indexed = 1 WHERE session_id = ?", [(i,) for i in session_ids])
+
+
+def backfill_signatures(conn=None, batch_size=500):
+    # Index recorded sessions not marked as indexed (saved before the index existed, or whose append
+    # failed); returns the count. Every session read is marked - those already in the index file
+    # without recomputing, and those with no reps or no readable recording - so none is read again
+    # on the next start.
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    added = 0
+    for display_name, exercise_name in _exercise_names(conn).items():
+        index = get_movement_index(exercise_name)
+        index.refresh()
+        exercise = index.exercise
+        if not len(index):
+            # Index file missing or emptied: sessions with reps have to be indexed again
+            conn.execute('''
+                UPDATE sessions SET signature_indexed = 0
+                WHERE exercise_type = ? AND signature_indexed = 1 AND recording_path IS NOT NULL
+                  AND session_id IN (SELECT session_id FROM reps)
+            ''', (display_name,))
+        last_id = 0
+        while True:
+            batch = conn.execute('''
+                SELECT session_id, patient_id, recording_path FROM sessions
+                WHERE exercise_type = ? AND signature_indexed = 0 AND recording_path IS NOT NULL AND session_id > ?
+                ORDER BY session_id LIMIT ?
+            ''', (display_name, last_id, batch_size)).fetchall()
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            pending = [row for row in batch if index.signature(row[0]) is None]
+            reps = {}
+            if pending:
+                ids = [row[0] for row in pending]
+                for session_id, *rep in conn.execute(f'''
+                    SELECT session_id, {', '.join(REP_DTYPE.names)} FROM reps
+                    WHERE session_id IN ({','.join('?' * len(ids))})
+                    ORDER BY session_id, rep_index
+                ''', ids):
+                    reps.setdefault(session_id, []).append(tuple(rep))
+            keys, signatures = [], []
+            for session_id, patient_id, path in pending:
+                if session_id not in reps:
+                    continue # No complete rep: nothing to index
+                try:
+                    signatures.append(recording_signature(path, np.array(reps[session_id], dtype=REP_DTYPE), exercise))
+                except (OSError, ValueError):
+                    continue # Missing recording: the session stays out of the index
+                keys.append((session_id, patient_id))
+            if keys:
+                append_signatures(exercise, [k[0] for k in keys], [k[1] for k in keys], np.stack(signatures))
+                added += len(keys)
+            # Marked only once the batch's signatures are on disk
+            mark_signatures_indexed(cursor, [row[0] for row in batch])
+            conn.commit()
+    conn.commit()
+    if own_conn:
+        conn.close()
+    return added
+
+
+def init_movement_index(conn=None):
+    # Requires the reps table (rep_segmentation.init_reps_table); returns the number of sessions backfilled
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    # Marks sessions the index has seen (indexed, or with nothing to index), so the startup backfill
+    # only reads sessions it has never looked at
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+    if 'signature_indexed' not in columns:
+        conn.execute("ALTER TABLE sessions ADD COLUMN signature_indexed INTEGER NOT NULL DEFAULT 0")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_signature_pending ON sessions (exercise_type, session_id)
+        WHERE signature_indexed = 0 AND recording_path IS NOT NULL
+    ''')
+    conn.commit()
+    added = backfill_signatures(conn)
+    if own_conn:
+        conn.close()
+    return added
+
+
+def similar_patients(patient_id, exercise_name='squat', k=DEFAULT_NEIGHBOURS):
+    # Patients whose movement was closest to this patient's intake (first indexed) session, with how
+    # they progressed: per-session mean range of motion and depth from the reps table
+    index = get_movement_index(exercise_name)
+    index.refresh()
+    conn = sqlite3.connect(DATABASE_PATH)
+    sessions = conn.execute('''
+        SELECT session_id FROM sessions
+        WHERE patient_id = ? AND exercise_type = ? AND recording_path IS NOT NULL
+        ORDER BY date, session_id
+    ''', (patient_id, index.exercise.display_name)).fetchall()
+    intake = next((session_id for session_id, in sessions if index.signature(session_id) is not None), None)
+    if intake is None:
+        conn.close()
+        return {'intake_session_id': None, 'neighbours': []}
+
+    matches = index.nearest_patients(index.signature(intake), k, exclude_patient_ids={patient_id})
+    progress = {}
+    if matches:
+        ids = [m[1] for m in matches]
+        rows = conn.execute(f'''
+            SELECT r.patient_id, s.session_id, s.date, COUNT(*), AVG(r.range_of_motion), AVG(r.depth_angle)
+            FROM reps r JOIN sessions s ON s.session_id = r.session_id
+            WHERE r.patient_id IN ({','.join('?' * len(ids))}) AND s.exercise_type = ?
+            GROUP BY r.session_id
+            ORDER BY r.patient_id, s.date, s.session_id
+        ''', ids + [index.exercise.display_name]).fetchall()
+        for other, session_id, date, reps, rom, depth in rows:
+            progress.setdefault(other, []).append({'session_id': session_id, 'date': date, 'reps': reps,
+                                                   'range_of_motion': rom, 'depth_angle': depth})
+    conn.close()
+    return {
+        'intake_session_id': intake,
+        'neighbours': [{'patient_id': other, 'session_id': session_id, 'distance': distance,
+                        'progress': progress.get(other, [])}
+                       for session_id, other, distance in matches],
+    }
+
+
+def register_similarity_routes(server):
+    # GET /api/patients/<patient_id>/similar?exercise=<name>&k=<n> -> JSON from similar_patients
+    # Lists other patients' sessions and progress, so only the patient's own doctor may ask
+    from flask import abort, jsonify, request
+    from exercise_rules import ExerciseDefinitionError
+
+    @server.route('/api/patients/<int:patient_id>/similar')
+    def similar_patients_route(patient_id):
+        require_patient_access(patient_id, allow_patient=False)
+        k = min(max(request.args.get('k', DEFAULT_NEIGHBOURS, type=int), 1), 100)
+        try:
+            return jsonify(similar_patients(patient_id, request.args.get('exercise', 'squat'), k))
+        except ExerciseDefinitionError:
+            abort(404)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Movement signature index: backfill, or time queries on synthetic data.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('backfill', help="Index recorded sessions missing from the index")
+    bench = sub.add_parser('benchmark', help="Time top-k queries over synthetic signatures")
+    bench.add_argument('sessions', type=int)
+    bench.add_argument('--queries', type=int, default=200)
+    bench.add_argument('-k', type=int, default=DEFAULT_NEIGHBOURS)
+    bench.add_argument('--directory', default='/tmp/theralink_index_benchmark')
+    args = parser.parse_args()
+
+    if args.command == 'backfill':
+        print(f"{init_movement_index()} sessions indexed", file=sys.stderr)
+    else:
+        exercise = load_exercise('squat')
+        rng = np.random.default_rng(0)
+        signatures = rng.normal(0, 0.1, (args.sessions, signature_dimension(exercise))).astype(np.float32)
+        if os.path.exists(index_path(exercise.name, args.directory)):
+            os.remove(index_path(exercise.name, args.directory))
+        start = time.perf_counter()
+        for chunk in range(0, args.sessions, 10000): # incremental inserts
+            rows = np.arange(chunk, min(chunk + 10000, args.sessions))
+            append_signatures(exercise, rows + 1, rows // 20 + 1, signatures[rows], args.directory)
+        index = MovementIndex(exercise.name, args.directory)
+        index.refresh()
+        print(f"{len(index)} signatures written and loaded in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+        for name, query in (('search', index.search), ('nearest_patients', index.nearest_patients)):
+            start = time.perf_counter()
+            for q in signatures[:args.queries]:
+                query(q, args.k)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>16}: {elapsed / args.queries * 1e3:.2f} ms/query (k={args.k})", file=sys.stderr)
@@ -0,0 +1,163 @@
+import sys
+import time
+import argparse
+import threading
+from collections import OrderedDict, namedtuple
+import cv2
+import numpy as np
+
+# Cached HUD layers for the live video (process_frame, label_final_results).
+# cv2.putText re-rasterises every glyph on every frame although the counters, feedback and labels
+# change a few times a minute. Here each distinct text (or banner) is rendered once into a small
+# BGRA sprite - an anti-aliased coverage mask plus colour - kept in an LRU cache keyed by its
+# content, and composited onto each frame with one vectorized blend over the sprite's region.
+# Sprites line up with what cv2.putText would draw at the same origin, so callers keep their
+# coordinates. The anti-aliased edges are blended from a coverage mask rather than drawn in place,
+# so they can differ from cv2.putText by 1 level here and there. Only text that repeats belongs
+# here: a string that changes every frame (a live percentage) would just churn the cache.
+
+OVERLAY_CACHE_SPRITES = 1024 # e.g. every "Knee: 0".."Knee: 180" plus the counters and messages
+
+# bgr: (h, w, 3) uint8 colour, copied as is when the sprite is opaque (inverse is None);
+# inverse: (h, w, 3) uint8 255 - alpha; premultiplied: (h, w, 3) uint8 colour * alpha / 255;
+# offset: sprite top-left relative to the text origin
+Sprite = namedtuple('Sprite', 'bgr inverse premultiplied offset')
+
+
+def _make_sprite(bgr, coverage, offset):
+    if coverage is None:
+        return Sprite(bgr, None, None, offset)
+    alpha = np.repeat(coverage[..., None], 3, axis=2)
+    return Sprite(bgr, 255 - alpha, cv2.multiply(bgr, alpha, scale=1 / 255), offset)
+
+
+def render_text(text, font_scale, color, thickness=1, font=cv2.FONT_HERSHEY_SIMPLEX, line_type=cv2.LINE_AA):
+    # Sprite of `text`; its offset places it exactly where cv2.putText(image, text, org, ...) draws
+    (width, height), baseline = cv2.getTextSize(text, font, font_scale, thickness)
+    pad = thickness + 1 # strokes and anti-aliasing reach a little past the reported box
+    coverage = np.zeros((height + baseline + 2 * pad, width + 2 * pad), dtype=np.uint8)
+    cv2.putText(coverage, text, (pad, pad + height), font, font_scale, 255, thickness, line_type)
+    bgr = np.empty(coverage.shape + (3,), dtype=np.uint8)
+    bgr[:] = color
+    return _make_sprite(bgr, coverage, (-pad, -pad - height))
+
+
+def render_banner(width, height, color, text, text_org, font_scale, text_color, thickness=1,
+                  font=cv2.FONT_HERSHEY_SIMPLEX, line_type=cv2.LINE_8):
+    # Opaque filled rectangle with text drawn into it (label_final_results' banner)
+    bgr = np.empty((height, width, 3), dtype=np.uint8)
+    bgr[:] = color
+    cv2.putText(bgr, text, text_org, font, font_scale, text_color, thickness, line_type)
+    return _make_sprite(bgr, None, (0, 0))
+
+
+def blend(image, sprite, x, y):
+    # Composite the sprite with its top-left at (x, y), clipped to the image
+    h, w = sprite.bgr.shape[:2]
+    top, left = max(y, 0), max(x, 0)
+    bottom, right = min(y + h, image.shape[0]), min(x + w, image.shape[1])
+    if top >= bottom or left >= right:
+        return
+    region = image[top:bottom, left:right]
+    rows, cols = slice(top - y, bottom - y), slice(left - x, right - x)
+    if sprite.inverse is None:
+        region[:] = sprite.bgr[rows, cols]
+        return
+    # region * (1 - alpha) + colour * alpha, as two saturating uint8 passes in place
+    cv2.multiply(region, sprite.inverse[rows, cols], dst=region, scale=1 / 255)
+    cv2.add(region, sprite.premultiplied[rows, cols], dst=region)
+
+
+class Overlay:
+    # Content-keyed sprite cache + compositor; safe to share between threads
+    def __init__(self, max_sprites=OVERLAY_CACHE_SPRITES):
+        self.max_sprites = max_sprites
+        self._sprites = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'renders': 0, 'evictions': 0}
+
+    def _sprite(self, key, render):
+        with self._lock:
+            sprite = self._sprites.get(key)
+            if sprite is not None:
+                self._sprites.move_to_end(key)
+                self._counters['hits'] += 1
+                return sprite
+        sprite = render()
+        with self._lock:
+            self._counters['renders'] += 1
+            self._sprites[key] = sprite
+            while len(self._sprites) > self.max_sprites:
+                self._sprites.popitem(last=False)
+                self._counters['evictions'] += 1
+        return sprite
+
+    def text(self, image, text, org, font_scale, color, thickness=1, font=cv2.FONT_HERSHEY_SIMPLEX,
+             line_type=cv2.LINE_AA):
+        # Drop-in for cv2.putText(image, text, org, font, font_scale, color, thickness, line_type)
+        sprite = self._sprite(('text', text, font, font_scale, tuple(color), thickness, line_type),
+                              lambda: render_text(text, font_scale, color, thickness, font, line_type))
+        blend(image, sprite, int(org[0]) + sprite.offset[0], int(org[1]) + sprite.offset[1])
+
+    def banner(self, image, height, color, text, text_org, font_scale, text_color, thickness=1,
+               font=cv2.FONT_HERSHEY_SIMPLEX, line_type=cv2.LINE_8):
+        # Full-width opaque banner at the top of the image, with its text
+        width = image.shape[1]
+        sprite = self._sprite(('banner', width, height, tuple(color), text, tuple(text_org), font_scale,
+                               tuple(text_color), thickness, font, line_type),
+                              lambda: render_banner(width, height, color, text, text_org, font_scale, text_color,
+                                                    thickness, font, line_type))
+        blend(image, sprite, 0, 0)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, sprites=len(self._sprites), max_sprites=self.max_sprites)
+
+
+hud = Overlay()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time a process_frame-like HUD drawn with cv2.putText vs cached sprites.")
+    parser.add_argument('--frames', type=int, default=3000)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    args = parser.parse_args()
+
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    frame = np.random.default_rng(0).integers(0, 255, (args.height, args.width, 3), dtype=np.uint8)
+
+    def hud_items(i):
+        # (text, org, scale, colour, thickness) as process_frame draws them; the duration changes
+        # every 30 frames, reps every 90, angles every frame
+        seconds = i // 30
+        yield f"Knee: {100 + i % 60}", (10, 30), 1, (0, 255, 0), 2
+        yield f"Hip: {120 + i % 40}", (10, 70), 1, (0, 255, 0), 2
+        yield f"Reps: {i // 90 % 10}/10", (args.width - 300, 30), 1, (0, 255, 0), 2
+        yield f"Sets: {i // 900 % 3}/3", (args.width - 300, 70), 1, (0, 255, 0), 2
+        yield f"Duration: {seconds // 60:02d}:{seconds % 60:02d}", (args.width - 300, 110), 1, (0, 255, 0), 2
+        yield "Keep your chest up" if i // 90 % 2 else "Good depth", (args.width // 2 - 150, args.height - 50), 1, (0, 0, 255), 2
+
+    results = {}
+    for name in ('cv2.putText', 'cached sprites'):
+        overlay = Overlay()
+        image = np.empty_like(frame)
+        start = time.perf_counter()
+        for i in range(args.frames):
+            np.copyto(image, frame)
+            for text, org, scale, color, thickness in hud_items(i):
+                if name == 'cv2.putText':
+                    cv2.putText(image, text, org, font, scale, color, thickness, cv2.LINE_AA)
+                else:
+                    overlay.text(image, text, org, scale, color, thickness)
+            if name == 'cv2.putText':
+                cv2.rectangle(image, (0, 0), (args.width, 74), (13, 13, 205), -1)
+                cv2.putText(image, "   Knee Ahead, push your butt out", (0, 43), font, 0.6, (255, 255, 255), 2)
+            else:
+                overlay.banner(image, 75, (13, 13, 205), "   Knee Ahead, push your butt out", (0, 43), 0.6, (255, 255, 255), 2)
+        results[name] = (time.perf_counter() - start, image.copy())
+        print(f"{name:>15}: {results[name][0] / args.frames * 1e6:.0f} us/frame "
+              f"(frame copy included){'' if name == 'cv2.putText' else f', {overlay.stats()}'}", file=sys.stderr)
+    difference = np.abs(results['cv2.putText'][1].astype(int) - results['cached sprites'][1].astype(int))
+    print(f"last frame: max pixel difference {difference.max()}, {np.mean(difference > 1) * 100:.3f}% of values differ by more than 1",
+          file=sys.stderr)
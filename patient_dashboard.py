@@ -6,11 +6,15 @@ import plotly.graph_objects as go
 import pandas as pd
 import sqlite3
 from datetime import datetime, timedelta
+from query_cache import cached_query
+from exercise_rules import available_exercises
+import app_squat
 
 dash.register_page(__name__, path='/patient_dashboard', title='Patient Dashboard', order=1)
 
 DATABASE_PATH = 'theralink.db'
 
+@cached_query('patient_sessions_summary', entity='patient')
 def get_patient_sessions_summary(patient_id):
     conn = sqlite3.connect(DATABASE_PATH)
     df = pd.read_sql_query(f"""
@@ -22,6 +26,7 @@ def get_patient_sessions_summary(patient_id):
     conn.close()
     return df
 
+@cached_query('upcoming_appointments', entity='patient')
 def get_upcoming_appointments_patient(patient_id):
     conn = sqlite3.connect(DATABASE_PATH)
     # Join with users table to get doctor username
@@ -29,10 +34,10 @@ def get_upcoming_appointments_patient(patient_id):
         SELECT u.username as doctor_username, a.appointment_date, a.appointment_time
         FROM appointments a
         JOIN users u ON a.doctor_id = u.id
-        WHERE a.patient_id = {patient_id} AND a.status = 'Scheduled'
-        AND a.appointment_date >= DATE('now')
-        ORDER BY a.appointment_date, a.appointment_time
-    """, conn)
+        WHERE a.patient_id = ? AND a.status = 'Scheduled'
+        AND a.starts_at >= DATE('now') -- range scan on idx_appointments_patient_start
+        ORDER BY a.starts_at
+    """, conn, params=(patient_id,))
     conn.close()
     return df
 
@@ -59,6 +64,25 @@ def layout(patient_username=None):
             )
         ]),
 
+        dbc.Row([
+            dbc.Col(
+                dbc.Card([
+                    dbc.CardHeader("Exercise"),
+                    dbc.CardBody([
+                        # Exercise counted by the camera (app_squat.py) in the next session
+                        dcc.Dropdown(
+                            id='patient-exercise-select',
+                            options=[{'label': display, 'value': name} for name, display in available_exercises().items()],
+                            value=app_squat.current_exercise.name,
+                            clearable=False
+                        ),
+                        html.Div(id='patient-exercise-status', className="mt-2")
+                    ])
+                ]),
+                width=12, className="mb-4"
+            )
+        ]),
+
         dbc.Row([
             dbc.Col(
                 dbc.Card([
@@ -80,6 +104,21 @@ def layout(patient_username=None):
 def store_patient_id(user_id):
     return user_id
 
+@callback(
+    Output('patient-exercise-status', 'children'),
+    Input('patient-exercise-select', 'value'),
+    State('patient-id-store-page', 'data'),
+    prevent_initial_call=True
+)
+def select_exercise(exercise_name, patient_id):
+    if not patient_id:
+        return html.P("Please log in as a patient to choose an exercise.")
+    try:
+        app_squat.set_exercise(exercise_name) # Rules, rep counting and segmentation all follow it
+    except RuntimeError as e:
+        return dbc.Alert(str(e), color="warning")
+    return html.P(f"Next session: {app_squat.current_exercise.display_name}")
+
 @callback(
     Output('patient-dashboard-progress-summary', 'children'),
     Output('patient-dashboard-appointments', 'children'),
@@ -0,0 +1,96 @@
+import sqlite3
+
+# Search-as-you-type lookup of a doctor's patients by name or username prefix.
+# Both columns have case-insensitive indexes, so a prefix becomes a short index range scan
+# and only the top `limit` patients are read, however large the caseload is.
+
+DATABASE_PATH = 'theralink.db'
+
+TYPEAHEAD_LIMIT = 20
+
+TYPEAHEAD_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_patients_doctor_name_nocase ON patients (doctor_id, name COLLATE NOCASE, patient_id)",
+    "CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)",
+]
+
+_PATIENT_COLUMNS = "p.patient_id, p.name, u.username"
+
+
+def ensure_typeahead_indexes(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    for statement in TYPEAHEAD_INDEXES:
+        conn.execute(statement)
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+def _prefix_range(prefix):
+    # [low, high) bounds matching every string that starts with `prefix` (compared with NOCASE).
+    # NOCASE compares ASCII letters as lowercase, so the bound is built from the lowercased prefix:
+    # bumping an uppercase last letter ('Z' -> '[') would give a bound below the lowercase letters.
+    prefix = ''.join(c.lower() if c.isascii() else c for c in prefix)
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def search_patient_prefix(doctor_id, prefix, limit=TYPEAHEAD_LIMIT):
+    # Top `limit` of the doctor's patients whose name or username starts with `prefix`, by name.
+    # With no prefix, the first patients alphabetically (what a dropdown shows before typing).
+    prefix = (prefix or '').strip()
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    if not prefix:
+        rows = conn.execute(f'''
+            SELECT {_PATIENT_COLUMNS} FROM patients p JOIN users u ON u.id = p.patient_id
+            WHERE p.doctor_id = ?
+            ORDER BY p.name COLLATE NOCASE, p.patient_id
+            LIMIT ?
+        ''', (doctor_id, limit)).fetchall()
+    else:
+        low, high = _prefix_range(prefix)
+        rows = conn.execute(f'''
+            SELECT * FROM (
+                SELECT {_PATIENT_COLUMNS} FROM patients p JOIN users u ON u.id = p.patient_id
+                WHERE p.doctor_id = ? AND p.name >= ? COLLATE NOCASE AND p.name < ? COLLATE NOCASE
+                ORDER BY p.name COLLATE NOCASE, p.patient_id
+                LIMIT ?
+            )
+            UNION
+            SELECT * FROM (
+                -- CROSS JOIN keeps users as the outer loop, so the username index drives this branch
+                SELECT {_PATIENT_COLUMNS} FROM users u CROSS JOIN patients p ON p.patient_id = u.id
+                WHERE u.username >= ? COLLATE NOCASE AND u.username < ? COLLATE NOCASE AND p.doctor_id = ?
+                ORDER BY u.username COLLATE NOCASE
+                LIMIT ?
+            )
+            ORDER BY 2 COLLATE NOCASE, 1
+            LIMIT ?
+        ''', (doctor_id, low, high, limit, low, high, doctor_id, limit, limit)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def get_patient_option(doctor_id, patient_id):
+    # The option for one (already selected) patient, so it stays visible while the list is filtered
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute(f'''
+        SELECT {_PATIENT_COLUMNS} FROM patients p JOIN users u ON u.id = p.patient_id
+        WHERE p.patient_id = ? AND p.doctor_id = ?
+    ''', (patient_id, doctor_id)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def count_doctor_patients(doctor_id):
+    conn = sqlite3.connect(DATABASE_PATH)
+    count = conn.execute("SELECT COUNT(*) FROM patients WHERE doctor_id = ?", (doctor_id,)).fetchone()[0]
+    conn.close()
+    return count
+
+
+def patient_option(patient):
+    return {'label': f"{patient['name']} ({patient['username']})", 'value': patient['patient_id']}
+
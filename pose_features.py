@@ -0,0 +1,198 @@
+import sys
+import math
+import time
+import argparse
+import numpy as np
+from exercise_rules import LANDMARK_NAMES
+
+# Full-body feature vector for the 57-feature form classifier (SquatPosture.get_params(results, all=True)).
+# Every feature is defined by a row in one of the index tables below, so a whole vector - or a whole
+# (N, 33, C) batch of them - is computed with one gather and a few array operations per feature
+# group instead of a Python expression per landmark. Virtual mid-points (between the shoulders,
+# hips and ankles) are appended to the landmark axis first, so they are indexed like any landmark.
+#
+#   21 angles (degrees): 16 joint angles, 5 segment inclinations from vertical
+#   14 distances and 12 signed offsets, divided by the torso length (so independent of camera distance)
+#   10 visibility terms: mean visibility per body region, visibility-weighted left/right joint angles
+#
+# Landmarks are (x, y, z) or (x, y, z, visibility); without visibility every landmark counts as visible.
+
+_INDEX = {name: i for i, name in enumerate(LANDMARK_NAMES)}
+_VIRTUAL = {
+    'MID_SHOULDER': ('LEFT_SHOULDER', 'RIGHT_SHOULDER'),
+    'MID_HIP': ('LEFT_HIP', 'RIGHT_HIP'),
+    'MID_ANKLE': ('LEFT_ANKLE', 'RIGHT_ANKLE'),
+}
+_INDEX.update({name: len(LANDMARK_NAMES) + i for i, name in enumerate(_VIRTUAL)})
+_VIRTUAL_PAIRS = np.array([[_INDEX[a], _INDEX[b]] for a, b in _VIRTUAL.values()], dtype=np.intp)
+
+
+def _table(rows):
+    return np.array([[_INDEX[name] for name in row] for row in rows], dtype=np.intp)
+
+
+def _sides(rows):
+    # 'S_KNEE' -> LEFT_KNEE row followed by RIGHT_KNEE row
+    return [[name.replace('S_', side + '_') for name in row] for side in ('LEFT', 'RIGHT') for row in rows]
+
+
+# Angle at the middle landmark (same definition as calculate_angle)
+JOINT_ANGLES = _sides([
+    ('S_HIP', 'S_KNEE', 'S_ANKLE'), # knee
+    ('S_SHOULDER', 'S_HIP', 'S_KNEE'), # hip
+    ('S_KNEE', 'S_ANKLE', 'S_FOOT_INDEX'), # ankle
+    ('S_ELBOW', 'S_SHOULDER', 'S_HIP'), # shoulder
+    ('S_SHOULDER', 'S_ELBOW', 'S_WRIST'), # elbow
+    ('S_ELBOW', 'S_WRIST', 'S_INDEX'), # wrist
+    ('S_EAR', 'S_SHOULDER', 'S_HIP'), # neck
+])
+JOINT_ANGLES += [('RIGHT_HIP', 'LEFT_HIP', 'LEFT_KNEE'), ('LEFT_HIP', 'RIGHT_HIP', 'RIGHT_KNEE')] # hip abduction
+# Lean of the segment from -> to, from upright (0) in image coordinates
+INCLINATIONS = [('MID_HIP', 'MID_SHOULDER')] + _sides([('S_ANKLE', 'S_KNEE'), ('S_KNEE', 'S_HIP')])
+DISTANCES = [
+    ('LEFT_SHOULDER', 'RIGHT_SHOULDER'), ('LEFT_HIP', 'RIGHT_HIP'), ('LEFT_KNEE', 'RIGHT_KNEE'),
+    ('LEFT_ANKLE', 'RIGHT_ANKLE'), ('LEFT_WRIST', 'RIGHT_WRIST'), ('LEFT_FOOT_INDEX', 'RIGHT_FOOT_INDEX'),
+    ('NOSE', 'MID_HIP'), ('NOSE', 'MID_ANKLE'),
+] + _sides([('S_HIP', 'S_ANKLE'), ('S_SHOULDER', 'S_WRIST'), ('S_EAR', 'S_SHOULDER')])
+# Signed (to - from) along one axis: 0 = x, 1 = y, 2 = z
+OFFSETS = [
+    ('S_FOOT_INDEX', 'S_KNEE', 0), # knee ahead of the toes
+    ('S_FOOT_INDEX', 'S_HEEL', 1), # heel lift
+    ('S_KNEE', 'S_HIP', 1), # hip above (-) or below (+) the knee
+]
+OFFSETS = [(a.replace('S_', side + '_'), b.replace('S_', side + '_'), axis)
+           for side in ('LEFT', 'RIGHT') for a, b, axis in OFFSETS] + [
+    ('MID_ANKLE', 'MID_SHOULDER', 0), ('MID_ANKLE', 'MID_HIP', 0), ('MID_ANKLE', 'MID_HIP', 1),
+    ('LEFT_SHOULDER', 'RIGHT_SHOULDER', 1), ('LEFT_HIP', 'RIGHT_HIP', 1), ('LEFT_SHOULDER', 'RIGHT_SHOULDER', 2),
+]
+TORSO = ('MID_SHOULDER', 'MID_HIP')
+VISIBILITY_REGIONS = {
+    'head': [name for name in LANDMARK_NAMES[:11]],
+    'left_arm': ['LEFT_SHOULDER', 'LEFT_ELBOW', 'LEFT_WRIST', 'LEFT_PINKY', 'LEFT_INDEX', 'LEFT_THUMB'],
+    'right_arm': ['RIGHT_SHOULDER', 'RIGHT_ELBOW', 'RIGHT_WRIST', 'RIGHT_PINKY', 'RIGHT_INDEX', 'RIGHT_THUMB'],
+    'left_leg': ['LEFT_HIP', 'LEFT_KNEE', 'LEFT_ANKLE', 'LEFT_HEEL', 'LEFT_FOOT_INDEX'],
+    'right_leg': ['RIGHT_HIP', 'RIGHT_KNEE', 'RIGHT_ANKLE', 'RIGHT_HEEL', 'RIGHT_FOOT_INDEX'],
+}
+# Left/right joint angle pairs (rows of JOINT_ANGLES) averaged with visibility weights
+WEIGHTED_JOINTS = ('knee', 'hip', 'ankle', 'shoulder', 'elbow')
+_N_SIDED = 7 # sided rows per side in JOINT_ANGLES
+
+_ANGLES = _table(JOINT_ANGLES)
+_INCLINATIONS = _table(INCLINATIONS)
+# Every 2D vector the features need, gathered in one step as points[to] - points[from]:
+# both arms of each joint angle, the inclined segments, then the distances and the torso
+_VECTORS = np.concatenate((_ANGLES[:, [1, 0]], _ANGLES[:, [1, 2]], _INCLINATIONS, _table(DISTANCES), _table([TORSO])))
+_N_ANGLES, _N_INCLINATIONS = len(JOINT_ANGLES), len(INCLINATIONS)
+_N_DIRECTIONS = 2 * _N_ANGLES + _N_INCLINATIONS # vectors whose direction is used
+# Offsets index the flattened (points * 3) coordinates
+_OFFSETS = np.array([[_INDEX[a] * 3 + axis, _INDEX[b] * 3 + axis] for a, b, axis in OFFSETS], dtype=np.intp)
+# Landmarks -> landmarks + virtual mid-points, as one (36, 33) matrix product
+_WITH_VIRTUAL = np.vstack((np.eye(len(LANDMARK_NAMES)), np.zeros((len(_VIRTUAL), len(LANDMARK_NAMES)))))
+for _v, _pair in enumerate(_VIRTUAL_PAIRS):
+    _WITH_VIRTUAL[len(LANDMARK_NAMES) + _v, _pair] = 0.5
+# Region membership as a (33, regions) averaging matrix
+_REGIONS = np.zeros((len(LANDMARK_NAMES), len(VISIBILITY_REGIONS)))
+for _r, _names in enumerate(VISIBILITY_REGIONS.values()):
+    _REGIONS[[_INDEX[name] for name in _names], _r] = 1.0 / len(_names)
+_WEIGHTED = np.array([[i, _N_SIDED + i] for i in range(len(WEIGHTED_JOINTS))], dtype=np.intp) # (joints, L/R)
+_WEIGHTED_LANDMARKS = _ANGLES[_WEIGHTED] # (joints, L/R, 3)
+
+FEATURE_NAMES = tuple(
+    [f"angle_{'_'.join(name.lower() for name in row)}" for row in JOINT_ANGLES]
+    + [f"inclination_{a.lower()}_{b.lower()}" for a, b in INCLINATIONS]
+    + [f"distance_{a.lower()}_{b.lower()}" for a, b in DISTANCES]
+    + [f"offset_{'xyz'[axis]}_{a.lower()}_{b.lower()}" for a, b, axis in OFFSETS]
+    + [f"visibility_{region}" for region in VISIBILITY_REGIONS]
+    + [f"weighted_{joint}_angle" for joint in WEIGHTED_JOINTS]
+)
+N_FEATURES = len(FEATURE_NAMES)
+assert N_FEATURES == 57, N_FEATURES
+
+EPSILON = 1e-6
+
+
+def full_body_features(landmarks):
+    # (33, C) or (N, 33, C) landmarks with C >= 3 -> (57,) or (N, 57) float32 features (FEATURE_NAMES order)
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+    single = landmarks.ndim == 2
+    if single:
+        landmarks = landmarks[None]
+    if landmarks.shape[1:2] != (len(LANDMARK_NAMES),) or landmarks.shape[2] < 3:
+        raise ValueError(f"Expected (N, {len(LANDMARK_NAMES)}, 3+) landmarks, got {landmarks.shape}")
+    n = len(landmarks)
+    points = _WITH_VIRTUAL @ landmarks[..., :3] # (N, 36, 3)
+    visibility = landmarks[..., 3] if landmarks.shape[2] > 3 else np.ones((n, len(LANDMARK_NAMES)))
+
+    vectors = points[:, _VECTORS[:, 1], :2] - points[:, _VECTORS[:, 0], :2]
+    direction = np.degrees(np.arctan2(vectors[:, :_N_DIRECTIONS, 1], vectors[:, :_N_DIRECTIONS, 0]))
+    # Joint angle: between the two arms, folded into [0, 180] (as calculate_angle)
+    angles = np.abs(direction[:, _N_ANGLES:2 * _N_ANGLES] - direction[:, :_N_ANGLES])
+    angles = np.where(angles > 180.0, 360.0 - angles, angles)
+    # Inclination: direction measured from straight up (-y), in (-180, 180]
+    inclination = (direction[:, 2 * _N_ANGLES:] + 270.0) % 360.0 - 180.0
+    lengths = np.sqrt(np.einsum('nvc,nvc->nv', vectors[:, _N_DIRECTIONS:], vectors[:, _N_DIRECTIONS:]))
+    torso = np.maximum(lengths[:, -1:], EPSILON)
+    flat = points.reshape(n, -1)
+    offsets = (flat[:, _OFFSETS[:, 1]] - flat[:, _OFFSETS[:, 0]]) / torso
+
+    # Each side's angle weighted by the lowest visibility of its three landmarks
+    weight = visibility[:, _WEIGHTED_LANDMARKS].min(axis=-1) # (N, joints, L/R)
+    pair = angles[:, _WEIGHTED]
+    total = weight.sum(axis=-1)
+    weighted = np.where(total > EPSILON, (pair * weight).sum(axis=-1) / np.maximum(total, EPSILON), pair.mean(axis=-1))
+
+    features = np.concatenate((angles, inclination, lengths[:, :-1] / torso, offsets, visibility @ _REGIONS, weighted),
+                              axis=1).astype(np.float32)
+    return features[0] if single else features
+
+
+def _features_per_landmark(landmarks):
+    # Reference implementation, one Python expression per landmark and feature (benchmark baseline)
+    point = {name: tuple(float(v) for v in landmarks[i][:3]) for i, name in enumerate(LANDMARK_NAMES)}
+    vis = {name: float(landmarks[i][3]) if len(landmarks[i]) > 3 else 1.0 for i, name in enumerate(LANDMARK_NAMES)}
+    for name, (a, b) in _VIRTUAL.items():
+        point[name] = tuple((p + q) / 2 for p, q in zip(point[a], point[b]))
+
+    def angle(a, b, c):
+        radians = math.atan2(point[c][1] - point[b][1], point[c][0] - point[b][0]) \
+            - math.atan2(point[a][1] - point[b][1], point[a][0] - point[b][0])
+        degrees = abs(math.degrees(radians))
+        return 360.0 - degrees if degrees > 180.0 else degrees
+
+    torso = max(math.dist(point[TORSO[0]][:2], point[TORSO[1]][:2]), EPSILON)
+    angles = [angle(*row) for row in JOINT_ANGLES]
+    values = list(angles)
+    values += [math.degrees(math.atan2(point[b][0] - point[a][0], -(point[b][1] - point[a][1]))) for a, b in INCLINATIONS]
+    values += [math.dist(point[a][:2], point[b][:2]) / torso for a, b in DISTANCES]
+    values += [(point[b][axis] - point[a][axis]) / torso for a, b, axis in OFFSETS]
+    values += [sum(vis[name] for name in names) / len(names) for names in VISIBILITY_REGIONS.values()]
+    for i in range(len(WEIGHTED_JOINTS)):
+        left_weight = min(vis[name] for name in JOINT_ANGLES[i])
+        right_weight = min(vis[name] for name in JOINT_ANGLES[_N_SIDED + i])
+        total = left_weight + right_weight
+        values.append((angles[i] * left_weight + angles[_N_SIDED + i] * right_weight) / total if total > EPSILON
+                      else (angles[i] + angles[_N_SIDED + i]) / 2)
+    return np.array(values, dtype=np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the vectorized 57-feature extractor against a per-landmark loop.")
+    parser.add_argument('--frames', type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    batch = np.concatenate((rng.uniform(0.1, 0.9, (args.frames, len(LANDMARK_NAMES), 3)),
+                            rng.uniform(0.0, 1.0, (args.frames, len(LANDMARK_NAMES), 1))), axis=2).astype(np.float32)
+    start = time.perf_counter()
+    reference = np.stack([_features_per_landmark(frame) for frame in batch])
+    loop = time.perf_counter() - start
+    start = time.perf_counter()
+    single = np.stack([full_body_features(frame) for frame in batch])
+    per_frame = time.perf_counter() - start
+    start = time.perf_counter()
+    vectorized = full_body_features(batch)
+    batched = time.perf_counter() - start
+    error = max(np.abs(reference - vectorized).max(), np.abs(single - vectorized).max())
+    print(f"{args.frames} frames, max abs difference {error:.2e}", file=sys.stderr)
+    for name, elapsed in (('per-landmark loop', loop), ('vectorized, per frame', per_frame), ('vectorized, batch', batched)):
+        print(f"{name:>22}: {elapsed / args.frames * 1e6:8.1f} us/frame", file=sys.stderr)
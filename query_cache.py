@@ -0,0 +1,256 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+import functools
+from collections import OrderedDict
+
+# In-process LRU/TTL cache for the read helpers used by the Dash pages.
+# Entries are keyed by the entity they describe (e.g. ('patient', 7)) so write paths
+# can invalidate everything derived from that entity without knowing which readers exist.
+
+CACHE_MAX_ENTRIES = int(os.environ.get('THERALINK_CACHE_MAX_ENTRIES', 2048))
+CACHE_TTL_SECONDS = float(os.environ.get('THERALINK_CACHE_TTL', 300))
+# Optional shared on-disk backend so several worker processes (gunicorn etc.) stay consistent.
+# Point every worker at the same file, e.g. THERALINK_SHARED_CACHE=theralink_cache.db
+SHARED_CACHE_PATH = os.environ.get('THERALINK_SHARED_CACHE')
+
+_MISSING = object()
+
+
+def _detach(value):
+    # DataFrames, dicts and lists are mutated by callers (e.g. pd.to_datetime on a column),
+    # so never hand out the cached object itself
+    copy_fn = getattr(value, 'copy', None)
+    return copy_fn() if callable(copy_fn) else value
+
+
+class LRUTTLCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, entity, entity_id=None):
+        # Keys are (entity, entity_id, namespace, variant)
+        with self._lock:
+            stale = [k for k in self._entries
+                     if k[0] == entity and (entity_id is None or k[1] == entity_id)]
+            for k in stale:
+                del self._entries[k]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedCacheBackend:
+    # SQLite file shared between worker processes. Values are pickled; invalidations are
+    # appended to a log so each process can drop its local copies of stale keys.
+    LOG_RETENTION = 10000
+
+    def __init__(self, path, ttl=CACHE_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                entity TEXT NOT NULL,
+                entity_id TEXT NOT NULL,
+                namespace TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (entity, entity_id, namespace, variant)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_invalidations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                entity TEXT NOT NULL,
+                entity_id TEXT -- NULL invalidates every id of the entity
+            )
+        ''')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_key(key):
+        entity, entity_id, namespace, variant = key
+        return entity, str(entity_id), namespace, variant
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache_entries WHERE entity=? AND entity_id=? AND namespace=? AND variant=?",
+            self._row_key(key)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return _MISSING
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (entity, entity_id, namespace, variant, value, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+            self._row_key(key) + (pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time() + self.ttl)
+        )
+        conn.commit()
+
+    def invalidate(self, entity, entity_id=None):
+        conn = self._conn()
+        if entity_id is None:
+            conn.execute("DELETE FROM cache_entries WHERE entity=?", (entity,))
+        else:
+            conn.execute("DELETE FROM cache_entries WHERE entity=? AND entity_id=?", (entity, str(entity_id)))
+        cursor = conn.execute("INSERT INTO cache_invalidations (entity, entity_id) VALUES (?, ?)",
+                              (entity, None if entity_id is None else str(entity_id)))
+        seq = cursor.lastrowid
+        if seq % 1000 == 0:
+            conn.execute("DELETE FROM cache_invalidations WHERE seq <= ?", (seq - self.LOG_RETENTION,))
+            conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (time.time(),))
+        conn.commit()
+        return seq
+
+    def invalidations_since(self, seq):
+        return self._conn().execute(
+            "SELECT seq, entity, entity_id FROM cache_invalidations WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+
+    def last_seq(self):
+        row = self._conn().execute("SELECT MAX(seq) FROM cache_invalidations").fetchone()
+        return row[0] or 0
+
+
+class QueryCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, shared_path=SHARED_CACHE_PATH):
+        self.local = LRUTTLCache(max_entries, ttl)
+        self.shared = SharedCacheBackend(shared_path, ttl) if shared_path else None
+        self._seen_seq = self.shared.last_seq() if self.shared else 0
+        self._stats_lock = threading.Lock()
+        self._stats = {} # namespace -> [hits, misses]
+
+    def _sync_shared(self):
+        # Drop local entries that another worker has invalidated since we last looked
+        for seq, entity, entity_id in self.shared.invalidations_since(self._seen_seq):
+            self.local.invalidate(entity, entity_id if entity_id is None else self._coerce_id(entity_id))
+            self._seen_seq = max(self._seen_seq, seq)
+
+    @staticmethod
+    def _coerce_id(entity_id):
+        # Ids travel through the shared log as text; local keys keep the caller's type (usually int)
+        return int(entity_id) if entity_id.lstrip('-').isdigit() else entity_id
+
+    def _record(self, namespace, hit):
+        with self._stats_lock:
+            counts = self._stats.setdefault(namespace, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def get(self, key):
+        if self.shared is not None:
+            self._sync_shared()
+        value = self.local.get(key)
+        if value is _MISSING and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not _MISSING:
+                self.local.set(key, value)
+        self._record(key[2], value is not _MISSING)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def invalidate(self, entity, entity_id=None):
+        self.local.invalidate(entity, entity_id)
+        if self.shared is not None:
+            self.shared.invalidate(entity, entity_id)
+            # Other workers may have logged invalidations below our own seq that we have not applied
+            # yet: replay the whole unseen log (our entry included, harmlessly) instead of skipping it
+            self._sync_shared()
+
+    def clear(self):
+        self.local.clear()
+        with self._stats_lock:
+            self._stats.clear()
+
+    def stats(self):
+        with self._stats_lock:
+            per_namespace = {
+                ns: {'hits': h, 'misses': m, 'hit_ratio': h / (h + m) if h + m else 0.0}
+                for ns, (h, m) in self._stats.items()
+            }
+        hits = sum(s['hits'] for s in per_namespace.values())
+        misses = sum(s['misses'] for s in per_namespace.values())
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': len(self.local),
+            'shared_backend': self.shared.path if self.shared else None,
+            'namespaces': per_namespace,
+        }
+
+
+query_cache = QueryCache()
+
+
+def cached_query(namespace, entity):
+    # Cache a read helper whose first argument is the id of `entity`.
+    # Any further arguments become part of the key, but invalidation is always per entity id.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(entity_id, *args, **kwargs):
+            variant = repr((args, sorted(kwargs.items()))) if args or kwargs else ''
+            key = (entity, entity_id, namespace, variant)
+            value = query_cache.get(key)
+            if value is _MISSING:
+                value = func(entity_id, *args, **kwargs)
+                query_cache.set(key, _detach(value))
+                return value
+            return _detach(value)
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def invalidate(entity, entity_id=None):
+    query_cache.invalidate(entity, entity_id)
+
+
+def cache_stats():
+    return query_cache.stats()
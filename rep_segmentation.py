@@ -0,0 +1,243 @@
+import sys
+import sqlite3
+import argparse
+import numpy as np
+from query_cache import cached_query
+from utils import joint_angles, trailing_mean
+from landmark_recorder import open_recording
+from exercise_rules import LANDMARK_NAMES, ACTIVE, REST, load_exercise, available_exercises
+
+# Offline rep segmentation: phase joint angle series -> one compact record per rep.
+# Reps are found the way the live counter (exercise_rules.ExerciseTracker) counts them - the
+# exercise's phase joint, smoothing and rest/active bounds, and no rep slower than max_rep_seconds -
+# but with hysteresis over a whole series at once (no Python loop per frame). The peak of each rep
+# is the extreme between entering the active phase and returning to rest, and tempo/depth/symmetry
+# are derived from those indices. Results go to the `reps` table, so rep-level queries never read
+# raw series.
+
+DATABASE_PATH = 'theralink.db'
+
+DEFAULT_EXERCISE = 'squat' # the only exercise sessions were recorded for before it could be chosen
+
+REP_DTYPE = np.dtype([
+    ('rep_index', '<i4'),
+    ('start_t', '<f8'), # last frame at rest before the active phase (seconds from the start of the series)
+    ('bottom_t', '<f8'), # peak of the active phase
+    ('end_t', '<f8'), # back in the rest range
+    ('depth_angle', '<f4'), # phase joint angle at the peak; for squats the smallest knee angle, lower is deeper
+    ('range_of_motion', '<f4'), # |start angle - peak angle|
+    ('descent_s', '<f4'),
+    ('ascent_s', '<f4'),
+    ('time_under_tension_s', '<f4'),
+    ('asymmetry_deg', '<f4'), # mean |left - right| phase joint angle over the rep
+])
+
+REPS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS reps (
+        session_id INTEGER NOT NULL,
+        rep_index INTEGER NOT NULL,
+        patient_id INTEGER NOT NULL,
+        start_t REAL NOT NULL,
+        bottom_t REAL NOT NULL,
+        end_t REAL NOT NULL,
+        depth_angle REAL NOT NULL,
+        range_of_motion REAL NOT NULL,
+        descent_s REAL NOT NULL,
+        ascent_s REAL NOT NULL,
+        time_under_tension_s REAL NOT NULL,
+        asymmetry_deg REAL,
+        PRIMARY KEY (session_id, rep_index),
+        FOREIGN KEY (session_id) REFERENCES sessions(session_id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_reps_patient_session ON reps (patient_id, session_id)",
+]
+
+REP_COLUMNS = REP_DTYPE.names
+
+
+def init_reps_table(conn=None):
+    # Requires sessions.recording_path (landmark_recorder.init_recording_schema); segments recorded
+    # sessions that have not been segmented yet
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    for statement in REPS_SCHEMA:
+        conn.execute(statement)
+    # Marks sessions whose recording has been segmented (into any number of reps, even none), so the
+    # startup backfill only reads recordings it has never seen; existing reps count as done
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+    if 'reps_segmented' not in columns:
+        conn.execute("ALTER TABLE sessions ADD COLUMN reps_segmented INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE sessions SET reps_segmented = 1 WHERE session_id IN (SELECT session_id FROM reps)")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_reps_pending ON sessions (session_id)
+        WHERE reps_segmented = 0 AND recording_path IS NOT NULL
+    ''')
+    conn.commit()
+    backfill_reps(conn)
+    if own_conn:
+        conn.close()
+
+
+def _mirrored(triplet):
+    # Landmark indices of the same joint on the other side of the body (LEFT_* <-> RIGHT_*)
+    names = [LANDMARK_NAMES[i] for i in triplet]
+    names = ['RIGHT_' + name[5:] if name.startswith('LEFT_') else
+             'LEFT_' + name[6:] if name.startswith('RIGHT_') else name for name in names]
+    return [LANDMARK_NAMES.index(name) for name in names]
+
+
+def recording_angles(landmarks, exercise):
+    # (n, 33, >=2) landmarks -> ((n, n_joints) unsmoothed exercise angles, (n,) phase joint mirrored)
+    xy = np.asarray(landmarks)[..., :2]
+    a, b, c = _mirrored(exercise.triplets[exercise.phase_joint])
+    return exercise.angles(xy), joint_angles(xy[:, a], xy[:, b], xy[:, c])
+
+
+def _segment_argmin(values, starts, stops):
+    # Index of the minimum of values[start:stop] for each (non-empty) segment, without a Python loop
+    lengths = stops - starts
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+    order = np.lexsort((values[positions], segment))
+    first = np.cumsum(lengths) - lengths
+    return positions[order[first]]
+
+
+def segment_reps(timestamps, angles, exercise=None, mirror=None):
+    # (n, n_joints) unsmoothed angles of `exercise` (Exercise.angles) -> REP_DTYPE array. A rep starts
+    # at the last frame in the rest range before the phase joint enters the active range, peaks at
+    # its extreme, and ends back in the rest range. `mirror` is the phase joint's unsmoothed angle
+    # on the other side of the body, for asymmetry.
+    exercise = exercise or load_exercise(DEFAULT_EXERCISE)
+    t = np.asarray(timestamps, dtype=np.float64)
+    raw = np.asarray(angles, dtype=np.float64).reshape(len(t), len(exercise.joints))
+    smoothed = trailing_mean(raw, exercise.smoothing_frames)
+    angle = smoothed[:, exercise.phase_joint]
+    frames = np.arange(len(angle))
+
+    # Stage per frame, as ExerciseTracker sets it (STARTING until the first frame at rest)
+    stage = exercise.stages(smoothed)
+    change = np.flatnonzero(stage[1:] != stage[:-1]) + 1
+    downs = change[(stage[change] == ACTIVE) & (stage[change - 1] == REST)] # rest -> active
+    ups = change[(stage[change] == REST) & (stage[change - 1] == ACTIVE)] # active -> rest
+
+    # Pair every entry into the active phase with the next return to rest; an unfinished last rep
+    # is dropped, and so is one the live counter rejects as too slow
+    next_up = np.searchsorted(ups, downs)
+    complete = next_up < len(ups)
+    downs, ends = downs[complete], ups[next_up[complete]]
+    in_time = t[ends] - t[downs] <= exercise.max_rep_seconds
+    downs, ends = downs[in_time], ends[in_time]
+    reps = np.zeros(len(downs), dtype=REP_DTYPE)
+    if not len(downs):
+        return reps
+
+    # The stage stays REST (hysteresis) until the active range is reached, so the start is the last
+    # frame actually inside the rest range, not the last frame whose stage is REST
+    in_rest = exercise.in_phase(smoothed)[0]
+    last_rest = np.maximum.accumulate(np.where(in_rest, frames, -1))
+    starts = last_rest[downs - 1]
+    # Active range below the rest range (squat, leg raise): the peak is the smallest angle
+    direction = 1.0 if exercise.active_bounds[1] <= exercise.rest_bounds[0] else -1.0
+    bottoms = _segment_argmin(angle * direction, downs, ends)
+
+    side = raw[:, exercise.phase_joint]
+    other = side if mirror is None else np.asarray(mirror, dtype=np.float64)
+    difference = np.concatenate(([0.0], np.cumsum(np.abs(side - other))))
+    t0 = t[0]
+    reps['rep_index'] = np.arange(len(downs))
+    reps['start_t'] = t[starts] - t0
+    reps['bottom_t'] = t[bottoms] - t0
+    reps['end_t'] = t[ends] - t0
+    reps['depth_angle'] = angle[bottoms]
+    reps['range_of_motion'] = np.abs(angle[starts] - angle[bottoms])
+    reps['descent_s'] = t[bottoms] - t[starts]
+    reps['ascent_s'] = t[ends] - t[bottoms]
+    reps['time_under_tension_s'] = t[ends] - t[starts]
+    reps['asymmetry_deg'] = (difference[ends + 1] - difference[starts]) / (ends + 1 - starts)
+    return reps
+
+
+def segment_recording(recording_path, exercise=None):
+    # Reps of a landmark recording, segmented on `exercise`'s phase joint (default: squat)
+    exercise = exercise or load_exercise(DEFAULT_EXERCISE)
+    with open_recording(recording_path) as recording:
+        if not len(recording):
+            return np.zeros(0, dtype=REP_DTYPE)
+        angles, mirror = recording_angles(recording.records['landmarks'].astype(np.float32), exercise)
+        timestamps = np.array(recording.timestamps)
+    return segment_reps(timestamps, angles, exercise, mirror)
+
+
+def store_reps(cursor, session_id, patient_id, reps):
+    cursor.execute("DELETE FROM reps WHERE session_id = ?", (session_id,))
+    cursor.executemany(
+        f"INSERT INTO reps (session_id, patient_id, {', '.join(REP_COLUMNS)}) VALUES (?, ?{', ?' * len(REP_COLUMNS)})",
+        [(session_id, patient_id) + tuple(rep.item()) for rep in reps]
+    )
+    mark_reps_segmented(cursor, [session_id])
+
+
+def mark_reps_segmented(cursor, session_ids):
+    cursor.executemany("UPDATE sessions SET reps_segmented = 1 WHERE session_id = ?", [(i,) for i in session_ids])
+
+
+def backfill_reps(conn, batch_size=500):
+    # Segment recorded sessions not marked as segmented (saved before the table existed), one batch
+    # at a time. Every session read is marked, so one whose recording is missing or holds no reps is
+    # not read again on the next start. Sessions of an exercise with no definition on disk are left
+    # for when one is added.
+    exercises = {display: name for name, display in available_exercises().items()}
+    last_id = 0
+    cursor = conn.cursor()
+    while True:
+        batch = conn.execute('''
+            SELECT session_id, patient_id, exercise_type, recording_path FROM sessions
+            WHERE reps_segmented = 0 AND recording_path IS NOT NULL AND session_id > ?
+            ORDER BY session_id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not batch:
+            break
+        done = []
+        for session_id, patient_id, exercise_type, recording_path in batch:
+            if exercise_type not in exercises:
+                continue
+            done.append(session_id)
+            try:
+                reps = segment_recording(recording_path, load_exercise(exercises[exercise_type]))
+            except (OSError, ValueError):
+                continue # Missing or unreadable recording: the session simply has no reps
+            store_reps(cursor, session_id, patient_id, reps)
+        mark_reps_segmented(cursor, done)
+        last_id = batch[-1][0]
+    conn.commit()
+
+
+@cached_query('session_reps', entity='session')
+def get_session_reps(session_id, patient_id):
+    # Per-rep records of one session (scoped to the patient), in order
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(f'''
+        SELECT {', '.join(REP_COLUMNS)} FROM reps
+        WHERE session_id = ? AND patient_id = ?
+        ORDER BY rep_index
+    ''', (session_id, patient_id)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segment the reps of a landmark recording.")
+    parser.add_argument('recording')
+    parser.add_argument('--exercise', default=DEFAULT_EXERCISE, choices=sorted(available_exercises()))
+    args = parser.parse_args()
+
+    reps = segment_recording(args.recording, load_exercise(args.exercise))
+    print('\t'.join(REP_COLUMNS))
+    for rep in reps:
+        print('\t'.join(f"{value:.3f}" if isinstance(value, float) else str(value) for value in rep.item()))
+    print(f"{len(reps)} reps", file=sys.stderr)
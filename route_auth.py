@@ -0,0 +1,73 @@
+import os
+import sqlite3
+from flask import abort, session
+
+# Server-side identity for the plain Flask routes (cohort exports, replays, similarity API).
+# The Dash pages keep the login in client-side stores, which a bare GET request cannot be trusted
+# with, so the login callback also records the user in Flask's signed session cookie. Every data
+# route checks that cookie, and that the requested doctor/patient belongs to the caller, before it
+# reads anything.
+
+DATABASE_PATH = 'theralink.db'
+
+# Signs the session cookie. Give every worker process the same value; without it each process
+# makes up its own key, so logins only hold for the process that issued them and until it restarts.
+SECRET_KEY = os.environ.get('THERALINK_SECRET_KEY')
+
+
+def init_route_auth(server):
+    server.secret_key = SECRET_KEY or os.urandom(32)
+    server.config.setdefault('SESSION_COOKIE_HTTPONLY', True)
+    server.config.setdefault('SESSION_COOKIE_SAMESITE', 'Lax')
+
+
+def remember_login(user_id, role):
+    # Called from the login callback; Dash callbacks run inside a Flask request, so this sets the cookie
+    session.clear()
+    session['user_id'] = int(user_id)
+    session['role'] = role
+
+
+def forget_login():
+    session.clear()
+
+
+def current_user():
+    # (user_id, role) of the caller, (None, None) when not logged in
+    return session.get('user_id'), session.get('role')
+
+
+def _patient_doctor_id(patient_id):
+    conn = sqlite3.connect(DATABASE_PATH)
+    row = conn.execute("SELECT doctor_id FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def require_role(role):
+    # Aborts unless the caller is logged in with this role (process-wide monitoring routes)
+    user_id, current_role = current_user()
+    if user_id is None:
+        abort(401)
+    if current_role != role:
+        abort(403)
+
+
+def require_doctor(doctor_id):
+    # Aborts unless the caller is logged in as this doctor
+    user_id, role = current_user()
+    if user_id is None:
+        abort(401)
+    if role != 'doctor' or user_id != doctor_id:
+        abort(403)
+
+
+def require_patient_access(patient_id, allow_patient=True):
+    # Aborts unless the caller is the patient's doctor, or (if allowed) the patient themselves
+    user_id, role = current_user()
+    if user_id is None:
+        abort(401)
+    if role == 'patient' and allow_patient and user_id == patient_id:
+        return
+    if role != 'doctor' or _patient_doctor_id(patient_id) != user_id:
+        abort(403)
@@ -0,0 +1,216 @@
+import sqlite3
+from datetime import datetime, date, time, timedelta
+from query_cache import invalidate
+
+# Appointment booking and calendar reads.
+# Every appointment carries normalized start/end timestamps ('YYYY-MM-DD HH:MM:SS', which sort
+# chronologically as text) indexed per doctor and per patient. Overlap checks and calendar windows
+# are range scans on those indexes; the scan is bounded below by the longest allowed appointment,
+# so it never has to look at a person's whole history.
+
+DATABASE_PATH = 'theralink.db'
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_APPOINTMENT_MINUTES = 30
+MAX_APPOINTMENT_MINUTES = 240 # also bounds the index range scanned for overlaps
+MAX_SERIES_OCCURRENCES = 104
+
+SCHEDULED = 'Scheduled'
+# Matches dashboard_stats: any status other than cancelled (case-insensitive) occupies the slot
+_ACTIVE = "lower({alias}status) != 'cancelled'"
+
+WEEKDAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+SCHEDULING_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS appointment_series (
+        series_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        doctor_id INTEGER NOT NULL,
+        patient_id INTEGER NOT NULL,
+        weekdays TEXT NOT NULL, -- e.g. '0,3' for Monday and Thursday
+        weeks INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_appointments_doctor_start ON appointments (doctor_id, starts_at)",
+    "CREATE INDEX IF NOT EXISTS idx_appointments_patient_start ON appointments (patient_id, starts_at)",
+]
+
+
+class SchedulingConflict(Exception):
+    def __init__(self, conflicts):
+        self.conflicts = conflicts # list of dicts for the clashing existing appointments
+        first = conflicts[0]
+        super().__init__(f"Overlaps an existing appointment at {first['starts_at']}"
+                         + (f" (and {len(conflicts) - 1} more)" if len(conflicts) > 1 else ""))
+
+
+def _column_names(cursor, table):
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+
+
+def init_scheduling_schema(conn=None):
+    # Requires the appointments table from app.py; adds the typed interval columns and backfills them
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    columns = _column_names(cursor, 'appointments')
+    for column, ddl in (('starts_at', 'TEXT'), ('ends_at', 'TEXT'), ('series_id', 'INTEGER')):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE appointments ADD COLUMN {column} {ddl}")
+    # Older rows only have the date and 'HH:MM' time strings
+    cursor.execute(f'''
+        UPDATE appointments
+        SET starts_at = datetime(appointment_date || ' ' || appointment_time),
+            ends_at = datetime(appointment_date || ' ' || appointment_time, '+{DEFAULT_APPOINTMENT_MINUTES} minutes')
+        WHERE starts_at IS NULL AND datetime(appointment_date || ' ' || appointment_time) IS NOT NULL
+    ''')
+    for statement in SCHEDULING_SCHEMA:
+        cursor.execute(statement)
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime):
+        return value.replace(microsecond=0)
+    if isinstance(value, date):
+        return datetime.combine(value, time())
+    return datetime.fromisoformat(str(value))
+
+
+def _interval(starts_at, duration_minutes):
+    if not 0 < duration_minutes <= MAX_APPOINTMENT_MINUTES:
+        raise ValueError(f"Appointments must last between 1 and {MAX_APPOINTMENT_MINUTES} minutes")
+    start = _to_datetime(starts_at)
+    return start, start + timedelta(minutes=duration_minutes)
+
+
+def _conflicts(cursor, doctor_id, patient_id, intervals):
+    # Existing, non-cancelled appointments of either participant overlapping any [start, end)
+    conflicts = []
+    for start, end in intervals:
+        scan_from = (start - timedelta(minutes=MAX_APPOINTMENT_MINUTES)).strftime(TIMESTAMP_FORMAT)
+        bounds = (scan_from, end.strftime(TIMESTAMP_FORMAT), start.strftime(TIMESTAMP_FORMAT))
+        rows = cursor.execute(f'''
+            SELECT id, doctor_id, patient_id, starts_at, ends_at FROM appointments
+            WHERE doctor_id = ? AND starts_at > ? AND starts_at < ? AND ends_at > ? AND {_ACTIVE.format(alias='')}
+            UNION
+            SELECT id, doctor_id, patient_id, starts_at, ends_at FROM appointments
+            WHERE patient_id = ? AND starts_at > ? AND starts_at < ? AND ends_at > ? AND {_ACTIVE.format(alias='')}
+        ''', (doctor_id, *bounds, patient_id, *bounds)).fetchall()
+        conflicts.extend(dict(zip(('id', 'doctor_id', 'patient_id', 'starts_at', 'ends_at'), row)) for row in rows)
+    return conflicts
+
+
+def _insert_rows(doctor_id, patient_id, intervals, series_id=None):
+    return [
+        (doctor_id, patient_id, start.date().isoformat(), start.strftime('%H:%M'), SCHEDULED,
+         start.strftime(TIMESTAMP_FORMAT), end.strftime(TIMESTAMP_FORMAT), series_id)
+        for start, end in intervals
+    ]
+
+
+_INSERT_APPOINTMENT = '''
+    INSERT INTO appointments (doctor_id, patient_id, appointment_date, appointment_time, status,
+                              starts_at, ends_at, series_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def _book(doctor_id, patient_id, intervals, series=None):
+    # Conflict check and insert share one write transaction, so two concurrent bookings cannot both pass
+    conn = sqlite3.connect(DATABASE_PATH, timeout=10, isolation_level=None)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        conflicts = _conflicts(cursor, doctor_id, patient_id, intervals)
+        if conflicts:
+            raise SchedulingConflict(conflicts)
+        series_id = None
+        if series is not None:
+            weekdays, weeks = series
+            cursor.execute(
+                "INSERT INTO appointment_series (doctor_id, patient_id, weekdays, weeks, created_at) VALUES (?, ?, ?, ?, ?)",
+                (doctor_id, patient_id, ','.join(str(d) for d in weekdays), weeks,
+                 datetime.now().strftime(TIMESTAMP_FORMAT))
+            )
+            series_id = cursor.lastrowid
+        ids = []
+        for row in _insert_rows(doctor_id, patient_id, intervals, series_id):
+            cursor.execute(_INSERT_APPOINTMENT, row)
+            ids.append(cursor.lastrowid)
+        cursor.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    # Upcoming-appointment lists for both sides are now stale
+    invalidate('patient', patient_id)
+    invalidate('doctor', doctor_id)
+    return ids
+
+
+def book_appointment(doctor_id, patient_id, starts_at, duration_minutes=DEFAULT_APPOINTMENT_MINUTES):
+    # Returns the new appointment id; raises SchedulingConflict if either side is already booked
+    return _book(doctor_id, patient_id, [_interval(starts_at, duration_minutes)])[0]
+
+
+def series_occurrences(first_day, start_time, weekdays, weeks):
+    # Start datetimes on the given weekdays (0 = Monday) for `weeks` weeks from the week of first_day
+    first_day = _to_datetime(first_day).date()
+    start_time = start_time if isinstance(start_time, time) else time.fromisoformat(str(start_time))
+    week_start = first_day - timedelta(days=first_day.weekday())
+    occurrences = []
+    for week in range(weeks):
+        for weekday in sorted(set(weekdays)):
+            day = week_start + timedelta(weeks=week, days=weekday)
+            if day >= first_day:
+                occurrences.append(datetime.combine(day, start_time))
+    return occurrences
+
+
+def book_series(doctor_id, patient_id, first_day, start_time, weekdays, weeks,
+                duration_minutes=DEFAULT_APPOINTMENT_MINUTES):
+    # e.g. weekdays=(0, 3), weeks=6 -> Monday and Thursday for six weeks.
+    # All occurrences are booked in one transaction: either the whole series fits or nothing is saved.
+    starts = series_occurrences(first_day, start_time, weekdays, weeks)
+    if not starts:
+        raise ValueError("The series has no occurrences")
+    if len(starts) > MAX_SERIES_OCCURRENCES:
+        raise ValueError(f"A series can have at most {MAX_SERIES_OCCURRENCES} appointments")
+    intervals = [_interval(start, duration_minutes) for start in starts]
+    return _book(doctor_id, patient_id, intervals, series=(weekdays, weeks))
+
+
+def get_calendar(owner, owner_id, window_start, window_end):
+    # Appointments of a doctor or patient overlapping [window_start, window_end), in one indexed range scan
+    if owner not in ('doctor', 'patient'):
+        raise ValueError(f"Unknown calendar owner: {owner}")
+    start, end = _to_datetime(window_start), _to_datetime(window_end)
+    scan_from = (start - timedelta(minutes=MAX_APPOINTMENT_MINUTES)).strftime(TIMESTAMP_FORMAT)
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(f'''
+        SELECT a.id, a.doctor_id, a.patient_id, a.starts_at, a.ends_at, a.status, a.series_id,
+               p.name AS patient_name, du.username AS doctor_username
+        FROM appointments a
+        LEFT JOIN patients p ON p.patient_id = a.patient_id
+        LEFT JOIN users du ON du.id = a.doctor_id
+        WHERE a.{owner}_id = ? AND a.starts_at > ? AND a.starts_at < ? AND a.ends_at > ?
+          AND {_ACTIVE.format(alias='a.')}
+        ORDER BY a.starts_at
+    ''', (owner_id, scan_from, end.strftime(TIMESTAMP_FORMAT), start.strftime(TIMESTAMP_FORMAT))).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def get_week_calendar(owner, owner_id, day):
+    # Monday-to-Sunday window containing `day`
+    day = _to_datetime(day).date()
+    monday = day - timedelta(days=day.weekday())
+    return monday, get_calendar(owner, owner_id, monday, monday + timedelta(days=7))
@@ -0,0 +1,240 @@
+import re
+import string
+import sqlite3
+
+# Full-text search over session feedback and patient records (SQLite FTS5).
+# sessions_fts is an external-content index on the sessions table (no duplicated text);
+# patients_fts holds name/contact plus the username from users. Both are kept in sync by
+# triggers, so searches are an inverted-index lookup ranked by bm25 instead of a LIKE scan.
+
+DATABASE_PATH = 'theralink.db'
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_RANK_WINDOW = 2000 # newest matching sessions considered for relevance ranking
+SNIPPET_TOKENS = 12
+# Markdown bold, so pages can render snippets with dcc.Markdown (the text itself is escaped)
+SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS = '**', '**', '…'
+# Every ASCII punctuation character may be backslash-escaped in Markdown (CommonMark)
+_MARKDOWN_PUNCTUATION = re.compile('([' + re.escape(string.punctuation) + '])')
+
+_TOKENIZER = "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'"
+
+SEARCH_SCHEMA = [
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS sessions_fts USING fts5(
+        feedback, exercise_type, completion_status,
+        content = 'sessions', content_rowid = 'session_id', {_TOKENIZER}
+    )
+    ''',
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+        name, contact, username, {_TOKENIZER}
+    )
+    ''',
+]
+
+# rowid of patients_fts is the patient_id
+_PATIENT_DOCUMENT = '''
+    SELECT p.patient_id, p.name, coalesce(p.contact, ''), coalesce(u.username, '')
+    FROM patients p LEFT JOIN users u ON u.id = p.patient_id
+'''
+
+SEARCH_TRIGGERS = [
+    # --- sessions: external content, so the old values are removed with the 'delete' command ---
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_session_insert AFTER INSERT ON sessions
+    BEGIN
+        INSERT INTO sessions_fts (rowid, feedback, exercise_type, completion_status)
+        VALUES (NEW.session_id, NEW.feedback, NEW.exercise_type, NEW.completion_status);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_session_update AFTER UPDATE OF feedback, exercise_type, completion_status ON sessions
+    BEGIN
+        INSERT INTO sessions_fts (sessions_fts, rowid, feedback, exercise_type, completion_status)
+        VALUES ('delete', OLD.session_id, OLD.feedback, OLD.exercise_type, OLD.completion_status);
+        INSERT INTO sessions_fts (rowid, feedback, exercise_type, completion_status)
+        VALUES (NEW.session_id, NEW.feedback, NEW.exercise_type, NEW.completion_status);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_session_delete AFTER DELETE ON sessions
+    BEGIN
+        INSERT INTO sessions_fts (sessions_fts, rowid, feedback, exercise_type, completion_status)
+        VALUES ('delete', OLD.session_id, OLD.feedback, OLD.exercise_type, OLD.completion_status);
+    END
+    ''',
+    # --- patients (+ username from users) ---
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_patient_insert AFTER INSERT ON patients
+    BEGIN
+        INSERT OR REPLACE INTO patients_fts (rowid, name, contact, username)
+        {_PATIENT_DOCUMENT} WHERE p.patient_id = NEW.patient_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_patient_update AFTER UPDATE OF name, contact ON patients
+    BEGIN
+        INSERT OR REPLACE INTO patients_fts (rowid, name, contact, username)
+        {_PATIENT_DOCUMENT} WHERE p.patient_id = NEW.patient_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_patient_delete AFTER DELETE ON patients
+    BEGIN
+        DELETE FROM patients_fts WHERE rowid = OLD.patient_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_username_update AFTER UPDATE OF username ON users
+    BEGIN
+        INSERT OR REPLACE INTO patients_fts (rowid, name, contact, username)
+        {_PATIENT_DOCUMENT} WHERE p.patient_id = NEW.id;
+    END
+    ''',
+]
+
+
+def init_search_index(conn=None):
+    # Requires users/patients (app.py) and sessions (app_squat.py); indexes existing rows on first run
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='sessions_fts'")
+    needs_rebuild = cursor.fetchone() is None
+    for statement in SEARCH_SCHEMA + SEARCH_TRIGGERS:
+        cursor.execute(statement)
+    conn.commit()
+    if needs_rebuild:
+        rebuild_search_index(conn)
+    if own_conn:
+        conn.close()
+
+
+def rebuild_search_index(conn=None):
+    # Full re-index; needed once after creation and after bulk loads that ran with triggers dropped
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO sessions_fts (sessions_fts) VALUES ('rebuild')")
+    cursor.execute("DELETE FROM patients_fts")
+    cursor.execute(f"INSERT INTO patients_fts (rowid, name, contact, username) {_PATIENT_DOCUMENT}")
+    cursor.execute("INSERT INTO sessions_fts (sessions_fts) VALUES ('optimize')")
+    cursor.execute("INSERT INTO patients_fts (patients_fts) VALUES ('optimize')")
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+def _query_terms(text, prefix_last=True):
+    # Free text -> [(words, is_prefix)]: "quoted phrases" stay together, other words stand alone,
+    # and the last word also matches as a prefix so results appear while typing
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\w+)', text or ''):
+        words = re.findall(r'\w+', phrase) if phrase else [word]
+        if words:
+            terms.append((words, False))
+    if terms and prefix_last and not text.rstrip().endswith('"'):
+        terms[-1] = (terms[-1][0], True)
+    return terms
+
+
+def to_fts_query(text, prefix_last=True):
+    # Safe FTS5 query (every term must match); None when there is nothing to search for
+    terms = _query_terms(text, prefix_last)
+    if not terms:
+        return None
+    return ' '.join('"' + ' '.join(words) + '"' + ('*' if prefix else '') for words, prefix in terms)
+
+
+def escape_markdown(text):
+    # Stored feedback is plain text: '*', '_', '[' etc. must not turn into Markdown
+    return _MARKDOWN_PUNCTUATION.sub(r'\\\1', text)
+
+
+def highlight_snippet(text, query_text, tokens=SNIPPET_TOKENS):
+    # Same markup as FTS5 snippet(), built in Python for the handful of rows on a page, with the
+    # text Markdown-escaped. snippet() would have to re-expand prefix terms (e.g. "kn*") once per
+    # row, which costs far more.
+    words = list(re.finditer(r'\w+', text or ''))
+    if not words:
+        return escape_markdown(text or '')
+    exact, prefixes = set(), []
+    for term_words, prefix in _query_terms(query_text):
+        exact.update(w.lower() for w in term_words)
+        if prefix:
+            prefixes.append(term_words[-1].lower())
+    hits = [m.group().lower() in exact or any(m.group().lower().startswith(p) for p in prefixes) for m in words]
+    # Window of `tokens` words containing the most hits
+    best = max(range(max(len(words) - tokens, 0) + 1), key=lambda i: sum(hits[i:i + tokens]))
+    window = range(best, min(best + tokens, len(words)))
+    out = [SNIPPET_ELLIPSIS] if best > 0 else []
+    position = words[best].start()
+    for i in window:
+        m = words[i]
+        out.append(escape_markdown(text[position:m.start()]))
+        word = escape_markdown(m.group()) # \w+ includes '_'
+        out.append(f"{SNIPPET_START}{word}{SNIPPET_END}" if hits[i] else word)
+        position = m.end()
+    last = words[window[-1]].end()
+    out.append(escape_markdown(text[last:]) if window[-1] == len(words) - 1 else SNIPPET_ELLIPSIS)
+    return ''.join(out)
+
+
+def search_sessions(doctor_id, text, page=0, page_size=SEARCH_PAGE_SIZE, patient_id=None):
+    # Ranked session hits among the doctor's patients: {'hits': [...], 'has_more': bool}.
+    # bm25 is only computed for the newest SEARCH_RANK_WINDOW matches (FTS5 walks its doclists in
+    # rowid order and stops there), and snippets only for the page returned, so a common term over
+    # millions of sessions stays bounded.
+    query = to_fts_query(text)
+    if query is None:
+        return {'hits': [], 'has_more': False}
+    patient_clause = "AND s.patient_id = ?" if patient_id is not None else ""
+    params = [query, doctor_id] + ([patient_id] if patient_id is not None else [])
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(f'''
+            SELECT * FROM (
+                SELECT s.session_id, s.patient_id, p.name AS patient_name, s.date, s.exercise_type, s.feedback,
+                       sessions_fts.rank AS rank -- bm25
+                FROM sessions_fts
+                JOIN sessions s ON s.session_id = sessions_fts.rowid
+                JOIN patients p ON p.patient_id = s.patient_id
+                WHERE sessions_fts MATCH ? AND p.doctor_id = ? {patient_clause}
+                ORDER BY sessions_fts.rowid DESC
+                LIMIT ?
+            )
+            ORDER BY rank, session_id DESC
+            LIMIT ? OFFSET ?
+        ''', params + [SEARCH_RANK_WINDOW, page_size + 1, page * page_size]).fetchall()
+        hits = [dict(row) for row in rows[:page_size]]
+    finally:
+        conn.close()
+    for hit in hits:
+        hit['snippet'] = highlight_snippet(hit.pop('feedback'), text)
+    return {'hits': hits, 'has_more': len(rows) > page_size}
+
+
+def search_patients(doctor_id, text, page=0, page_size=SEARCH_PAGE_SIZE):
+    # Ranked matches among the doctor's patients on name / contact / username: {'hits': [...], 'has_more': bool}.
+    # A name match weighs most, then the username; a caseload is small, so every match is ranked.
+    query = to_fts_query(text)
+    if query is None:
+        return {'hits': [], 'has_more': False}
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute('''
+            SELECT p.patient_id, p.name, patients_fts.username AS username, p.contact
+            FROM patients_fts
+            JOIN patients p ON p.patient_id = patients_fts.rowid
+            WHERE patients_fts MATCH ? AND patients_fts.rank MATCH 'bm25(10.0, 1.0, 5.0)' AND p.doctor_id = ?
+            ORDER BY patients_fts.rank, p.patient_id
+            LIMIT ? OFFSET ?
+        ''', (query, doctor_id, page_size + 1, page * page_size)).fetchall()
+    finally:
+        conn.close()
+    return {'hits': [dict(row) for row in rows[:page_size]], 'has_more': len(rows) > page_size}
@@ -0,0 +1,269 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from query_cache import cached_query
+
+# SQL-backed session history for the patient/doctor session pages.
+# Filters are applied in the query and the list is returned one page at a time using
+# keyset pagination on (date, session_id), so page cost does not depend on history length.
+
+DATABASE_PATH = 'theralink.db'
+
+SESSION_PAGE_SIZE = 20
+
+# Columns needed to render a session list row (never the joint angle payload)
+SESSION_LIST_COLUMNS = ('session_id', 'date', 'exercise_type', 'reps_achieved', 'reps_target',
+                        'sets_achieved', 'sets_target', 'completion_status', 'feedback', 'exercise_duration')
+
+# Buckets used by the progress graphs; picked from the span of the filtered history
+BUCKET_EXPRESSIONS = {
+    'day': "date(date)",
+    'week': "date(date, 'weekday 0', '-6 days')", # Monday of the week
+    'month': "strftime('%Y-%m-01', date)",
+}
+
+# Joints summarised into session_angle_stats; payload keys like 'knee_angles'/'knee_angle' map to 'knee'
+SUMMARY_JOINTS = ('knee', 'hip', 'ankle', 'shoulder', 'elbow', 'wrist')
+
+
+def ensure_session_indexes(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_patient_date ON sessions (patient_id, date, session_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_patient_exercise_date ON sessions (patient_id, exercise_type, date, session_id)")
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+def init_angle_summary_table(conn=None):
+    # Per-session, per-joint summary of joint_angles_json so lists and graphs never load the payload
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS session_angle_stats (
+            session_id INTEGER NOT NULL,
+            joint TEXT NOT NULL,
+            samples INTEGER NOT NULL,
+            first_angle REAL,
+            mean_angle REAL,
+            min_angle REAL,
+            max_angle REAL,
+            PRIMARY KEY (session_id, joint),
+            FOREIGN KEY (session_id) REFERENCES sessions(session_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    # Marks sessions whose payload has been summarised (or had nothing to summarise), so the startup
+    # backfill only reads sessions it has never seen; existing summaries count as done
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+    if 'angle_stats_done' not in columns:
+        conn.execute("ALTER TABLE sessions ADD COLUMN angle_stats_done INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE sessions SET angle_stats_done = 1 WHERE session_id IN (SELECT session_id FROM session_angle_stats)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_angle_stats_pending ON sessions (session_id) WHERE angle_stats_done = 0")
+    conn.commit()
+    backfill_angle_summaries(conn)
+    if own_conn:
+        conn.close()
+
+
+def _joint_name(key):
+    for suffix in ('_angles', '_angle'):
+        if key.endswith(suffix):
+            return key[:-len(suffix)]
+    return key
+
+
+def summarize_joint_angles(joint_angles_data):
+    # {'knee_angles': [..], 'hip_angles': [..]} -> [(joint, samples, first, mean, min, max), ...]
+    summaries = []
+    for key, angles in (joint_angles_data or {}).items():
+        joint = _joint_name(key)
+        if joint not in SUMMARY_JOINTS or not isinstance(angles, (list, tuple)):
+            continue
+        values = [float(a) for a in angles if a is not None]
+        if values:
+            summaries.append((joint, len(values), values[0], sum(values) / len(values), min(values), max(values)))
+    return summaries
+
+
+def store_angle_summary(cursor, session_id, joint_angles_data):
+    cursor.executemany(
+        "INSERT OR REPLACE INTO session_angle_stats (session_id, joint, samples, first_angle, mean_angle, min_angle, max_angle) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(session_id,) + summary for summary in summarize_joint_angles(joint_angles_data)]
+    )
+    mark_angle_summaries(cursor, [session_id])
+
+
+def mark_angle_summaries(cursor, session_ids):
+    cursor.executemany("UPDATE sessions SET angle_stats_done = 1 WHERE session_id = ?", [(i,) for i in session_ids])
+
+
+def backfill_angle_summaries(conn, batch_size=500):
+    # Summarise sessions not marked as summarised (saved before the table existed); streams payloads
+    # one batch at a time. Every session read is marked, so one with nothing to summarise (no or
+    # unparseable payload) is not read again on the next start.
+    last_id = 0
+    write = conn.cursor()
+    while True:
+        batch = conn.execute('''
+            SELECT session_id, joint_angles_json FROM sessions
+            WHERE angle_stats_done = 0 AND session_id > ?
+            ORDER BY session_id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not batch:
+            break
+        for session_id, payload in batch:
+            try:
+                store_angle_summary(write, session_id, json.loads(payload))
+            except (json.JSONDecodeError, TypeError, ValueError, AttributeError):
+                pass # Unparseable payloads simply get no summary
+        mark_angle_summaries(write, [session_id for session_id, _ in batch])
+        last_id = batch[-1][0]
+    conn.commit()
+
+
+def _filter_clause(patient_id, exercise_type=None, start_date=None, end_date=None):
+    clauses = ["patient_id = ?"]
+    params = [patient_id]
+    if exercise_type:
+        clauses.append("exercise_type = ?")
+        params.append(exercise_type)
+    if start_date:
+        clauses.append("date >= ?")
+        params.append(str(start_date)[:10])
+    if end_date:
+        # Dates are stored as 'YYYY-MM-DD HH:MM:SS'; include the whole end day
+        end_exclusive = datetime.strptime(str(end_date)[:10], '%Y-%m-%d') + timedelta(days=1)
+        clauses.append("date < ?")
+        params.append(end_exclusive.strftime('%Y-%m-%d'))
+    return " AND ".join(clauses), params
+
+
+def get_session_page(patient_id, exercise_type=None, start_date=None, end_date=None,
+                     cursor=None, page_size=SESSION_PAGE_SIZE, offset=0):
+    # Newest first. `cursor` is the (date, session_id) of the last row of the previous page.
+    # `offset` is only a fallback for jumping straight to a page whose cursor is unknown.
+    where, params = _filter_clause(patient_id, exercise_type, start_date, end_date)
+    if cursor:
+        where += " AND (date, session_id) < (?, ?)"
+        params += [cursor[0], cursor[1]]
+        offset = 0
+
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(f"""
+        SELECT {', '.join(SESSION_LIST_COLUMNS)}
+        FROM sessions
+        WHERE {where}
+        ORDER BY date DESC, session_id DESC
+        LIMIT ? OFFSET ?
+    """, params + [page_size + 1, offset]).fetchall()
+    conn.close()
+
+    rows = [dict(row) for row in rows]
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = [rows[-1]['date'], rows[-1]['session_id']] if has_more else None
+    return {'rows': rows, 'next_cursor': next_cursor}
+
+
+def get_session(patient_id, session_id):
+    # Single session row for the detail view; scoped to the patient so ids cannot be guessed
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute(f"""
+        SELECT {', '.join(SESSION_LIST_COLUMNS)}
+        FROM sessions
+        WHERE session_id = ? AND patient_id = ?
+    """, (session_id, patient_id)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+@cached_query('session_angles', entity='session')
+def get_session_angles(session_id, patient_id):
+    # The heavy joint angle payload, loaded only when one session's detail is opened.
+    # Saved sessions never change, so the decoded payload stays cached until evicted.
+    conn = sqlite3.connect(DATABASE_PATH)
+    row = conn.execute("SELECT joint_angles_json FROM sessions WHERE session_id = ? AND patient_id = ?",
+                       (session_id, patient_id)).fetchone()
+    conn.close()
+    if row is None or not row[0]:
+        return {}
+    try:
+        return json.loads(row[0])
+    except (json.JSONDecodeError, TypeError):
+        return {}
+
+
+def get_exercise_types(patient_id):
+    conn = sqlite3.connect(DATABASE_PATH)
+    rows = conn.execute("SELECT DISTINCT exercise_type FROM sessions WHERE patient_id = ? ORDER BY exercise_type",
+                        (patient_id,)).fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def _pick_bucket(conn, where, params):
+    first, last = conn.execute(f"SELECT MIN(date), MAX(date) FROM sessions WHERE {where}", params).fetchone()
+    if not first:
+        return 'day'
+    span_days = (datetime.strptime(last[:10], '%Y-%m-%d') - datetime.strptime(first[:10], '%Y-%m-%d')).days
+    if span_days <= 120:
+        return 'day'
+    if span_days <= 2 * 365:
+        return 'week'
+    return 'month'
+
+
+def get_session_aggregates(patient_id, exercise_type=None, start_date=None, end_date=None, bucket=None,
+                           by_exercise=False):
+    # One row per time bucket (and exercise type, if by_exercise) for the progress graphs;
+    # the graphs never see individual sessions
+    where, params = _filter_clause(patient_id, exercise_type, start_date, end_date)
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    bucket = bucket or _pick_bucket(conn, where, params)
+    group = "bucket, exercise_type" if by_exercise else "bucket"
+    rows = conn.execute(f"""
+        SELECT {BUCKET_EXPRESSIONS[bucket]} AS bucket,
+               {"exercise_type," if by_exercise else ""}
+               COUNT(*) AS sessions,
+               SUM(reps_achieved) AS reps_achieved,
+               SUM(reps_target) AS reps_target,
+               AVG(exercise_duration) AS avg_duration,
+               AVG(knee.first_angle) AS avg_knee_angle,
+               AVG(hip.first_angle) AS avg_hip_angle
+        FROM sessions
+        LEFT JOIN session_angle_stats knee ON knee.session_id = sessions.session_id AND knee.joint = 'knee'
+        LEFT JOIN session_angle_stats hip ON hip.session_id = sessions.session_id AND hip.joint = 'hip'
+        WHERE {where}
+        GROUP BY {group}
+        ORDER BY {group}
+    """, params).fetchall()
+    conn.close()
+    return bucket, [dict(row) for row in rows]
+
+
+def get_joint_angle_aggregates(patient_id, exercise_type=None, start_date=None, end_date=None, bucket=None):
+    # Per-session mean joint angles from the summary table, averaged per (bucket, exercise_type, joint)
+    where, params = _filter_clause(patient_id, exercise_type, start_date, end_date)
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    bucket = bucket or _pick_bucket(conn, where, params)
+    rows = conn.execute(f"""
+        SELECT {BUCKET_EXPRESSIONS[bucket]} AS bucket,
+               s.exercise_type, a.joint,
+               COUNT(*) AS sessions,
+               AVG(a.mean_angle) AS mean_angle,
+               MIN(a.min_angle) AS min_angle,
+               MAX(a.max_angle) AS max_angle
+        FROM (SELECT session_id, date, exercise_type FROM sessions WHERE {where}) AS s
+        JOIN session_angle_stats a ON a.session_id = s.session_id
+        GROUP BY bucket, s.exercise_type, a.joint
+        ORDER BY bucket
+    """, params).fetchall()
+    conn.close()
+    return bucket, [dict(row) for row in rows]
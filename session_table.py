@@ -0,0 +1,51 @@
+from dash import dash_table
+from session_history import get_session_page, SESSION_PAGE_SIZE
+
+# Server-paged, virtualized session table shared by the patient and doctor session pages.
+# Only the rows of the current page are sent to the browser, and only the visible ones are
+# rendered; rows carry the session id so a click opens that session's detail directly.
+
+
+def session_table(table_id, columns, page_size=SESSION_PAGE_SIZE):
+    # columns: list of (row key, header label)
+    return dash_table.DataTable(
+        id=table_id,
+        columns=[{'name': label, 'id': key} for key, label in columns],
+        data=[],
+        page_action='custom',
+        page_current=0,
+        page_size=page_size,
+        page_count=1,
+        virtualization=True,
+        fixed_rows={'headers': True},
+        style_table={'height': '420px', 'overflowY': 'auto'},
+        style_cell={'textAlign': 'left', 'padding': '6px', 'minWidth': '90px', 'cursor': 'pointer',
+                    'whiteSpace': 'normal', 'height': 'auto'},
+        style_header={'fontWeight': 'bold'},
+        style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': '#f8f9fa'}],
+    )
+
+
+def fetch_session_table_page(patient_id, page_current, page_cursors, row_formatter,
+                             exercise_type=None, start_date=None, end_date=None, page_size=SESSION_PAGE_SIZE):
+    # page_cursors maps str(page index) -> keyset cursor learnt while reading the previous page.
+    # Sequential prev/next always hits a known cursor; a typed-in page falls back to OFFSET.
+    page_cursors = dict(page_cursors or {})
+    page_current = page_current or 0
+    cursor = page_cursors.get(str(page_current))
+    offset = page_current * page_size if cursor is None else 0
+
+    page = get_session_page(patient_id, exercise_type, start_date, end_date,
+                            cursor=cursor, page_size=page_size, offset=offset)
+    if page['next_cursor']:
+        page_cursors[str(page_current + 1)] = page['next_cursor']
+
+    data = []
+    for row in page['rows']:
+        formatted = row_formatter(row)
+        formatted['id'] = row['session_id'] # DataTable row id -> active_cell['row_id']
+        data.append(formatted)
+
+    # Without a COUNT(*) we only know whether one more page exists
+    page_count = page_current + (2 if page['next_cursor'] else 1)
+    return data, page_cursors, page_count
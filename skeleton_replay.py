@@ -0,0 +1,236 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+import mediapipe as mp
+from landmark_recorder import open_recording
+from route_auth import require_patient_access, require_role
+
+# Skeleton-only replay of recorded sessions (no patient video is ever stored).
+# A session's landmark recording (landmark_recorder.py) is resampled to the requested frame rate
+# and drawn with the same POSE_CONNECTIONS and colours as process_frame, then JPEG-encoded.
+# Encoded frame sequences are kept in a byte-bounded LRU cache and streamed as MJPEG, which
+# any <img> element plays without a video codec on either side.
+
+DATABASE_PATH = 'theralink.db'
+
+# Same DrawingSpec colours (BGR) as process_frame in app_squat.py
+SKELETON_LANDMARK_COLOR = (245, 117, 66)
+SKELETON_CONNECTION_COLOR = (245, 66, 230)
+SKELETON_THICKNESS = 2
+SKELETON_CIRCLE_RADIUS = 2
+VISIBILITY_THRESHOLD = 0.5 # drawing_utils skips landmarks below this
+BACKGROUND_COLOR = (32, 32, 32)
+
+DEFAULT_WIDTH, DEFAULT_HEIGHT, DEFAULT_FPS = 640, 480, 15
+MAX_WIDTH, MAX_HEIGHT, MAX_FPS = 1280, 720, 30
+JPEG_QUALITY = 80
+REPLAY_CACHE_BYTES = int(float(os.environ.get('THERALINK_REPLAY_CACHE_MB', 64)) * 1024 * 1024)
+# stream_mjpeg paces frames with sleep, holding a server thread for the whole replay; past this
+# many concurrent viewers new replays get 503 instead of starving the Dash callbacks of threads
+REPLAY_MAX_STREAMS = int(os.environ.get('THERALINK_REPLAY_MAX_STREAMS', 4))
+
+# (n, 2) landmark index pairs, drawn in one polylines call per frame
+_CONNECTIONS = np.array(sorted(mp.solutions.pose.POSE_CONNECTIONS), dtype=np.intp)
+
+
+def replay_size(width=None, height=None, fps=None):
+    # Clamp requested output parameters to what the server is willing to render
+    width = min(max(int(width or DEFAULT_WIDTH), 64), MAX_WIDTH)
+    height = min(max(int(height or DEFAULT_HEIGHT), 64), MAX_HEIGHT)
+    fps = min(max(int(fps or DEFAULT_FPS), 1), MAX_FPS)
+    return width, height, fps
+
+
+def resample_indices(timestamps, fps):
+    # Recorded frame shown at each output tick (the last one at or before it), so gaps hold the pose
+    timestamps = np.asarray(timestamps)
+    if not len(timestamps):
+        return np.zeros(0, dtype=np.intp)
+    ticks = timestamps[0] + np.arange(int((timestamps[-1] - timestamps[0]) * fps) + 1) / fps
+    return np.searchsorted(timestamps, ticks, side='right') - 1
+
+
+def render_frames(landmarks, width, height):
+    # (n, 33, 4) normalized landmarks -> generator of BGR skeleton images (one reused buffer)
+    landmarks = np.asarray(landmarks, dtype=np.float32)
+    points = np.rint(landmarks[..., :2] * (width, height)).astype(np.int32)
+    # drawing_utils only draws visible landmarks that fall inside the image
+    drawn = (landmarks[..., 3] >= VISIBILITY_THRESHOLD) \
+        & (landmarks[..., 0] >= 0) & (landmarks[..., 0] <= 1) & (landmarks[..., 1] >= 0) & (landmarks[..., 1] <= 1)
+    segments = points[:, _CONNECTIONS] # (n, connections, 2, 2)
+    segment_drawn = drawn[:, _CONNECTIONS].all(axis=2)
+    background = np.full((height, width, 3), BACKGROUND_COLOR, dtype=np.uint8)
+    image = np.empty_like(background)
+    for i in range(len(landmarks)):
+        np.copyto(image, background)
+        cv2.polylines(image, list(segments[i][segment_drawn[i]]), False, SKELETON_CONNECTION_COLOR,
+                      SKELETON_THICKNESS, cv2.LINE_AA)
+        for x, y in points[i][drawn[i]]:
+            cv2.circle(image, (int(x), int(y)), SKELETON_CIRCLE_RADIUS, SKELETON_LANDMARK_COLOR,
+                       SKELETON_THICKNESS, cv2.LINE_AA)
+        yield image
+
+
+def render_clip(recording_path, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, fps=DEFAULT_FPS):
+    # List of JPEG frames at `fps`. Each distinct recorded pose is drawn and encoded once;
+    # ticks that repeat a pose (camera slower than `fps`) reuse the same bytes.
+    with open_recording(recording_path) as recording:
+        indices = resample_indices(recording.timestamps, fps)
+        unique, positions = np.unique(indices, return_inverse=True)
+        landmarks = recording.records['landmarks'][unique]
+    params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    encoded = [cv2.imencode('.jpg', image, params)[1].tobytes() for image in render_frames(landmarks, width, height)]
+    return [encoded[p] for p in positions]
+
+
+class ClipCache:
+    # LRU of rendered clips bounded by total encoded size
+    def __init__(self, max_bytes=REPLAY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._clips = OrderedDict() # key -> (size, frames)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'render_seconds': 0.0}
+
+    def get(self, key, render):
+        with self._lock:
+            entry = self._clips.get(key)
+            if entry is not None:
+                self._clips.move_to_end(key)
+                self._counters['hits'] += 1
+                return entry[1]
+            self._counters['misses'] += 1
+        started = time.perf_counter()
+        frames = render()
+        size = sum({id(frame): len(frame) for frame in frames}.values()) # repeated frames are shared
+        with self._lock:
+            self._counters['render_seconds'] += time.perf_counter() - started
+            if size <= self.max_bytes and key not in self._clips:
+                self._clips[key] = (size, frames)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (evicted, _) = self._clips.popitem(last=False)
+                    self._bytes -= evicted
+                    self._counters['evictions'] += 1
+        return frames
+
+    def invalidate(self, recording_path):
+        with self._lock:
+            for key in [k for k in self._clips if k[0] == recording_path]:
+                self._bytes -= self._clips.pop(key)[0]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, clips=len(self._clips), bytes=self._bytes, max_bytes=self.max_bytes)
+
+
+clip_cache = ClipCache()
+
+
+def get_recording_path(patient_id, session_id):
+    # Scoped to the patient, like session_history.get_session
+    conn = sqlite3.connect(DATABASE_PATH)
+    row = conn.execute("SELECT recording_path FROM sessions WHERE session_id = ? AND patient_id = ?",
+                       (session_id, patient_id)).fetchone()
+    conn.close()
+    if row is None or not row[0] or not os.path.exists(row[0]):
+        return None
+    return row[0]
+
+
+def get_replay_clip(recording_path, width=None, height=None, fps=None):
+    width, height, fps = replay_size(width, height, fps)
+    frames = clip_cache.get((recording_path, width, height, fps),
+                            lambda: render_clip(recording_path, width, height, fps))
+    return frames, fps
+
+
+def replay_url(patient_id, session_id, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, fps=DEFAULT_FPS):
+    return f"/replay/{patient_id}/{session_id}.mjpg?w={width}&h={height}&fps={fps}"
+
+
+def stream_mjpeg(frames, fps):
+    # multipart/x-mixed-replace body, paced at `fps` so the browser plays it in real time
+    interval = 1.0 / fps
+    next_at = time.monotonic()
+    for frame in frames:
+        yield b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' + str(len(frame)).encode() + b'\r\n\r\n'
+        yield frame
+        yield b'\r\n'
+        next_at += interval
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+_stream_slots = threading.BoundedSemaphore(REPLAY_MAX_STREAMS)
+
+
+def _release_once():
+    # Response.call_on_close may fire more than once (and not at all if the client never reads)
+    lock, released = threading.Lock(), [False]
+
+    def release():
+        with lock:
+            if not released[0]:
+                released[0] = True
+                _stream_slots.release()
+    return release
+
+
+def register_replay_routes(server):
+    # GET /replay/<patient_id>/<session_id>.mjpg?w=&h=&fps= -> streamed skeleton replay
+    # Only the patient's doctor or the patient themselves (route_auth.py) may watch it.
+    from flask import Response, abort, jsonify, request, stream_with_context
+
+    @server.route('/replay/<int:patient_id>/<int:session_id>.mjpg')
+    def skeleton_replay_route(patient_id, session_id):
+        require_patient_access(patient_id)
+        recording_path = get_recording_path(patient_id, session_id)
+        if recording_path is None:
+            abort(404)
+        if not _stream_slots.acquire(blocking=False):
+            abort(503)
+        release = _release_once()
+        try:
+            frames, fps = get_replay_clip(recording_path, request.args.get('w', type=int),
+                                          request.args.get('h', type=int), request.args.get('fps', type=int))
+            response = Response(stream_with_context(stream_mjpeg(frames, fps)),
+                                mimetype='multipart/x-mixed-replace; boundary=frame')
+        except BaseException:
+            release()
+            raise
+        response.call_on_close(release)
+        return response
+
+    @server.route('/replay-stats')
+    def replay_stats_route():
+        require_role('doctor')
+        return jsonify(clip_cache.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a landmark recording and report speed against real time.")
+    parser.add_argument('recording')
+    parser.add_argument('--width', type=int, default=DEFAULT_WIDTH)
+    parser.add_argument('--height', type=int, default=DEFAULT_HEIGHT)
+    parser.add_argument('--fps', type=int, default=DEFAULT_FPS)
+    parser.add_argument('--output', help="Optional .mjpg file to write the frames to")
+    args = parser.parse_args()
+
+    width, height, fps = replay_size(args.width, args.height, args.fps)
+    started = time.perf_counter()
+    frames = render_clip(args.recording, width, height, fps)
+    elapsed = time.perf_counter() - started
+    clip_seconds = len(frames) / fps
+    print(f"{len(frames)} frames ({clip_seconds:.1f}s at {fps} fps, {width}x{height}) rendered in {elapsed:.2f}s "
+          f"= {clip_seconds / elapsed if elapsed else float('inf'):.1f}x real time", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.writelines(frames)
@@ -0,0 +1,399 @@
+import sys
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+import numpy as np
+from utils import trailing_mean
+from query_cache import cached_query
+from exercise_rules import load_exercise
+from landmark_recorder import open_recording
+from rep_segmentation import segment_recording
+
+# Similarity of each recorded rep to reference demonstrations (movement templates).
+# Every rep is cut from its landmark recording using the `reps` table, its joint angle curves are
+# resampled to a fixed length, and it is aligned to each template with banded DTW. The DTW runs on
+# a whole batch of reps at once: one numpy step per template row, with the within-row recurrence
+# solved by a prefix-sum + minimum.accumulate scan over the Sakoe-Chiba band. An LB_Keogh lower
+# bound skips templates that cannot beat the best match found so far. Scores go to rep_template_scores:
+# a new session's reps are scored as it is saved (app_squat.save_session_data); `score` below
+# catches up on older sessions and on reps recorded before a template was added.
+
+DATABASE_PATH = 'theralink.db'
+
+CURVE_LENGTH = 64 # samples per resampled rep
+BAND_RADIUS = 6 # Sakoe-Chiba band, in samples (~10% of a rep)
+SIMILARITY_SCALE_DEG = 45.0 # mean per-joint deviation that scores 0% similar
+SCORE_BATCH_REPS = 4096
+
+TEMPLATE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS movement_templates (
+        template_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        exercise TEXT NOT NULL,
+        name TEXT NOT NULL,
+        joints TEXT NOT NULL, -- comma separated, order of the curve columns
+        length INTEGER NOT NULL,
+        curve BLOB NOT NULL, -- float32 (length, joints)
+        created_at TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS rep_template_scores (
+        session_id INTEGER NOT NULL,
+        rep_index INTEGER NOT NULL,
+        patient_id INTEGER NOT NULL,
+        template_id INTEGER NOT NULL, -- best matching template
+        distance REAL NOT NULL, -- DTW cost per sample and joint, degrees
+        similarity REAL NOT NULL, -- 0..100
+        PRIMARY KEY (session_id, rep_index),
+        FOREIGN KEY (session_id) REFERENCES sessions(session_id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_rep_scores_patient_session ON rep_template_scores (patient_id, session_id)",
+]
+
+INSERT_SCORE_SQL = '''
+    INSERT OR REPLACE INTO rep_template_scores (session_id, rep_index, patient_id, template_id, distance, similarity)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+def init_template_tables(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    for statement in TEMPLATE_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+# --- curves ---
+
+def series_angles(landmarks, exercise):
+    # (n, 33, >=2) landmarks -> (n, joints) smoothed angles for the exercise's joints
+    return trailing_mean(exercise.angles(landmarks), exercise.smoothing_frames)
+
+
+def resample_segments(timestamps, values, starts, ends, length=CURVE_LENGTH):
+    # Linear resampling of values[(n, joints)] between each (start, end) time -> (segments, length, joints)
+    t = np.asarray(timestamps, dtype=np.float64)
+    starts, ends = np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
+    targets = starts[:, None] + (ends - starts)[:, None] * np.linspace(0.0, 1.0, length)
+    upper = np.clip(np.searchsorted(t, targets, side='right'), 1, len(t) - 1)
+    lower = upper - 1
+    span = t[upper] - t[lower]
+    weight = np.clip(np.divide(targets - t[lower], span, out=np.zeros_like(targets), where=span > 0), 0.0, 1.0)
+    return values[lower] * (1 - weight[..., None]) + values[upper] * weight[..., None]
+
+
+def recording_rep_curves(recording_path, reps, exercise, length=CURVE_LENGTH):
+    # Curves of the given reps (dicts/rows with start_t, end_t relative to the first frame)
+    with open_recording(recording_path) as recording:
+        timestamps = np.array(recording.timestamps)
+        angles = series_angles(recording.records['landmarks'].astype(np.float32), exercise)
+    t = timestamps - timestamps[0]
+    starts = [rep['start_t'] for rep in reps]
+    ends = [rep['end_t'] for rep in reps]
+    return resample_segments(t, angles, starts, ends, length).astype(np.float32)
+
+
+# --- DTW ---
+
+def _band_view(template, radius):
+    # (length, joints) -> (length, 2r+1, joints): row i holds template[i - r .. i + r] (edge-padded),
+    # plus a mask of which band cells fall inside the template
+    length = len(template)
+    columns = np.arange(length)[:, None] + np.arange(-radius, radius + 1)
+    valid = (columns >= 0) & (columns < length)
+    return template[np.clip(columns, 0, length - 1)], valid
+
+
+def dtw_band(queries, template, radius=BAND_RADIUS):
+    # Banded DTW cost (L1 over joints) of every query against one template.
+    # queries: (batch, length, joints); template: (length, joints). Returns (batch,) total costs.
+    queries = np.asarray(queries, dtype=np.float64)
+    band, valid = _band_view(np.asarray(template, dtype=np.float64), radius)
+    batch, length, _ = queries.shape
+    width = 2 * radius + 1
+    inf_column = np.full((batch, 1), np.inf)
+    # All band costs and their within-row prefix sums up front: (batch, length, width).
+    # Summed joint by joint: reducing a short last axis is several times slower than adding planes.
+    costs = np.zeros((batch, length, width))
+    scratch = np.empty_like(costs)
+    for j in range(queries.shape[2]):
+        np.subtract(queries[:, :, None, j], band[None, :, :, j], out=scratch)
+        costs += np.abs(scratch, out=scratch)
+    prefixes = np.cumsum(costs, axis=2, out=costs)
+    befores = np.concatenate([np.zeros((batch, length, 1)), prefixes[:, :, :-1]], axis=2)
+    previous = None
+    for i in range(length):
+        # Band offset o in row i is column i - r + o; in row i-1 the same column is offset o + 1
+        if previous is None:
+            reach = np.full((batch, width), np.inf)
+            reach[:, radius] = 0.0 # path starts at (0, 0)
+        else:
+            shifted = np.concatenate([previous[:, 1:], inf_column], axis=1) # D[i-1, j]
+            reach = np.minimum(previous, shifted) # min(D[i-1, j-1], D[i-1, j])
+        reach[:, ~valid[i]] = np.inf
+        # D[i, j] = c[i, j] + min(reach[j], D[i, j-1]) = S[j] + min_{k<=j}(reach[k] - S[k-1])
+        current = prefixes[:, i] + np.minimum.accumulate(reach - befores[:, i], axis=1)
+        current[:, ~valid[i]] = np.inf
+        previous = current
+    return previous[:, radius] # D[length-1, length-1]
+
+
+def keogh_envelope(template, radius=BAND_RADIUS):
+    band, valid = _band_view(np.asarray(template, dtype=np.float64), radius)
+    lower = np.where(valid[..., None], band, np.inf).min(axis=1)
+    upper = np.where(valid[..., None], band, -np.inf).max(axis=1)
+    return lower, upper
+
+
+def lb_keogh(queries, envelopes):
+    # Lower bound of dtw_band for every (query, template): (batch, templates)
+    queries = np.asarray(queries, dtype=np.float64)
+    bounds = np.empty((len(queries), len(envelopes)))
+    for k, (lower, upper) in enumerate(envelopes):
+        below = np.maximum(lower - queries, 0.0)
+        above = np.maximum(queries - upper, 0.0)
+        bounds[:, k] = (below + above).sum(axis=(1, 2))
+    return bounds
+
+
+def best_template_match(queries, templates, radius=BAND_RADIUS, prune=True):
+    # Best (lowest cost) template per query. Returns (template position, cost, stats).
+    # With prune=True templates are visited in LB_Keogh order per query and a DTW is only run
+    # while its lower bound can still beat the best cost found so far.
+    queries = np.asarray(queries, dtype=np.float64)
+    n, n_templates = len(queries), len(templates)
+    best_cost = np.full(n, np.inf)
+    best_index = np.full(n, -1, dtype=np.intp)
+    if not n or not n_templates:
+        return best_index, best_cost, {'dtw': 0, 'pruned': 0}
+    if not prune:
+        for k, template in enumerate(templates):
+            cost = dtw_band(queries, template, radius)
+            better = cost < best_cost
+            best_cost[better], best_index[better] = cost[better], k
+        return best_index, best_cost, {'dtw': n * n_templates, 'pruned': 0}
+
+    bounds = lb_keogh(queries, [keogh_envelope(t, radius) for t in templates])
+    order = np.argsort(bounds, axis=1)
+    computed = 0
+    for rank in range(n_templates):
+        candidate = order[:, rank]
+        live = bounds[np.arange(n), candidate] < best_cost
+        if not live.any():
+            break
+        # One batched DTW per template among the queries still in play at this rank
+        for k in np.unique(candidate[live]):
+            rows = np.flatnonzero(live & (candidate == k))
+            cost = dtw_band(queries[rows], templates[k], radius)
+            computed += len(rows)
+            better = cost < best_cost[rows]
+            best_cost[rows[better]], best_index[rows[better]] = cost[better], k
+    return best_index, best_cost, {'dtw': computed, 'pruned': n * n_templates - computed}
+
+
+def normalized_distance(cost, length=CURVE_LENGTH, n_joints=1):
+    # Total DTW cost -> mean absolute deviation per sample and joint (degrees)
+    return cost / (length * n_joints)
+
+
+def similarity_from_distance(distance):
+    return np.clip(100.0 * (1.0 - distance / SIMILARITY_SCALE_DEG), 0.0, 100.0)
+
+
+# --- templates ---
+
+def add_template(name, recording_path, exercise_name='squat', length=CURVE_LENGTH):
+    # Reference template = mean resampled curve over the reps of a demonstration recording
+    exercise = load_exercise(exercise_name)
+    reps = segment_recording(recording_path, exercise)
+    if not len(reps):
+        raise ValueError(f"No complete reps found in {recording_path}")
+    curves = recording_rep_curves(recording_path, reps, exercise, length)
+    curve = curves.mean(axis=0).astype(np.float32)
+    conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.execute('''
+        INSERT INTO movement_templates (exercise, name, joints, length, curve, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (exercise.name, name, ','.join(exercise.joints), length, curve.tobytes(),
+          datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    conn.commit()
+    template_id = cursor.lastrowid
+    conn.close()
+    return template_id
+
+
+def load_templates(exercise_name, conn=None):
+    # ([template_id, ...], [(length, joints) float32 curves]) for one exercise
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DATABASE_PATH)
+    rows = conn.execute('''
+        SELECT template_id, joints, length, curve FROM movement_templates WHERE exercise = ? ORDER BY template_id
+    ''', (exercise_name,)).fetchall()
+    if own_conn:
+        conn.close()
+    ids = [row[0] for row in rows]
+    curves = [np.frombuffer(curve, dtype=np.float32).reshape(length, len(joints.split(','))) for _, joints, length, curve in rows]
+    return ids, curves
+
+
+# --- scoring stored sessions ---
+
+def _match_scores(curves, template_ids, templates, n_joints, prune=True):
+    # (reps, length, joints) curves -> [(template_id, distance, similarity)] of each rep's best match
+    index, cost, _ = best_template_match(curves, templates, prune=prune)
+    distance = normalized_distance(cost, CURVE_LENGTH, n_joints)
+    similarity = similarity_from_distance(distance)
+    return [(template_ids[i], float(d), float(s)) for i, d, s in zip(index, distance, similarity)]
+
+
+def score_recording_reps(recording_path, reps, exercise):
+    # [(rep_index, template_id, distance, similarity)] for the reps of one recording; [] when the
+    # exercise has no templates. Called as a session is saved, before its row exists.
+    if reps is None or not len(reps):
+        return []
+    template_ids, templates = load_templates(exercise.name)
+    if not templates:
+        return []
+    curves = recording_rep_curves(recording_path, reps, exercise)
+    return [(int(rep['rep_index']),) + score
+            for rep, score in zip(reps, _match_scores(curves, template_ids, templates, len(exercise.joints)))]
+
+
+def store_rep_scores(cursor, session_id, patient_id, scores):
+    cursor.executemany(INSERT_SCORE_SQL, [(session_id, rep_index, patient_id) + tuple(score)
+                                          for rep_index, *score in scores])
+
+
+def _unscored_reps(conn, exercise, patient_ids=None):
+    # Reps of the exercise's recorded sessions without a score, grouped by session (recording read once each)
+    patient_clause = f"AND r.patient_id IN ({','.join('?' * len(patient_ids))})" if patient_ids else ""
+    rows = conn.execute(f'''
+        SELECT r.session_id, r.patient_id, s.recording_path, r.rep_index, r.start_t, r.end_t
+        FROM reps r
+        JOIN sessions s ON s.session_id = r.session_id
+        WHERE s.exercise_type = ? AND s.recording_path IS NOT NULL {patient_clause}
+          AND NOT EXISTS (SELECT 1 FROM rep_template_scores t
+                          WHERE t.session_id = r.session_id AND t.rep_index = r.rep_index)
+        ORDER BY r.session_id, r.rep_index
+    ''', [exercise.display_name] + list(patient_ids or [])).fetchall()
+    sessions = {}
+    for session_id, patient_id, path, rep_index, start_t, end_t in rows:
+        sessions.setdefault((session_id, patient_id, path), []).append(
+            {'rep_index': rep_index, 'start_t': start_t, 'end_t': end_t})
+    return sessions
+
+
+def score_reps(exercise_name='squat', patient_ids=None, batch_reps=SCORE_BATCH_REPS, prune=True):
+    # Score every unscored rep against the exercise's templates, batch_reps reps per DTW batch.
+    # Returns the number of reps scored.
+    exercise = load_exercise(exercise_name)
+    conn = sqlite3.connect(DATABASE_PATH, timeout=10)
+    template_ids, templates = load_templates(exercise.name, conn)
+    if not templates:
+        conn.close()
+        return 0
+    pending = _unscored_reps(conn, exercise, patient_ids)
+    keys, curves = [], []
+    scored = 0
+
+    def flush():
+        nonlocal scored
+        if not keys:
+            return
+        scores = _match_scores(np.concatenate(curves), template_ids, templates, len(exercise.joints), prune)
+        conn.executemany(INSERT_SCORE_SQL, [key + score for key, score in zip(keys, scores)])
+        conn.commit()
+        scored += len(keys)
+        keys.clear()
+        curves.clear()
+
+    for (session_id, patient_id, path), reps in pending.items():
+        try:
+            curves.append(recording_rep_curves(path, reps, exercise))
+        except (OSError, ValueError):
+            continue # Missing recording: its reps stay unscored
+        keys.extend((session_id, rep['rep_index'], patient_id) for rep in reps)
+        if len(keys) >= batch_reps:
+            flush()
+    flush()
+    conn.close()
+    return scored
+
+
+@cached_query('patient_similarity_trend', entity='patient')
+def get_patient_similarity_trend(patient_id, exercise_type=None):
+    # Weekly mean rep similarity for one patient, per exercise:
+    # [{'week': 'YYYY-MM-DD', 'exercise_type': ..., 'reps': n, 'similarity': x}]
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    exercise_clause = "AND s.exercise_type = ?" if exercise_type else ""
+    rows = conn.execute(f'''
+        SELECT date(s.date, 'weekday 0', '-6 days') AS week, s.exercise_type, COUNT(*) AS reps,
+               AVG(t.similarity) AS similarity
+        FROM rep_template_scores t
+        JOIN sessions s ON s.session_id = t.session_id
+        WHERE t.patient_id = ? {exercise_clause}
+        GROUP BY week, s.exercise_type
+        ORDER BY week
+    ''', (patient_id,) + ((exercise_type,) if exercise_type else ())).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+# --- benchmark ---
+
+def _synthetic_reps(n_reps, n_templates, n_joints, rng):
+    # Squat-like curves: a dip with random depth, timing and noise
+    x = np.linspace(0.0, 1.0, CURVE_LENGTH)
+
+    def dips(count):
+        depth = rng.uniform(70, 110, (count, 1, n_joints))
+        centre = rng.uniform(0.35, 0.65, (count, 1, 1))
+        width = rng.uniform(0.15, 0.3, (count, 1, 1))
+        shape = np.exp(-((x[None, :, None] - centre) / width) ** 2)
+        return 170 - depth * shape + rng.normal(0, 2, (count, CURVE_LENGTH, n_joints))
+
+    return dips(n_reps), list(dips(n_templates))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Movement template matching: add templates, score reps, benchmark.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add-template', help="Create a template from a demonstration recording")
+    add.add_argument('name')
+    add.add_argument('recording')
+    add.add_argument('--exercise', default='squat')
+    score = sub.add_parser('score', help="Score all unscored reps")
+    score.add_argument('--exercise', default='squat')
+    score.add_argument('--no-prune', action='store_true')
+    bench = sub.add_parser('benchmark', help="Time batched DTW on synthetic reps")
+    bench.add_argument('reps', type=int)
+    bench.add_argument('--templates', type=int, default=8)
+    bench.add_argument('--joints', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'add-template':
+        init_template_tables()
+        print(add_template(args.name, args.recording, args.exercise))
+    elif args.command == 'score':
+        init_template_tables()
+        start = time.perf_counter()
+        count = score_reps(args.exercise, prune=not args.no_prune)
+        print(f"{count} reps scored in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    else:
+        queries, templates = _synthetic_reps(args.reps, args.templates, args.joints, np.random.default_rng(0))
+        for prune in (False, True):
+            start = time.perf_counter()
+            index, cost, stats = best_template_match(queries, templates, prune=prune)
+            elapsed = time.perf_counter() - start
+            print(f"{'LB_Keogh pruned' if prune else 'exhaustive':>15}: {args.reps} reps x {args.templates} templates "
+                  f"in {elapsed:.2f}s ({args.reps / elapsed:,.0f} reps/s), {stats['dtw']} DTWs, {stats['pruned']} pruned",
+                  file=sys.stderr)
@@ -0,0 +1,31 @@
+import sqlite3
+import pytest
+import patient_search
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = str(tmp_path / 'theralink.db')
+    monkeypatch.setattr(patient_search, 'DATABASE_PATH', path)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)")
+    conn.execute("CREATE TABLE patients (patient_id INTEGER PRIMARY KEY, name TEXT, doctor_id INTEGER)")
+    for patient_id, name, username, doctor_id in [(1, 'Liz', 'lz1', 7), (2, 'lizzy', 'lz2', 7), (3, 'Lizard', 'lz3', 7),
+                                                  (4, 'Lima', 'LIZA', 7), (5, 'Lizbeth', 'lz5', 8)]:
+        conn.execute("INSERT INTO users VALUES (?, ?)", (patient_id, username))
+        conn.execute("INSERT INTO patients VALUES (?, ?, ?)", (patient_id, name, doctor_id))
+    conn.commit()
+    patient_search.ensure_typeahead_indexes(conn)
+    conn.close()
+    return path
+
+
+@pytest.mark.parametrize('prefix', ['Liz', 'liz', 'LIZ', 'lIz'])
+def test_prefix_matches_regardless_of_case(database, prefix):
+    names = [patient['name'] for patient in patient_search.search_patient_prefix(7, prefix)]
+    # Lima matches on its username; Lizbeth belongs to another doctor
+    assert names == ['Lima', 'Liz', 'Lizard', 'lizzy']
+
+
+def test_uppercase_last_letter_bound():
+    assert patient_search._prefix_range('LIZ') == ('liz', 'li{')
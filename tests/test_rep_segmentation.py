@@ -0,0 +1,37 @@
+import numpy as np
+from exercise_rules import load_exercise
+from rep_segmentation import segment_reps
+
+
+def squat_series(fps=30.0, stand=1.0, descent=2.0, ascent=2.0, top=170.0, bottom=65.0, reps=1):
+    # Clean squats on the squat definition's phase joint: standing, linear descent, linear ascent
+    exercise = load_exercise('squat')
+    one = np.concatenate((np.full(int(stand * fps), top), np.linspace(top, bottom, int(descent * fps)),
+                          np.linspace(bottom, top, int(ascent * fps))))
+    knee = np.concatenate([one] * reps + [np.full(int(stand * fps), top)])
+    angles = np.full((len(knee), len(exercise.joints)), 90.0)
+    angles[:, exercise.phase_joint] = knee
+    return np.arange(len(knee)) / fps, angles, exercise
+
+
+def test_rep_starts_at_the_last_frame_in_the_rest_range():
+    t, angles, exercise = squat_series()
+    reps = segment_reps(t, angles, exercise)
+    assert len(reps) == 1
+    rep = reps[0]
+    # The smoothed knee angle leaves the rest range (>= 160) ~0.2 s into the 2 s descent at t = 1 s,
+    # and is back in it ~0.2 s before the end of the 2 s ascent
+    assert 1.0 <= rep['start_t'] < 1.4
+    assert 1.6 < rep['descent_s'] <= 2.1
+    assert 1.6 < rep['ascent_s'] <= 2.1
+    assert 3.4 < rep['time_under_tension_s'] <= 4.1
+    assert 90.0 < rep['range_of_motion'] <= 105.0
+    assert 65.0 <= rep['depth_angle'] < 70.0
+
+
+def test_counts_every_rep_and_drops_too_slow_ones():
+    t, angles, exercise = squat_series(reps=3)
+    assert len(segment_reps(t, angles, exercise)) == 3
+    # ~13 s from the active range back to rest: over max_rep_seconds, like the live counter
+    t, angles, exercise = squat_series(ascent=15.0)
+    assert len(segment_reps(t, angles, exercise)) == 0
@@ -0,0 +1,301 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from pose_features import N_FEATURES
+from dataset_recorder import DATASET_DIR, LABEL_LETTERS, load_manifest, iter_shards
+
+# Training entry point for the form classifier (replaces the in-memory, single-run tfmodel.py).
+# Recorded shards (dataset_recorder.py) are streamed through tf.data: read shard by shard, cached
+# to a file on first pass, shuffled, batched and prefetched, so epochs after the first never touch
+# the .npz files and the dataset never has to fit in memory. Folds are whole recordings: neighbouring
+# frames of one recording are near duplicates, so a recording split between training and validation
+# would leak. Shards never span recordings and carry their recording id (dataset_recorder.py).
+# Every (configuration, fold) pair trains in its own CPU worker process; the best configuration is
+# then retrained on all shards and saved with a JSON metrics report and Agg-rendered plots.
+
+MODEL_PATH = 'form_model_57'
+REPORT_DIR = 'training_report'
+
+DEFAULT_FOLDS = 5
+DEFAULT_EPOCHS = 100
+DEFAULT_BATCH_SIZE = 256
+SHUFFLE_BUFFER = 16384
+EARLY_STOPPING_PATIENCE = 8
+DECISION_THRESHOLD = 0.5
+RECORDING_GAP_SECONDS = 2.0 # shards written before recording ids: closer than this = same recording
+# Sweep grid: every combination is cross-validated
+DEFAULT_HIDDEN_UNITS = (0, 32)
+DEFAULT_LEARNING_RATES = (1e-3, 3e-3)
+
+
+def _configure_tensorflow(threads):
+    # Worker initializer (thread counts can only be set before TensorFlow runs anything):
+    # CPU only, and a share of the cores rather than all of them
+    os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _worker_pool(workers, threads):
+    # spawn: TensorFlow is not fork-safe
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_configure_tensorflow, initargs=(threads,))
+
+
+def make_dataset(tf, directory, shards, batch_size, cache_path=None, shuffle=True, seed=0):
+    # Shards -> cached, shuffled, batched, prefetched tf.data pipeline of (features, multi-hot labels)
+    shards = [int(s) for s in shards]
+
+    def chunks():
+        for shard in iter_shards(directory, ('features', 'labels'), shards):
+            yield shard['features'], shard['labels'].astype(np.float32)
+
+    dataset = tf.data.Dataset.from_generator(chunks, output_signature=(
+        tf.TensorSpec((None, N_FEATURES), tf.float32), tf.TensorSpec((None, len(LABEL_LETTERS)), tf.float32),
+    )).unbatch()
+    dataset = dataset.cache(cache_path) if cache_path else dataset.cache()
+    if shuffle:
+        dataset = dataset.shuffle(SHUFFLE_BUFFER, seed=seed, reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def build_model(tf, train_dataset, hidden_units, learning_rate):
+    # Standardised inputs -> optional hidden layer -> one sigmoid per label letter
+    normalize = tf.keras.layers.Normalization()
+    normalize.adapt(train_dataset.map(lambda features, labels: features))
+    layers = [tf.keras.Input((N_FEATURES,)), normalize]
+    if hidden_units:
+        layers.append(tf.keras.layers.Dense(hidden_units, activation='relu'))
+    layers.append(tf.keras.layers.Dense(len(LABEL_LETTERS), activation='sigmoid'))
+    model = tf.keras.Sequential(layers)
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss=tf.keras.losses.BinaryCrossentropy(),
+                  metrics=[tf.keras.metrics.BinaryAccuracy(name='accuracy')])
+    return model
+
+
+def label_metrics(labels, probabilities, threshold=DECISION_THRESHOLD):
+    # Per-letter precision/recall/F1 and exact-match accuracy of thresholded predictions
+    predicted = probabilities >= threshold
+    actual = labels >= 0.5
+    true_positive = (predicted & actual).sum(axis=0)
+    precision = true_positive / np.maximum(predicted.sum(axis=0), 1)
+    recall = true_positive / np.maximum(actual.sum(axis=0), 1)
+    f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+    return {
+        'exact_match': float((predicted == actual).all(axis=1).mean()) if len(labels) else None,
+        'per_label': {letter: {'precision': float(p), 'recall': float(r), 'f1': float(f), 'support': int(s)}
+                      for letter, p, r, f, s in zip(LABEL_LETTERS, precision, recall, f1, actual.sum(axis=0))},
+        'macro_f1': float(f1.mean()),
+    }
+
+
+def predicted_label(probabilities, threshold=DECISION_THRESHOLD):
+    # One frame's sigmoid outputs -> its label letters, as label_metrics thresholds them ('c' if none)
+    return ''.join(letter for letter, p in zip(LABEL_LETTERS, np.ravel(probabilities)) if p >= threshold) or 'c'
+
+
+def _predict(model, dataset):
+    labels, probabilities = [], []
+    for features, batch_labels in dataset:
+        labels.append(batch_labels.numpy())
+        probabilities.append(model(features, training=False).numpy())
+    if not labels:
+        return np.zeros((0, len(LABEL_LETTERS))), np.zeros((0, len(LABEL_LETTERS)))
+    return np.concatenate(labels), np.concatenate(probabilities)
+
+
+def train_fold(task):
+    # Worker: train one configuration on one fold; returns its history and validation metrics
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(task['seed'])
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='theralink_train_') as scratch:
+        train = make_dataset(tf, task['directory'], task['train_shards'], task['batch_size'],
+                             os.path.join(scratch, 'train'), shuffle=True, seed=task['seed'])
+        validation = make_dataset(tf, task['directory'], task['validation_shards'], task['batch_size'],
+                                  os.path.join(scratch, 'validation'), shuffle=False)
+        model = build_model(tf, train, task['hidden_units'], task['learning_rate'])
+        stop = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=EARLY_STOPPING_PATIENCE,
+                                                restore_best_weights=True)
+        history = model.fit(train, validation_data=validation, epochs=task['epochs'], callbacks=[stop], verbose=0)
+        labels, probabilities = _predict(model, validation)
+    losses = history.history['val_loss']
+    return {
+        'config': task['config'], 'fold': task['fold'],
+        'best_epoch': int(np.argmin(losses)) + 1, 'val_loss': float(np.min(losses)),
+        'history': {key: [float(v) for v in values] for key, values in history.history.items()},
+        'metrics': label_metrics(labels, probabilities), 'seconds': time.perf_counter() - started,
+    }
+
+
+def train_final(task):
+    # Worker: train the chosen configuration on every shard for a fixed number of epochs and save it
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(task['seed'])
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='theralink_train_') as scratch:
+        train = make_dataset(tf, task['directory'], task['train_shards'], task['batch_size'],
+                             os.path.join(scratch, 'train'), shuffle=True, seed=task['seed'])
+        model = build_model(tf, train, task['hidden_units'], task['learning_rate'])
+        history = model.fit(train, epochs=task['epochs'], verbose=0)
+        model.save(task['model_path'])
+    return {'history': {key: [float(v) for v in values] for key, values in history.history.items()},
+            'seconds': time.perf_counter() - started}
+
+
+def shard_recordings(shards):
+    # Manifest shard entries -> recording key per shard. Shards from before recording ids were stored
+    # count as one recording while each starts within RECORDING_GAP_SECONDS of the previous one's end.
+    keys, previous_end, legacy = [], None, -1
+    for shard in shards:
+        if shard.get('recording') is not None:
+            keys.append(shard['recording'])
+            previous_end = None
+            continue
+        if previous_end is None or shard['start_t'] - previous_end > RECORDING_GAP_SECONDS:
+            legacy += 1
+        keys.append(f"legacy-{legacy}")
+        previous_end = shard['end_t']
+    return keys
+
+
+def shard_folds(shards, folds, seed=0):
+    # Manifest shard entries -> `folds` lists of shard indices. Whole recordings are dealt out in
+    # shuffled order, largest first, each to the fold with the fewest frames so far.
+    recordings = {}
+    for i, key in enumerate(shard_recordings(shards)):
+        recordings.setdefault(key, []).append(i)
+    if len(recordings) < 2:
+        raise ValueError("Cross-validation needs at least two recordings")
+    folds = min(folds, len(recordings))
+    groups = [recordings[key] for key in np.random.default_rng(seed).permutation(sorted(recordings))]
+    groups.sort(key=lambda group: -sum(shards[i]['frames'] for i in group)) # stable: ties stay shuffled
+    fold_shards, fold_frames = [[] for _ in range(folds)], [0] * folds
+    for group in groups:
+        smallest = int(np.argmin(fold_frames))
+        fold_shards[smallest].extend(group)
+        fold_frames[smallest] += sum(shards[i]['frames'] for i in group)
+    return [sorted(fold) for fold in fold_shards]
+
+
+def _plot(report, directory):
+    import matplotlib
+    matplotlib.use('Agg') # No display needed
+    import matplotlib.pyplot as plt
+
+    best = report['best_config']
+    figure, axis = plt.subplots()
+    for run in report['runs']:
+        if run['config'] == best:
+            axis.plot(run['history']['val_loss'], label=f"fold {run['fold']}")
+    axis.set_title(f"Validation loss, {best}")
+    axis.set_xlabel('epoch')
+    axis.legend()
+    figure.savefig(os.path.join(directory, 'validation_loss.png'), dpi=100)
+    plt.close(figure)
+
+    figure, axis = plt.subplots()
+    names = list(report['configs'])
+    axis.bar(range(len(names)), [report['configs'][name]['mean_val_loss'] for name in names])
+    axis.set_xticks(range(len(names)), names, rotation=30, ha='right')
+    axis.set_title('Mean cross-validation loss per configuration')
+    figure.tight_layout()
+    figure.savefig(os.path.join(directory, 'sweep.png'), dpi=100)
+    plt.close(figure)
+
+
+def run(directory=DATASET_DIR, folds=DEFAULT_FOLDS, epochs=DEFAULT_EPOCHS, batch_size=DEFAULT_BATCH_SIZE,
+        hidden_units=DEFAULT_HIDDEN_UNITS, learning_rates=DEFAULT_LEARNING_RATES, workers=None,
+        model_path=MODEL_PATH, report_dir=REPORT_DIR, seed=0):
+    manifest = load_manifest(directory)
+    n_shards = len(manifest['shards'])
+    fold_shards = shard_folds(manifest['shards'], folds, seed)
+    configs = {f"hidden={hidden},lr={rate:g}": {'hidden_units': hidden, 'learning_rate': rate}
+               for hidden, rate in itertools.product(hidden_units, learning_rates)}
+    tasks = []
+    for (name, config), (fold, validation) in itertools.product(configs.items(), enumerate(fold_shards)):
+        tasks.append(dict(config, config=name, fold=fold, directory=directory, epochs=epochs, batch_size=batch_size,
+                          seed=seed + fold, validation_shards=validation,
+                          train_shards=[s for s in range(n_shards) if s not in validation]))
+    cores = os.cpu_count() or 1
+    workers = max(1, min(workers or cores, len(tasks)))
+
+    started = time.perf_counter()
+    runs = []
+    with _worker_pool(workers, max(1, cores // workers)) as pool:
+        for future in as_completed([pool.submit(train_fold, task) for task in tasks]):
+            result = future.result()
+            runs.append(result)
+            print(f"{result['config']} fold {result['fold']}: val_loss {result['val_loss']:.4f} "
+                  f"after {result['best_epoch']} epochs ({result['seconds']:.0f}s)", file=sys.stderr)
+        runs.sort(key=lambda r: (r['config'], r['fold']))
+        summary = {}
+        for name in configs:
+            own = [r for r in runs if r['config'] == name]
+            summary[name] = dict(configs[name], mean_val_loss=float(np.mean([r['val_loss'] for r in own])),
+                                 std_val_loss=float(np.std([r['val_loss'] for r in own])),
+                                 mean_macro_f1=float(np.mean([r['metrics']['macro_f1'] for r in own])),
+                                 median_best_epoch=int(np.median([r['best_epoch'] for r in own])))
+    best = min(summary, key=lambda name: summary[name]['mean_val_loss'])
+    cv_seconds = time.perf_counter() - started
+
+    # Final model: every shard and every core, as many epochs as the best configuration needed in cross-validation
+    final_task = dict(configs[best], directory=directory, batch_size=batch_size, seed=seed,
+                      epochs=summary[best]['median_best_epoch'], train_shards=list(range(n_shards)),
+                      model_path=model_path)
+    with _worker_pool(1, cores) as pool:
+        final = pool.submit(train_final, final_task).result()
+
+    report = {
+        'dataset': {'directory': directory, 'shards': n_shards, 'recordings': len(set(shard_recordings(manifest['shards']))),
+                    'frames': sum(s['frames'] for s in manifest['shards']),
+                    'label_counts': dict(zip(LABEL_LETTERS, np.sum([s['label_counts'] for s in manifest['shards']],
+                                                                    axis=0).tolist()))},
+        'folds': fold_shards, 'configs': summary, 'best_config': best, 'runs': runs,
+        'final': {'model_path': model_path, 'epochs': final_task['epochs'], **final},
+        'seconds': {'cross_validation': cv_seconds, 'total': time.perf_counter() - started}, 'workers': workers,
+    }
+    if os.path.isdir(report_dir):
+        shutil.rmtree(report_dir)
+    os.makedirs(report_dir)
+    with open(os.path.join(report_dir, 'metrics.json'), 'w') as f:
+        json.dump(report, f, indent=1)
+    _plot(report, report_dir)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-validate, sweep and train the form classifier on recorded shards.")
+    parser.add_argument('--dataset', default=DATASET_DIR)
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS)
+    parser.add_argument('--epochs', type=int, default=DEFAULT_EPOCHS, help="Upper bound; early stopping ends sooner")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--hidden-units', type=int, nargs='+', default=list(DEFAULT_HIDDEN_UNITS))
+    parser.add_argument('--learning-rates', type=float, nargs='+', default=list(DEFAULT_LEARNING_RATES))
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per core, up to the number of runs)")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--report', default=REPORT_DIR)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    report = run(args.dataset, args.folds, args.epochs, args.batch_size, args.hidden_units, args.learning_rates,
+                 args.workers, args.model, args.report, args.seed)
+    best = report['configs'][report['best_config']]
+    print(f"best {report['best_config']}: val_loss {best['mean_val_loss']:.4f} +/- {best['std_val_loss']:.4f}, "
+          f"macro F1 {best['mean_macro_f1']:.3f}; model saved to {args.model}, report in {args.report} "
+          f"({report['seconds']['total']:.0f}s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+from overlay import hud
 
 
 def landmarks_list_to_array(landmark_list, image_shape):
@@ -45,33 +46,46 @@ def label_params(frame, params, coords):
                 cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
 
 
-def label_final_results(image, label):
-    expanded_labels = {
-        "c": "Correct Form",
-        "k": "Knee Ahead, push your butt out",
-        "h": "Back Wrongly Positioned, keep your chest up",
-        "r": "Back Wrongly Positioned, keep your chest up",
-        "x": "Correct Depth"
-    }
+def label_final_results(image, label, exercise=None):
+    # Label letters and their messages come from the exercise definition (exercises/<name>.json)
+    if exercise is None:
+        from exercise_rules import load_exercise # Imported here: exercise_rules itself uses utils
+        exercise = load_exercise('squat')
 
-    image_width, image_height, _ = image.shape
+    described_label, correct = exercise.describe_label(label)
 
-    label_list = [character for character in label]
-    described_label = list(map(lambda x: expanded_labels[x], label_list))
+    color = (42, 210, 48) if correct else (13, 13, 205)
 
-    color = (42, 210, 48) if "c" in label_list else (13, 13, 205)
-
-    cv2.rectangle(image,
-        (0, 0), (image_height, 74),
+    # Same pixels as cv2.rectangle((0, 0), (width, 74)) + cv2.putText, but the banner is
+    # rendered once per label and copied in afterwards (overlay.py)
+    hud.banner(
+        image, 75,
         color,
-        -1
-    )
-
-    cv2.putText(
-        image, "   "+" + ".join(word for word in described_label),
+        "   "+" + ".join(word for word in described_label),
         (0, 43),
-        cv2.FONT_HERSHEY_SIMPLEX,
         0.6,
         (255, 255, 255),
         2
     )
+
+
+def joint_angles(a, b, c):
+    # Vectorized calculate_angle (app_squat.py): angle at b in degrees, in [0, 180].
+    # a, b, c are (..., 2) arrays of x, y, e.g. (frames, 2) for one joint over a whole series.
+    a, b, c = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64), np.asarray(c, dtype=np.float64)
+    radians = np.arctan2(c[..., 1] - b[..., 1], c[..., 0] - b[..., 0]) \
+        - np.arctan2(a[..., 1] - b[..., 1], a[..., 0] - b[..., 0])
+    angle = np.abs(np.degrees(radians))
+    return np.where(angle > 180.0, 360.0 - angle, angle)
+
+
+def trailing_mean(values, window):
+    # Mean of the last `window` samples at every frame along axis 0 (shorter at the start),
+    # i.e. what a deque(maxlen=window) average gives frame by frame
+    values = np.asarray(values, dtype=np.float64)
+    if window <= 1 or not len(values):
+        return values
+    sums = np.cumsum(values, axis=0)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums / counts.reshape((-1,) + (1,) * (values.ndim - 1))
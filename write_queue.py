@@ -0,0 +1,233 @@
+import os
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+import traceback
+from collections import deque
+
+# Write-behind queue with a single SQLite writer thread.
+# Producers (the camera/frame loop, Dash callbacks) hand over small write operations without
+# touching the database; the writer groups whatever has queued up into one transaction, committed
+# when either the batch is large enough or the oldest pending write has waited long enough.
+# One writer connection means no `database is locked` contention between our own writers; when
+# another process holds the lock, the whole batch is retried with backoff instead of being dropped.
+# Operations that still fail are reported to their submitter through on_error(exception).
+
+DATABASE_PATH = 'theralink.db'
+
+WRITE_BATCH_MAX = int(os.environ.get('THERALINK_WRITE_BATCH', 500)) # operations per transaction
+WRITE_MAX_DELAY = float(os.environ.get('THERALINK_WRITE_DELAY', 0.25)) # seconds an operation may wait
+WRITE_MAX_PENDING = int(os.environ.get('THERALINK_WRITE_MAX_PENDING', 10000))
+WRITE_FLUSH_TIMEOUT = 10.0
+WRITE_RETRIES = int(os.environ.get('THERALINK_WRITE_RETRIES', 5)) # batch retries on SQLITE_BUSY/LOCKED
+WRITE_RETRY_BACKOFF = 0.1 # seconds before the first retry, doubled each time
+
+
+class _Flush:
+    # Marker item: set once everything queued before it has been committed
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_STOP = object()
+
+
+def _is_busy(error):
+    # SQLITE_BUSY / SQLITE_LOCKED (or an extended code of either): another connection holds the lock
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+
+class _Retry(Exception):
+    # Raised out of the batch when an operation hit a busy/locked error
+    pass
+
+
+class WriteBehindQueue:
+    def __init__(self, database_path=None, batch_max=WRITE_BATCH_MAX, max_delay=WRITE_MAX_DELAY,
+                 max_pending=WRITE_MAX_PENDING, retries=WRITE_RETRIES):
+        self.database_path = database_path or DATABASE_PATH
+        self.batch_max = batch_max
+        self.max_delay = max_delay
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._commit_latencies = deque(maxlen=1000)
+        self._counters = {'submitted': 0, 'committed': 0, 'batches': 0, 'dropped': 0, 'failed': 0,
+                          'retries': 0, 'max_depth': 0}
+
+    # --- producer side (never blocks unless asked to) ---
+    def submit(self, operation, on_commit=None, block=False, timeout=None, on_error=None):
+        # operation(cursor) runs inside the writer's transaction (again, if the batch is retried);
+        # on_commit() runs after it commits, on_error(exception) if it was rolled back for good.
+        # Returns False (and counts a drop) if the queue is full and block is False.
+        self._ensure_started()
+        try:
+            self._queue.put((operation, on_commit, on_error), block=block, timeout=timeout)
+        except queue.Full:
+            with self._metrics_lock:
+                self._counters['dropped'] += 1
+            return False
+        with self._metrics_lock:
+            self._counters['submitted'] += 1
+            self._counters['max_depth'] = max(self._counters['max_depth'], self._queue.qsize())
+        return True
+
+    def execute(self, sql, params=(), on_commit=None, block=False, on_error=None):
+        return self.submit(lambda cursor: cursor.execute(sql, params), on_commit, block, on_error=on_error)
+
+    def executemany(self, sql, rows, on_commit=None, block=False, on_error=None):
+        rows = list(rows)
+        return self.submit(lambda cursor: cursor.executemany(sql, rows), on_commit, block, on_error=on_error)
+
+    def flush(self, timeout=WRITE_FLUSH_TIMEOUT):
+        # Wait until everything submitted so far is committed (not for use on the frame loop)
+        if self._thread is None:
+            return True
+        marker = _Flush()
+        self._queue.put(marker, timeout=timeout)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout=WRITE_FLUSH_TIMEOUT):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP, timeout=timeout)
+        self._thread.join(timeout)
+        self._thread = None
+
+    # --- writer thread ---
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database_path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA busy_timeout=5000") # Other processes may still write directly
+        conn.execute("PRAGMA journal_mode=WAL") # Readers keep reading while we commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _next_batch(self, first):
+        # Collect up to batch_max items, waiting at most max_delay after the first one arrived
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_max and not isinstance(batch[-1], _Flush) and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = self._connect()
+        cursor = conn.cursor()
+        stopping = False
+        while not stopping:
+            batch = self._next_batch(self._queue.get())
+            operations = [item for item in batch if isinstance(item, tuple)]
+            stopping = batch[-1] is _STOP
+            if operations:
+                self._commit(conn, cursor, operations)
+            for item in batch:
+                if isinstance(item, _Flush):
+                    item.done.set()
+        conn.close()
+
+    def _attempt(self, conn, cursor, operations):
+        # One transaction over the batch -> (on_commit callbacks, [(on_error, exception)]).
+        # A savepoint per operation: one bad write is rolled back without losing the batch, but a
+        # busy/locked error aborts the whole attempt so the caller can retry it.
+        committed, failures = [], []
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for operation, on_commit, on_error in operations:
+                cursor.execute("SAVEPOINT op")
+                try:
+                    operation(cursor)
+                    cursor.execute("RELEASE op")
+                    committed.append(on_commit)
+                except Exception as e:
+                    if _is_busy(e):
+                        raise _Retry() from e
+                    cursor.execute("ROLLBACK TO op")
+                    cursor.execute("RELEASE op")
+                    failures.append((on_error, e))
+                    traceback.print_exc()
+            cursor.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        return committed, failures
+
+    def _commit(self, conn, cursor, operations):
+        started = time.perf_counter()
+        retries = 0
+        while True:
+            try:
+                committed, failures = self._attempt(conn, cursor, operations)
+                break
+            except (_Retry, sqlite3.Error) as e:
+                cause = e.__cause__ if isinstance(e, _Retry) else e
+                if _is_busy(cause) and retries < self.retries:
+                    # Another process holds the write lock (BEGIN IMMEDIATE / COMMIT): wait and retry
+                    time.sleep(WRITE_RETRY_BACKOFF * 2 ** retries)
+                    retries += 1
+                    continue
+                traceback.print_exception(cause)
+                committed, failures = [], [(on_error, cause) for _, _, on_error in operations]
+                break
+        elapsed = time.perf_counter() - started
+        with self._metrics_lock:
+            self._commit_latencies.append(elapsed)
+            self._counters['batches'] += 1
+            self._counters['committed'] += len(committed)
+            self._counters['failed'] += len(failures)
+            self._counters['retries'] += retries
+        for on_commit in committed:
+            if on_commit is not None:
+                try:
+                    on_commit()
+                except Exception:
+                    traceback.print_exc()
+        for on_error, error in failures:
+            if on_error is not None:
+                try:
+                    on_error(error)
+                except Exception:
+                    traceback.print_exc()
+
+    def metrics(self):
+        with self._metrics_lock:
+            latencies = sorted(self._commit_latencies)
+            counters = dict(self._counters)
+
+        def percentile(pct):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(pct / 100.0 * len(latencies)))]
+
+        counters.update({
+            'queue_depth': self._queue.qsize(),
+            'writer_running': self._thread is not None and self._thread.is_alive(),
+            'avg_batch_size': counters['committed'] / counters['batches'] if counters['batches'] else 0.0,
+            'commit_latency_p50_ms': percentile(50) * 1000,
+            'commit_latency_p95_ms': percentile(95) * 1000,
+            'commit_latency_max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+        })
+        return counters
+
+
+write_queue = WriteBehindQueue()
+atexit.register(write_queue.close) # Flush pending writes on interpreter shutdown